@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Время прохода по /proc: последовательно (как monitor.py без пула) и через
+ScanPool из scanpool.py с разным числом воркеров.
+
+    python3 benchmarks/bench_scan.py [процессов-пустышек] [новых за проход] [воркеры,…]
+
+Пустышки (sleep) раздувают таблицу процессов; «новые» запускаются перед
+каждым проходом «всплеск», чтобы замерить и сбор сведений о них.
+Ускорение от воркеров видно только на машине с несколькими CPU.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import psutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import scanpool  # noqa: E402
+
+
+def spawn(n: int) -> list:
+    return [subprocess.Popen(["sleep", "600"]) for _ in range(n)]
+
+
+def reap(procs: list) -> None:
+    for p in procs:
+        p.kill()
+    for p in procs:
+        p.wait()
+
+
+class Serial:
+    """Тот же алгоритм, что scan_new_procs + get_proc_info в monitor.py."""
+
+    def __init__(self):
+        self.known = {p.pid for p in psutil.process_iter()}
+
+    def scan(self) -> list:
+        current, new = set(), []
+        for proc in psutil.process_iter():
+            current.add(proc.pid)
+            if proc.pid not in self.known:
+                new.append(proc)
+        self.known = current
+        out = []
+        for proc in new:
+            try:
+                proc.cpu_percent(interval=0.1)
+                out.append(proc.name())
+            except psutil.Error:
+                pass
+        return out
+
+    def close(self) -> None:
+        pass
+
+
+class Pooled:
+    def __init__(self, workers: int):
+        self.pool = scanpool.ScanPool(workers)
+        self.pool.seed(self._pids())
+
+    @staticmethod
+    def _pids() -> list:
+        return [int(d) for d in os.listdir("/proc") if d.isdigit()]
+
+    def scan(self) -> list:
+        return self.pool.scan(self._pids())
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+def measure(scanner, burst: int, rounds: int) -> tuple:
+    quiet, busy = [], []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        scanner.scan()
+        quiet.append(time.perf_counter() - t0)
+        extra = spawn(burst)
+        t0 = time.perf_counter()
+        found = len(scanner.scan())
+        busy.append(time.perf_counter() - t0)
+        reap(extra)
+        scanner.scan()   # забыть завершённые
+        assert found >= burst, f"найдено {found} из {burst}"
+    return min(quiet), min(busy)
+
+
+def main() -> None:
+    filler = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    burst = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    workers = [int(w) for w in sys.argv[3].split(",")] if len(sys.argv) > 3 else [2, 4]
+    rounds = 3
+
+    sleepers = spawn(filler)
+    try:
+        total = len(psutil.pids())
+        print(f"процессов: {total}, новых за проход «всплеск»: {burst}, CPU: {os.cpu_count()}\n")
+        print(f"{'режим':<14}{'тихий, мс':>12}{'всплеск, мс':>14}")
+        for label, make in [("serial", Serial)] + [(f"pool×{w}", lambda w=w: Pooled(w)) for w in workers]:
+            scanner = make()
+            try:
+                quiet, busy = measure(scanner, burst, rounds)
+            finally:
+                scanner.close()
+            print(f"{label:<14}{quiet * 1000:>12.1f}{busy * 1000:>14.1f}")
+    finally:
+        reap(sleepers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Сравнение формата wire.py с JSON на пачках событий «новый процесс».
+
+    python3 benchmarks/bench_wire.py [событий в пачке] [пачек]
+
+События синтетические, но похожи на реальные: несколько десятков имён
+с разными пользователями, юнитами и контейнерами, pid и время идут подряд.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import wire  # noqa: E402
+
+NAMES = [("nginx", "/usr/sbin/nginx", "www-data", "nginx.service", ""),
+         ("python3", "/usr/bin/python3.11", "app", "", "web"),
+         ("sh", "/usr/bin/dash", "root", "cron.service", ""),
+         ("postgres", "/usr/lib/postgresql/15/bin/postgres", "postgres", "postgresql@15-main.service", ""),
+         ("node", "/usr/local/bin/node", "node", "", "frontend"),
+         ("curl", "/usr/bin/curl", "root", "", ""),
+         ("systemd-tmpfile", "/usr/bin/systemd-tmpfiles", "root", "systemd-tmpfiles-clean.service", "")]
+NAMES += [(f"worker-{i}", f"/opt/jobs/bin/worker-{i}", "jobs", "jobs.service", "") for i in range(30)]
+
+
+def make_events(n: int, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    now, pid = time.time(), 40000
+    events = []
+    for _ in range(n):
+        name, exe, user, unit, ctr = rnd.choice(NAMES)
+        pid += rnd.randint(1, 5)
+        now += rnd.random() * 0.01
+        events.append({
+            "pid": pid, "name": name, "exe": exe,
+            "cmdline": f"{exe} --config /etc/{name}/{name}.conf --worker {rnd.randint(1, 8)}",
+            "username": user,
+            "create_time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)),
+            "create_ts": round(now, 2), "status": "running",
+            "cpu": round(rnd.random() * 30, 1), "memory_mb": round(rnd.random() * 500, 1),
+            "cgroup": f"/system.slice/{unit}" if unit else (f"/docker/{ctr}" if ctr else ""),
+            "unit": unit, "container": ctr, "container_id": "", "runtime": "docker" if ctr else "",
+        })
+    return events
+
+
+def bench(label: str, enc, dec, batches: list) -> None:
+    t0 = time.perf_counter()
+    frames = [enc(b) for b in batches]
+    t1 = time.perf_counter()
+    for f in frames:
+        dec(f)
+    t2 = time.perf_counter()
+    n = sum(len(b) for b in batches)
+    size = sum(len(f) for f in frames)
+    print(f"{label:<14}{size / n:>9.1f}{n / (t1 - t0):>14,.0f}{n / (t2 - t1):>14,.0f}")
+
+
+def main() -> None:
+    per = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    batches = [make_events(per, seed) for seed in range(count)]
+
+    # проверка круговой совместимости до замеров
+    back = wire.decode(wire.encode(batches[0]))
+    for a, b in zip(batches[0], back):
+        assert (a["pid"], a["name"], a["cmdline"], a["unit"]) == (b["pid"], b["name"], b["cmdline"], b["unit"])
+        assert abs(a["create_ts"] - b["create_ts"]) < 0.001 and abs(a["cpu"] - b["cpu"]) < 0.051
+
+    print(f"пачек: {count} × {per} событий\n")
+    print(f"{'формат':<14}{'байт/соб.':>9}{'encode, соб/с':>14}{'decode, соб/с':>14}")
+    bench("json", lambda b: json.dumps(b).encode(), json.loads, batches)
+    bench("json+zlib", lambda b: zlib.compress(json.dumps(b).encode(), 1),
+          lambda f: json.loads(zlib.decompress(f)), batches)
+    bench("wire", lambda b: wire.encode(b, compress=False), wire.decode, batches)
+    bench("wire+zlib", wire.encode, wire.decode, batches)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,556 @@
+"""
+Хранилище истории процессов для Process Monitor Pro.
+
+На каждое имя процесса — одна запись:
+  raw  — сырые события за последние сутки, по столбцам (ts, pid, cpu, mem, usr, tag);
+         tag — происхождение события: у записи процесса это «ctr:…»/«unit:…»,
+         у записи группы (юнит/контейнер) — имя процесса
+  m/h/d — агрегаты по минутам, часам и суткам:
+          [начало бакета, count, cpu_sum, cpu_max, mem_sum, mem_max]
+Агрегаты обновляются инкрементально при каждой записи, старые данные
+удаляются по времени (prune), так что память и размер stats.json
+ограничены независимо от частоты событий.
+
+Модуль не зависит от бота: его используют monitor.py и офлайн-утилиты.
+"""
+
+import csv
+import json
+import re
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Iterable, Iterator, Tuple
+
+try:
+    import numpy as np
+except ImportError:   # numpy необязателен: без него агрегаты считаются на чистом Python
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:   # pyarrow необязателен: без него экспорт в .npz или CSV
+    pa = pq = None
+
+RAW_RETENTION = 24 * 3600    # сырые события — сутки
+RAW_MAX       = 5000         # и не больше стольких на имя (защита от «штормов»)
+MAX_NAMES     = 20000        # имён в хранилище; лишние вытесняются по давности
+
+# (ключ, ширина бакета в секундах, срок хранения в секундах)
+TIERS = (
+    ("m", 60,    2 * 86400),
+    ("h", 3600,  45 * 86400),
+    ("d", 86400, 400 * 86400),
+)
+
+COLUMNS     = ("ts", "pid", "cpu", "mem", "usr", "tag")
+STR_COLUMNS = ("usr", "tag")
+TIER_COLUMNS = ("start", "count", "cpu_sum", "cpu_max", "mem_sum", "mem_max")
+
+# индексы в строке агрегата
+B_START, B_COUNT, B_CPU_SUM, B_CPU_MAX, B_MEM_SUM, B_MEM_MAX = range(6)
+
+
+def new_entry() -> Dict:
+    entry = {"n": 0, "first": None, "last": None, "raw": {c: [] for c in COLUMNS}}
+    for key, _, _ in TIERS:
+        entry[key] = []
+    return entry
+
+
+def _rollup(rows: List[List[float]], ts: float, width: int, cpu: float, mem: float) -> None:
+    start = int(ts // width * width)
+    if rows and rows[-1][B_START] == start:
+        row = rows[-1]
+    elif not rows or rows[-1][B_START] < start:
+        rows.append([start, 0, 0.0, 0.0, 0.0, 0.0])
+        row = rows[-1]
+    else:
+        # событие из прошлого (часы, запоздавший агент) — редкий путь
+        i = bisect_left([r[B_START] for r in rows], start)
+        if i == len(rows) or rows[i][B_START] != start:
+            rows.insert(i, [start, 0, 0.0, 0.0, 0.0, 0.0])
+        row = rows[i]
+    row[B_COUNT]   += 1
+    row[B_CPU_SUM] += cpu
+    row[B_MEM_SUM] += mem
+    if cpu > row[B_CPU_MAX]:
+        row[B_CPU_MAX] = cpu
+    if mem > row[B_MEM_MAX]:
+        row[B_MEM_MAX] = mem
+
+
+def record(entry: Dict, ts: float, pid: int, cpu: float, mem: float, usr: str,
+           tag: str = "") -> None:
+    raw = entry["raw"]
+    values = (ts, pid, cpu, mem, usr, tag)   # в порядке COLUMNS
+    if not raw["ts"] or raw["ts"][-1] <= ts:
+        for col, value in zip(COLUMNS, values):
+            raw[col].append(value)
+    else:
+        # create_ts приходит не по порядку (PID, агенты, журнал) — raw держим
+        # отсортированным: на нём bisect в prune и запросах
+        i = bisect_right(raw["ts"], ts)
+        for col, value in zip(COLUMNS, values):
+            raw[col].insert(i, value)
+    # обрезаем пачкой, чтобы не сдвигать списки на каждом событии
+    if len(raw["ts"]) > RAW_MAX + RAW_MAX // 10:
+        for col in COLUMNS:
+            del raw[col][:-RAW_MAX]
+    entry["n"] += 1
+    if entry["first"] is None or ts < entry["first"]:
+        entry["first"] = ts
+    if entry["last"] is None or ts > entry["last"]:
+        entry["last"] = ts
+    for key, width, _ in TIERS:
+        _rollup(entry[key], ts, width, cpu, mem)
+
+
+def prune(entry: Dict, now: Optional[float] = None) -> bool:
+    """Удалить данные старше срока хранения. True — запись опустела."""
+    now = now or time.time()
+    raw = entry["raw"]
+    cut = bisect_left(raw["ts"], now - RAW_RETENTION)
+    if cut:
+        for col in COLUMNS:
+            del raw[col][:cut]
+    empty = not raw["ts"]
+    for key, _, keep in TIERS:
+        rows = entry[key]
+        i = bisect_left([r[B_START] for r in rows], now - keep)
+        if i:
+            del rows[:i]
+        empty = empty and not rows
+    return empty
+
+
+def prune_all(store: Dict[str, Dict], now: Optional[float] = None) -> int:
+    """Чистка всего хранилища; возвращает число удалённых имён."""
+    now = now or time.time()
+    dead = [name for name, entry in list(store.items()) if prune(entry, now)]
+    if len(store) - len(dead) > MAX_NAMES:
+        gone  = set(dead)
+        alive = sorted((e["last"] or 0, n) for n, e in list(store.items()) if n not in gone)
+        dead += [n for _, n in alive[:len(alive) - MAX_NAMES]]
+    for name in dead:
+        store.pop(name, None)
+    return len(dead)
+
+
+def count_since(entry: Dict, since: float) -> int:
+    """Число событий начиная с since по самому подробному подходящему уровню."""
+    raw_ts = entry["raw"]["ts"]
+    if raw_ts and raw_ts[0] <= since:
+        return len(raw_ts) - bisect_left(raw_ts, since)
+    # данных меньше, чем запрошено, — _pick_tier берёт уровень, где они есть целиком
+    key, width = _pick_tier(entry, since)
+    rows = entry[key]
+    i = bisect_left([r[B_START] for r in rows], since // width * width)
+    return int(sum(r[B_COUNT] for r in rows[i:]))
+
+
+def _parse_legacy_ts(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+def migrate(data: Dict) -> Dict[str, Dict]:
+    """Привести stats.json к текущему формату (старый — список событий на имя)."""
+    store: Dict[str, Dict] = {}
+    for name, value in (data or {}).items():
+        if isinstance(value, dict) and "raw" in value:
+            raw = value["raw"]
+            for col in COLUMNS:   # столбцы, добавленные позже
+                raw.setdefault(col, [""] * len(raw["ts"]))
+            ts = raw["ts"]
+            if any(ts[k] > ts[k + 1] for k in range(len(ts) - 1)):
+                # файл записан версией, которая дописывала события как пришли
+                order = sorted(range(len(ts)), key=ts.__getitem__)
+                for col in COLUMNS:
+                    raw[col] = [raw[col][k] for k in order]
+            store[name] = value
+            continue
+        entry = new_entry()
+        events: Iterable[Dict] = value if isinstance(value, list) else []
+        for ev in events:
+            record(entry, _parse_legacy_ts(ev.get("ts")), ev.get("pid", 0),
+                   ev.get("cpu", 0.0), ev.get("mem", 0.0), ev.get("usr", "?"))
+        store[name] = entry
+    return store
+
+
+# ─────────────────────────────────────────────
+#  ЗАПРОСЫ
+# ─────────────────────────────────────────────
+_REL_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+_REL_RE    = re.compile(r"^(\d+(?:\.\d+)?)([mhdw])$")
+_ABS_FORMATS = ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S", "%H:%M")
+
+
+def parse_time(value: str, now: Optional[float] = None) -> float:
+    """'now', '90m', '24h', '7d', '2w', '2024-05-01', '2024-05-01T10:00', '10:00' → epoch."""
+    now = now or time.time()
+    value = value.strip().lower()
+    if value == "now":
+        return now
+    m = _REL_RE.match(value)
+    if m:
+        return now - float(m.group(1)) * _REL_UNITS[m.group(2)]
+    for fmt in _ABS_FORMATS:
+        try:
+            dt = datetime.strptime(value.upper(), fmt)
+        except ValueError:
+            continue
+        if fmt == "%H:%M":
+            dt = datetime.fromtimestamp(now).replace(hour=dt.hour, minute=dt.minute,
+                                                     second=0, microsecond=0)
+        return dt.timestamp()
+    raise ValueError(f"не понимаю время: {value}")
+
+
+def _percentiles(values: List[float]) -> Tuple[float, float, float, float]:
+    """(p50, p95, max, mean) с линейной интерполяцией — как numpy.percentile."""
+    if np is not None:
+        arr = np.asarray(values, dtype=float)
+        p50, p95 = np.percentile(arr, (50, 95))
+        return float(p50), float(p95), float(arr.max()), float(arr.mean())
+    vals = sorted(values)
+    last = len(vals) - 1
+
+    def pct(q: float) -> float:
+        pos = last * q
+        lo  = int(pos)
+        hi  = min(lo + 1, last)
+        return vals[lo] + (vals[hi] - vals[lo]) * (pos - lo)
+
+    return pct(0.5), pct(0.95), vals[-1], sum(vals) / len(vals)
+
+
+def _np_breakdown(values) -> List[Tuple[str, int]]:
+    """[(значение, число)] по убыванию, без пустых значений."""
+    names, counts = np.unique(values.astype(str), return_counts=True)
+    return sorted(((k, v) for k, v in zip(names.tolist(), counts.tolist()) if k),
+                  key=lambda x: -x[1])
+
+
+def _query_raw(raw: Dict[str, list], since: float, until: float,
+               user: Optional[str]) -> Dict:
+    # снимок длины: параллельная запись дописывает ts раньше остальных столбцов
+    n    = min(len(raw[c]) for c in COLUMNS)
+    ts   = raw["ts"][:n]
+    i, j = bisect_left(ts, since), bisect_right(ts, until)
+    cols = {c: raw[c][i:j] for c in COLUMNS}
+    if np is not None and cols["ts"]:
+        arr = {c: np.asarray(v, dtype=object if c in STR_COLUMNS else float)
+               for c, v in cols.items()}
+        if user is not None:
+            mask = arr["usr"] == user
+            arr  = {c: v[mask] for c, v in arr.items()}
+        users, tags = (_np_breakdown(arr[c]) for c in STR_COLUMNS)
+        hours = np.bincount(((arr["ts"] - since) // 3600).astype(int)) if len(arr["ts"]) else []
+        peak  = int(hours.max()) if len(hours) else 0
+        cols  = {c: v.tolist() for c, v in arr.items()}
+    else:
+        if user is not None:
+            keep = [k for k, u in enumerate(cols["usr"]) if u == user]
+            cols = {c: [v[k] for k in keep] for c, v in cols.items()}
+        users, tags = ([(k, v) for k, v in Counter(cols[c]).most_common() if k]
+                       for c in STR_COLUMNS)
+        hours = Counter(int((t - since) // 3600) for t in cols["ts"])
+        peak  = max(hours.values()) if hours else 0
+    rows = list(zip(*(cols[c] for c in COLUMNS)))
+    rows.reverse()
+    count = len(rows)
+    return {
+        "source": "raw",
+        "count":  count,
+        "cpu":    _percentiles(cols["cpu"]) if count else None,
+        "mem":    _percentiles(cols["mem"]) if count else None,
+        "peak":   peak,
+        "users":  users,
+        "tags":   tags,
+        "rows":   rows,     # строки по COLUMNS, новые первыми
+    }
+
+
+def _query_tier(rows: List[list], width: int, since: float, until: float) -> Dict:
+    starts = [r[B_START] for r in rows]
+    sel    = rows[bisect_left(starts, since // width * width):bisect_right(starts, until)]
+    if np is not None and sel:
+        arr    = np.asarray(sel, dtype=float)
+        count  = int(arr[:, B_COUNT].sum())
+        cpu    = (None, None, float(arr[:, B_CPU_MAX].max()), float(arr[:, B_CPU_SUM].sum()) / count)
+        mem    = (None, None, float(arr[:, B_MEM_MAX].max()), float(arr[:, B_MEM_SUM].sum()) / count)
+        if width <= 3600:
+            hour_idx = (arr[:, B_START] // 3600).astype(np.int64)
+            hour_idx -= hour_idx.min()
+            peak = int(np.bincount(hour_idx, weights=arr[:, B_COUNT]).max())
+        else:
+            peak = None
+    else:
+        count = int(sum(r[B_COUNT] for r in sel))
+        cpu = mem = None
+        if count:
+            cpu = (None, None, max(r[B_CPU_MAX] for r in sel), sum(r[B_CPU_SUM] for r in sel) / count)
+            mem = (None, None, max(r[B_MEM_MAX] for r in sel), sum(r[B_MEM_SUM] for r in sel) / count)
+        peak = None
+        if width <= 3600 and sel:
+            hours: Counter = Counter()
+            for r in sel:
+                hours[int(r[B_START] // 3600)] += r[B_COUNT]
+            peak = int(max(hours.values()))
+    return {
+        "source": width,
+        "count":  count,
+        "cpu":    cpu if count else None,
+        "mem":    mem if count else None,
+        "peak":   peak,
+        "users":  [],
+        "tags":   [],
+        "rows":   [tuple(r) for r in reversed(sel)],   # строки агрегата, новые первыми
+    }
+
+
+def _raw_covers(entry: Dict, since: float) -> bool:
+    """Сырые события покрывают интервал от since (или вообще всё, что было)."""
+    raw_ts = entry["raw"]["ts"]
+    return bool(raw_ts) and (raw_ts[0] <= since or (entry["first"] or 0) >= raw_ts[0])
+
+
+def _pick_tier(entry: Dict, since: float) -> Tuple[str, int]:
+    """Самый подробный уровень агрегатов, доживший до since или до первого события
+    записи, если она моложе интервала (иначе — самый длинный)."""
+    since = max(since, entry["first"] or since)
+    for key, width, _ in TIERS:
+        if entry[key] and entry[key][0][B_START] <= since:
+            return key, width
+    return TIERS[-1][0], TIERS[-1][1]
+
+
+def query(entry: Dict, since: float, until: float, user: Optional[str] = None) -> Dict:
+    """Сводка по записи за [since, until].
+
+    Пока сырые события покрывают интервал — считаем по ним (перцентили,
+    разбивка по пользователям, фильтр user). Иначе берём самый подробный
+    уровень агрегатов, доживший до since: там есть только сумма, среднее и
+    максимум, а фильтр по пользователю недоступен (source != "raw").
+    """
+    raw_ts = entry["raw"]["ts"]
+    if _raw_covers(entry, since):
+        res = _query_raw(entry["raw"], since, until, user)
+    elif user is not None:
+        since = max(since, raw_ts[0]) if raw_ts else since
+        res = _query_raw(entry["raw"], since, until, user)
+        res["truncated"] = True
+    else:
+        key, width = _pick_tier(entry, since)
+        res = _query_tier(entry[key], width, since, until)
+    hours = max((until - since) / 3600, 1 / 60)
+    res.update(since=since, until=until, user=user, rate=res["count"] / hours)
+    return res
+
+
+def count_between(entry: Dict, since: float, until: float) -> int:
+    """Число событий за [since, until] — как query()["count"], без разбора строк."""
+    if _raw_covers(entry, since):
+        ts = entry["raw"]["ts"]
+        return bisect_right(ts, until) - bisect_left(ts, since)
+    key, width = _pick_tier(entry, since)
+    rows = entry[key]
+    starts = [r[B_START] for r in rows]
+    sel = rows[bisect_left(starts, since // width * width):bisect_right(starts, until)]
+    return int(sum(r[B_COUNT] for r in sel))
+
+
+def timeline(entry: Dict, since: float, until: float, width: int) -> Tuple[int, List[list]]:
+    """Бакеты по width секунд за [since, until] в формате строк агрегатов.
+    Возвращает (фактическая ширина, строки): не подробнее уровня, с которого взяты данные."""
+    rows: List[list] = []
+    if _raw_covers(entry, since):
+        raw = entry["raw"]
+        n = min(len(raw[c]) for c in COLUMNS)
+        ts = raw["ts"][:n]
+        for k in range(bisect_left(ts, since), bisect_right(ts, until)):
+            _rollup(rows, ts[k], width, raw["cpu"][k], raw["mem"][k])
+        return width, rows
+    key, tier_width = _pick_tier(entry, since)
+    width = max(width, tier_width)
+    src = entry[key]
+    starts = [r[B_START] for r in src]
+    for r in src[bisect_left(starts, since // tier_width * tier_width):bisect_right(starts, until)]:
+        start = int(r[B_START] // width * width)
+        if not rows or rows[-1][B_START] != start:
+            rows.append([start, 0, 0.0, 0.0, 0.0, 0.0])
+        row = rows[-1]
+        row[B_COUNT]   += r[B_COUNT]
+        row[B_CPU_SUM] += r[B_CPU_SUM]
+        row[B_MEM_SUM] += r[B_MEM_SUM]
+        row[B_CPU_MAX] = max(row[B_CPU_MAX], r[B_CPU_MAX])
+        row[B_MEM_MAX] = max(row[B_MEM_MAX], r[B_MEM_MAX])
+    return width, rows
+
+
+# ─────────────────────────────────────────────
+#  ПОТОКОВОЕ ЧТЕНИЕ
+# ─────────────────────────────────────────────
+STREAM_CHUNK = 1 << 20   # символов за одно чтение
+
+
+def iter_store(path: str) -> Iterator[Tuple[str, Dict]]:
+    """(имя, запись) из stats.json по одной — без загрузки файла целиком.
+
+    Верхний уровень разбирается вручную, каждая запись — json (на C);
+    в памяти одновременно одна запись и буфер чтения. Записи старого
+    формата приводятся к текущему, как в migrate.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+
+        def more(need: int) -> None:
+            nonlocal buf, pos, eof
+            data = f.read(max(STREAM_CHUNK, need))
+            eof = not data
+            buf, pos = buf[pos:] + data, 0
+
+        def token() -> str:
+            """Следующий значащий символ (без сдвига позиции)."""
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                if eof:
+                    raise ValueError(f"{path}: неожиданный конец файла")
+                more(0)
+
+        def value():
+            nonlocal pos
+            token()
+            need = 0
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    # запись не поместилась в буфер: дочитываем, каждый раз вдвое больше
+                    need = max(need * 2, len(buf) - pos)
+                    more(need)
+                    continue
+                if end == len(buf) and not eof and not isinstance(obj, (dict, list, str)):
+                    more(0)   # число могло оборваться на границе буфера
+                    continue
+                pos = end
+                return obj
+
+        if token() != "{":
+            raise ValueError(f"{path}: ожидался объект JSON")
+        pos += 1
+        if token() == "}":
+            return
+        while True:
+            name = value()
+            if token() != ":":
+                raise ValueError(f"{path}: ожидалось «:» после {name!r}")
+            pos += 1
+            entry = value()
+            yield from migrate({name: entry}).items()
+            sep = token()
+            pos += 1
+            if sep == "}":
+                return
+            if sep != ",":
+                raise ValueError(f"{path}: ожидалась «,» после {name!r}")
+
+
+# ─────────────────────────────────────────────
+#  СТОЛБЦОВЫЙ ЭКСПОРТ
+#  Столбцы собираются срезами из хранимых списков (raw) или строк
+#  агрегатов — без словаря на событие. Строки (имя, user, tag) кодируются
+#  словарём: уникальные значения + индексы int32.
+#    parquet — pyarrow, строковые столбцы как dictionary
+#    npz     — numpy: <столбец> и для строк <столбец>_values, без pickle
+#    csv     — если нет ни того, ни другого
+# ─────────────────────────────────────────────
+EXPORT_FORMATS = ("parquet", "npz", "csv")
+
+
+def export_formats() -> List[str]:
+    """Доступные форматы экспорта, лучший первым."""
+    have = {"parquet": pa is not None, "npz": np is not None, "csv": True}
+    return [f for f in EXPORT_FORMATS if have[f]]
+
+
+def collect_columns(items: Iterable[Tuple[str, Dict]], level: str = "raw",
+                    since: float = 0.0, until: float = float("inf")) -> Dict[str, list]:
+    """Столбцы «name» + COLUMNS (level="raw") или «name» + TIER_COLUMNS (m/h/d)."""
+    names = COLUMNS if level == "raw" else TIER_COLUMNS
+    cols: Dict[str, list] = {"name": [], **{c: [] for c in names}}
+    width = {key: w for key, w, _ in TIERS}.get(level)
+    for name, entry in items:
+        if level == "raw":
+            raw = entry["raw"]
+            n = min(len(raw[c]) for c in COLUMNS)
+            ts = raw["ts"][:n]
+            lo, hi = bisect_left(ts, since), bisect_right(ts, until)
+            for c in COLUMNS:
+                cols[c].extend(raw[c][lo:hi])
+            count = hi - lo
+        else:
+            rows = entry[level]
+            starts = [r[B_START] for r in rows]
+            sel = rows[bisect_left(starts, since // width * width):bisect_right(starts, until)]
+            for k, c in enumerate(TIER_COLUMNS):
+                cols[c].extend(r[k] for r in sel)
+            count = len(sel)
+        cols["name"].extend([name] * count)
+    return cols
+
+
+def _dict_encode(values: List[str]) -> Tuple[List[str], List[int]]:
+    index: Dict[str, int] = {}
+    codes = [index.setdefault(v, len(index)) for v in values]
+    return list(index), codes
+
+
+def write_columns(cols: Dict[str, list], path: str, fmt: str) -> int:
+    """Записать столбцы в файл; возвращает число строк."""
+    rows = len(cols["name"])
+    str_cols = [c for c in cols if c == "name" or c in STR_COLUMNS]
+    if fmt == "parquet":
+        data = {}
+        for c, v in cols.items():
+            if c in str_cols:
+                uniq, codes = _dict_encode(v)
+                data[c] = pa.DictionaryArray.from_arrays(pa.array(codes, pa.int32()),
+                                                         pa.array(uniq, pa.string()))
+            else:
+                data[c] = pa.array(v, pa.int64() if c in ("pid", "start", "count") else pa.float64())
+        pq.write_table(pa.table(data), path, compression="zstd")
+    elif fmt == "npz":
+        arrays = {}
+        for c, v in cols.items():
+            if c in str_cols:
+                uniq, codes = _dict_encode(v)
+                arrays[c] = np.asarray(codes, dtype=np.int32)
+                arrays[c + "_values"] = np.asarray(uniq, dtype=str)
+            else:
+                arrays[c] = np.asarray(v, dtype=np.int64 if c in ("pid", "start", "count") else np.float64)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+    elif fmt == "csv":
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(list(cols))
+            w.writerows(zip(*cols.values()))
+    else:
+        raise ValueError(f"неизвестный формат {fmt}")
+    return rows
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Process Monitor Pro — профессиональный Telegram-бот мониторинга процессов
-Версия 2.0
+Версия 2.1
 """
 
 import subprocess
@@ -15,26 +15,55 @@ def _install_deps():
         try:
             __import__(pkg)
         except ImportError:
-            subprocess.check_call([sys.executable, "-m", "pip", "install", pkg, "--quiet"])
+            subprocess.check_call([sys.executable, "-m", "pip", "install", pkg,
+                                   "--quiet", "--break-system-packages"])
 
 _install_deps()
 
 import psutil
 import requests
 import time
+import heapq
 import json
 import socket
+import gzip
+import queue
+import shutil
 import logging
-from datetime import datetime
-from typing import Optional, Dict, List, Set, Any
+import hmac
+import base64
+import hashlib
+import html
+import math
+import pwd
+import re
+import select
+import selectors
+import signal
+import struct
+import secrets
+import tempfile
+import logging.handlers
+import argparse
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, List, Set, Any, Tuple, Callable, Iterable
 from threading import Thread, Lock, Event
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict, Counter
+
+import history
+import wire
+import scanpool
+import ringbuf
 
 # ─────────────────────────────────────────────
 #  КОНФИГУРАЦИЯ — измени токен здесь
 # ─────────────────────────────────────────────
 TELEGRAM_TOKEN = "TOKEN"
 CHECK_INTERVAL  = 5          # секунд между проверками процессов
+FLUSH_INTERVAL  = 5          # секунд между проходами отправки сгруппированных уведомлений
 BASE_DIR        = "/root/Desktop/process-monitor"
 LOG_FILE        = f"{BASE_DIR}/monitor.log"
 
@@ -44,6 +73,131 @@ USERS_FILE    = f"{BASE_DIR}/active_users.json"
 SETTINGS_FILE = f"{BASE_DIR}/user_settings.json"
 WHITELIST_FILE= f"{BASE_DIR}/whitelist.json"
 STATS_FILE    = f"{BASE_DIR}/stats.json"
+GROUPS_FILE   = f"{BASE_DIR}/group_stats.json"  # статистика по юнитам и контейнерам
+JOURNAL_FILE  = f"{BASE_DIR}/outbox.journal"   # журнал неотправленных уведомлений
+ANOMALY_FILE  = f"{BASE_DIR}/anomaly.json"     # состояние детектора аномалий
+DIGEST_FILE   = f"{BASE_DIR}/digest.json"      # счётчики дайджестов и известные бинарники
+CB_TOKENS_FILE= f"{BASE_DIR}/callback_tokens.json"   # длинные callback_data, спрятанные за токеном
+
+JOURNAL_COMPACT_BYTES = 1024**2   # перезаписывать журнал, когда он больше
+JOURNAL_MAX_ATTEMPTS  = 5         # попыток отправки, после — уведомление отбрасывается
+JOURNAL_KEEP_ACKED    = 2000      # последних подтверждённых id для дедупликации
+
+# ─── списки игнорируемых / белый список ───
+LIST_PAGE        = 8       # имён на странице /list
+LIST_BLOCK       = 512     # размер блока отсортированного списка (делится при 2×)
+LIST_LOG_COMPACT = 1000    # изменений в журнале списка до перезаписи JSON-снимка
+
+# ─── cgroup / контейнеры / systemd-юниты ───
+CGROUP_CACHE_MAX = 4096                 # разных cgroup в кэше (LRU)
+DOCKER_ROOT      = "/var/lib/docker"    # откуда брать имена docker-контейнеров
+
+# ─── параллельный скан (очень большие хосты) ───
+SCAN_WORKERS      = 0        # подпроцессов scanpool.py: 0 — авто (по числу CPU, до 4), 1 — выкл
+SCAN_PARALLEL_MIN = 20000    # процессов на хосте, с которых скан идёт параллельно
+
+# ─── сканер в отдельном процессе (--scan-process) ───
+SCAN_PROCESS        = False  # True — скан в дочернем процессе: бот (GIL, сохранения) его не тормозит
+SCANNER_STALL       = 30     # сек без кадров от сканера (больше CHECK_INTERVAL) — перезапуск
+SCANNER_RESTART_MAX = 60     # сек — потолок паузы между перезапусками
+
+# ─── кольцевой буфер последних событий (/recent, pmctl.py tail) ───
+RING_FILE   = ringbuf.DEFAULT_PATH    # пусто — выключен
+RING_SLOTS  = ringbuf.DEFAULT_SLOTS   # событий в буфере (по 256 байт, память не растёт)
+RECENT_SHOW = 20                      # строк в ответе /recent
+
+# ─── запись потока событий (--record) и воспроизведение (--replay) ───
+RECORD_FILE = ""             # непусто — дописывать новые процессы в этот файл (формат wire)
+
+# ─── агент / коллектор: несколько серверов — один бот ───
+# Адрес — "unix:/путь/к/сокету" или "хост:порт". Те же значения задаются
+# ключами --agent / --collector / --host при запуске.
+AGENT_COLLECTOR  = ""        # непусто — запуск агентом: только сканер, события — сюда
+COLLECTOR_LISTEN = ""        # непусто — принимать события агентов на этом адресе
+AGENT_SECRET     = ""        # общий секрет агентов и коллектора (обязателен для TCP-адреса)
+HOST_NAME        = socket.gethostname()   # имя хоста в событиях агента
+AGENT_BATCH_MAX  = 500       # событий в одной пачке агента
+AGENT_WIRE       = True      # пачки в двоичном формате wire.py (False — JSON)
+AGENT_BUFFER     = 20000     # событий, которые агент держит, пока коллектор недоступен
+AGENT_HEARTBEAT  = 30        # пустая пачка раз в N сек, если событий не было
+AGENT_RETRY_MAX  = 60        # максимальная пауза между попытками подключения, сек
+COLLECTOR_QUEUE  = 1000      # пачек в очереди коллектора; больше — агент ждёт
+COLLECTOR_LINE_MAX = 8 * 1024**2   # предел строки протокола (защита от мусора)
+
+# ─── HTTP-эндпоинт метрик (формат Prometheus) ───
+METRICS_ENABLED = True
+METRICS_HOST    = "127.0.0.1"   # слушаем только локально
+METRICS_PORT    = 9108
+
+# ─── webhook вместо long polling (WEBHOOK_URL пуст — polling) ───
+POLL_RETRY_MAX = 60             # сек — потолок паузы между getUpdates после ошибок
+WEBHOOK_URL    = ""             # публичный https-адрес, например https://bot.example.com/tg-webhook
+WEBHOOK_LISTEN = "127.0.0.1"    # где слушает встроенный HTTP-сервер (за nginx/caddy)
+WEBHOOK_PORT   = 8443
+WEBHOOK_PATH   = "/tg-webhook"
+WEBHOOK_SECRET = ""             # X-Telegram-Bot-Api-Secret-Token; пусто — генерируется при старте
+WEBHOOK_MAX_BODY = 1024**2
+
+# ─── слежение за ресурсами процессов после запуска ───
+SAMPLE_INTERVAL    = 10      # сек между замерами отслеживаемых процессов
+SAMPLE_MAX_TRACKED = 1000    # максимум одновременно отслеживаемых процессов
+SAMPLE_SUSTAIN     = 3       # столько замеров подряд выше порога → алерт
+SERIES_BUCKET      = 60      # сек на одну точку временного ряда
+SERIES_POINTS      = 180     # точек на имя процесса (3 ч при SERIES_BUCKET=60)
+SERIES_MAX_NAMES   = 2000
+
+# ─── учёт ресурсов по пользователям / юнитам / именам (/top) ───
+TOP_WINDOW = 3600            # сек, окно суммирования
+TOP_BUCKET = 60              # сек на бакет окна
+TOP_ROWS   = 5               # строк на раздел в /top (в развёрнутом виде — втрое больше)
+
+# ─── дайджесты (сводки раз в сутки / неделю) ───
+DIGEST_MAX_ITEMS = 20        # строк в каждом списке дайджеста (новые бинарники, аномалии, порты)
+DIGEST_MAX_NAMES = 1000      # разных имён в счётчике запусков за период
+DIGEST_MAX_EXES  = 100000    # известных бинарников
+
+# ─── слежение за слушающими портами ───
+PORTS_INTERVAL = 5           # сек между снимками /proc/net
+PORTS_CONFIRM  = 2           # снимков подряд, чтобы новый порт считался открытым
+                             # (отсекает короткоживущие UDP-сокеты клиентов)
+PORTS_MAX_LINES = 25         # строк с портами в /status и в одном уведомлении
+
+# ─── детектор аномалий (режим 🧠 Умный) ───
+ANOMALY_MAX_NAMES   = 50000   # имён в памяти детектора (LRU)
+ANOMALY_WARMUP      = 600     # сек после старта без сигналов «новое имя»
+ANOMALY_MIN_EVENTS  = 20      # событий по имени до оценки частоты и выбросов
+ANOMALY_RATE_FACTOR = 50      # запуски в N раз чаще обычного → аномалия
+ANOMALY_Z           = 4.0     # порог z-score для CPU/RAM
+ANOMALY_COOLDOWN    = 3600    # сек между сигналами по одному имени
+ANOMALY_ALPHA_SLOW  = 0.05    # вес EWMA «обычного» поведения
+ANOMALY_ALPHA_FAST  = 0.3     # вес EWMA текущей частоты запусков
+
+# ─── callback_data (лимит Telegram — 64 байта) ───
+CB_MAX_BYTES  = 64
+CB_TOKENS_MAX = 5000         # токенов длинных callback_data в памяти и на диске (LRU)
+
+# ─── рассылка одного уведомления во многие чаты ───
+SEND_WORKERS = 8             # одновременных отправок
+SEND_RATE    = 25            # сообщений в секунду на всех чатах (лимит Bot API — около 30/с)
+
+# ─── экраны меню: кэш отрисовки и склейка правок ───
+RENDER_TTL     = 2.0         # сек — повторное нажатие на тяжёлый экран (статус, топ) берёт готовый текст
+EDIT_COALESCE  = 1.0         # сек — правки одного сообщения чаще этого склеиваются в одну (последнюю)
+EDIT_CACHE_MAX = 4096        # сообщений, для которых помним хэш последней правки (LRU)
+
+# ─── /history ───
+HIST_PAGE      = 10          # строк на странице
+HIST_CACHE_TTL = 900         # сек, сколько живёт результат запроса для листания
+
+# ─── /export — столбцовая выгрузка истории файлом ───
+EXPORT_MAX_BYTES = 50 * 1024**2   # лимит Bot API на отправку файла; больше — через pmctl.py export
+
+# ─── администраторы (chat_id) — доступ к /perf ───
+ADMIN_IDS: Set[str] = set()
+PERF_WINDOW      = 2048      # последних замеров на операцию для p50/p95/p99
+PROFILE_MAX_SECS = 60        # максимальная длительность /perf prof
+PERF_ROUTES      = 8         # самых медленных маршрутов (по p95) в /perf
+PROFILE_INTERVAL = 0.005     # период сэмплирования стеков, сек
 
 # ─── системные процессы (игнорируются по умолчанию) ───
 DEFAULT_SYSTEM = {
@@ -67,35 +221,665 @@ DEFAULT_SETTINGS: Dict[str, Any] = {
     "min_cpu_percent": 0.0,
     "min_memory_mb":  0.0,
     "track_stats": True,
+    "notify_ports": True,         # уведомлять об открытии/закрытии портов
+    "digest": "off",              # off | daily | weekly
+    "digest_time": "09:00",       # когда присылать (weekly — по понедельникам)
+}
+
+# ─────────────────────────────────────────────
+#  НАСТРОЙКИ ЛОГИРОВАНИЯ
+#  True  — показывать в логе
+#  False — скрыть
+# ─────────────────────────────────────────────
+LOG_CONFIG = {
+    "commands":      True,   # входящие команды (/start, /stop и т.д.)
+    "callbacks":     True,   # нажатия кнопок в боте
+    "new_processes": True,   # обнаружение новых процессов
+    "tg_errors":     True,   # ошибки Telegram API
+    "tg_timeouts":   False,  # таймауты long polling (обычно мусор — держи False)
+    "tg_warnings":   True,   # предупреждения Telegram (флуд и т.п.)
+    "errors":        True,   # внутренние ошибки потоков
+    "threads":       True,   # старт потоков при запуске
+    "startup":       True,   # информация при запуске бота
+    "save_load":     False,  # сохранение/загрузка json файлов
+}
+
+LOG_LEVEL       = logging.INFO
+LOG_JSON        = False              # True — писать monitor.log в формате JSON-lines
+LOG_MAX_BYTES   = 20 * 1024**2       # ротация по размеру (0 — выкл)
+LOG_ROTATE_WHEN = ""                 # ротация по времени: "midnight", "H", … ("" — выкл)
+LOG_BACKUPS     = 7                  # сколько старых файлов хранить
+LOG_COMPRESS    = True               # сжимать старые файлы в .gz
+
+# лимит на категорию: (сообщений в секунду, запас burst).
+# Сверх лимита пишется лишь каждое LOG_SAMPLE_EVERY-е сообщение,
+# остальные считаются и сводкой попадают в лог, когда поток спадёт.
+LOG_RATE_LIMITS = {
+    "new_processes": (20, 200),
+    "callbacks":     (10, 50),
+    "tg_warnings":   (5, 20),
+    "tg_errors":     (5, 20),
 }
+LOG_SAMPLE_EVERY = 100
 
 # ─────────────────────────────────────────────
 #  ЛОГИРОВАНИЕ
+#  Потоки кладут записи в очередь, форматирование, запись,
+#  ротация и сжатие — в фоновом потоке QueueListener.
 # ─────────────────────────────────────────────
 os.makedirs(BASE_DIR, exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding="utf-8"),
-        logging.StreamHandler(sys.stdout),
-    ],
-)
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts":     datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level":  record.levelname,
+            "cat":    getattr(record, "category", ""),
+            "thread": record.threadName,
+            "msg":    record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class _AsyncQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # не форматируем в вызывающем потоке — это сделает QueueListener
+        return record
+
+def _gzip_rotate(source: str, dest: str) -> None:
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+def _make_file_handler() -> logging.Handler:
+    if LOG_ROTATE_WHEN:
+        h = logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS, encoding="utf-8")
+    elif LOG_MAX_BYTES:
+        h = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+    else:
+        return logging.FileHandler(LOG_FILE, encoding="utf-8")
+    if LOG_COMPRESS:
+        h.namer   = lambda name: name + ".gz"
+        h.rotator = _gzip_rotate
+    return h
+
+def _setup_logging(to_file: bool = True, tag: str = "") -> logging.handlers.QueueListener:
+    text_fmt  = logging.Formatter("%(asctime)s [%(levelname)s] " + tag + "%(message)s")
+    handlers: List[logging.Handler] = []
+    if to_file:
+        file_h = _make_file_handler()
+        file_h.setFormatter(_JsonFormatter() if LOG_JSON else text_fmt)
+        handlers.append(file_h)
+    stream_h  = logging.StreamHandler(sys.stdout)
+    stream_h.setFormatter(text_fmt)
+    handlers.append(stream_h)
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [_AsyncQueueHandler(q)]
+    root.setLevel(LOG_LEVEL)
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+_log_listener = _setup_logging()
 log = logging.getLogger("monitor")
 
+_LEVELS = {"debug": logging.DEBUG, "info": logging.INFO,
+           "warning": logging.WARNING, "error": logging.ERROR}
+# категория → [токены, время последнего пополнения, подавлено]
+_log_buckets: Dict[str, List[float]] = {}
+
+def _log_allowed(category: str) -> bool:
+    """Token bucket на категорию. Гонки между потоками дают лишь
+    неточность счётчиков, поэтому без блокировки."""
+    limit = LOG_RATE_LIMITS.get(category)
+    if not limit:
+        return True
+    rate, burst = limit
+    now = time.monotonic()
+    b = _log_buckets.get(category)
+    if b is None:
+        b = _log_buckets[category] = [float(burst), now, 0]
+    b[0] = min(float(burst), b[0] + (now - b[1]) * rate)
+    b[1] = now
+    if b[0] >= 1.0:
+        b[0] -= 1.0
+        if b[2]:
+            dropped, b[2] = int(b[2]), 0
+            log.warning("[%s] rate limited: %d messages over limit (1 of %d written)",
+                        category, dropped, LOG_SAMPLE_EVERY, extra={"category": category})
+        return True
+    b[2] += 1
+    return b[2] % LOG_SAMPLE_EVERY == 0
+
+def _log(category: str, level: str, msg: str, *args) -> None:
+    """Логирование с фильтрацией по LOG_CONFIG и лимитом LOG_RATE_LIMITS."""
+    if not LOG_CONFIG.get(category, True):
+        return
+    levelno = _LEVELS[level]
+    if not log.isEnabledFor(levelno) or not _log_allowed(category):
+        return
+    log.log(levelno, msg, *args, extra={"category": category})
+
+# ─────────────────────────────────────────────
+#  СПИСКИ ИМЁН (игнорируемые, белый список)
+#  Всегда отсортированы: блоки по LIST_BLOCK + bisect по максимумам блоков,
+#  вставка/удаление — O(log n + LIST_BLOCK). Проверка вхождения — через set.
+#  На диске: JSON-снимок + append-only журнал изменений (<файл>.log):
+#    {"+": имя}  {"-": имя}  {"=": [имена]}  — добавлено / удалено / заменено всё
+# ─────────────────────────────────────────────
+class NameList:
+    def __init__(self, path: str, default: Iterable[str] = ()):
+        self.path     = path
+        self.log_path = path + ".log"
+        self.default  = tuple(default)
+        self._lock    = Lock()
+        self._set:    Set[str]        = set()
+        self._blocks: List[List[str]] = []
+        self._maxes:  List[str]       = []     # последний элемент каждого блока
+        self._pages:  Dict[Tuple, Tuple[List[str], int]] = {}   # (запрос, стр.) → (имена, всего)
+        self._found:  Dict[str, List[str]] = {}                  # запрос → совпадения
+        self._log_n   = 0
+        self._fh      = None
+
+    def __contains__(self, name) -> bool:
+        return name in self._set
+
+    def __len__(self) -> int:
+        return len(self._set)
+
+    def __iter__(self):
+        for block in list(self._blocks):
+            yield from block
+
+    # ─── структура ───
+    def _build(self, names: Iterable[str]) -> None:
+        self._set = set(names)
+        items = sorted(self._set)
+        self._blocks = [items[i:i + LIST_BLOCK] for i in range(0, len(items), LIST_BLOCK)]
+        self._maxes  = [b[-1] for b in self._blocks]
+
+    def _insert(self, name: str) -> bool:
+        if name in self._set:
+            return False
+        self._set.add(name)
+        if not self._blocks:
+            self._blocks, self._maxes = [[name]], [name]
+            return True
+        i = min(bisect_left(self._maxes, name), len(self._blocks) - 1)
+        block = self._blocks[i]
+        insort(block, name)
+        self._maxes[i] = block[-1]
+        if len(block) > 2 * LIST_BLOCK:
+            half = len(block) // 2
+            self._blocks[i:i + 1] = [block[:half], block[half:]]
+            self._maxes[i:i + 1]  = [block[half - 1], block[-1]]
+        return True
+
+    def _remove(self, name: str) -> bool:
+        if name not in self._set:
+            return False
+        self._set.discard(name)
+        i = bisect_left(self._maxes, name)
+        block = self._blocks[i]
+        del block[bisect_left(block, name)]
+        if block:
+            self._maxes[i] = block[-1]
+        else:
+            del self._blocks[i], self._maxes[i]
+        return True
+
+    def _changed(self, rec: Dict) -> None:
+        # вызывается под self._lock
+        self._pages.clear()
+        self._found.clear()
+        if self._fh is not None:
+            self._fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._log_n += 1
+
+    # ─── изменения ───
+    def add(self, name: str) -> bool:
+        with self._lock:
+            if not self._insert(name):
+                return False
+            self._changed({"+": name})
+        self._maybe_compact()
+        return True
+
+    def discard(self, name: str) -> bool:
+        with self._lock:
+            if not self._remove(name):
+                return False
+            self._changed({"-": name})
+        self._maybe_compact()
+        return True
+
+    def reset(self, names: Iterable[str] = ()) -> None:
+        """Заменить содержимое целиком (очистка списка, восстановление системных)."""
+        names = list(names)
+        with self._lock:
+            self._build(names)
+            self._changed({"=": names})
+        self._maybe_compact()
+
+    # ─── чтение ───
+    def _slice(self, start: int, stop: int) -> List[str]:
+        out: List[str] = []
+        for block in self._blocks:
+            if start >= len(block):
+                start -= len(block)
+                stop  -= len(block)
+                continue
+            out.extend(block[start:stop])
+            stop -= len(block)
+            start = 0
+            if stop <= 0:
+                break
+        return out
+
+    def page(self, page: int, query: str = "") -> Tuple[List[str], int, int]:
+        """(имена на странице, всего страниц, всего совпадений). query — подстрока без учёта регистра."""
+        with self._lock:
+            if query:
+                found = self._found.get(query)
+                if found is None:
+                    q = query.casefold()
+                    found = self._found[query] = [n for n in self if q in n.casefold()]
+                count = len(found)
+            else:
+                count = len(self._set)
+            pages = max(1, (count + LIST_PAGE - 1) // LIST_PAGE)
+            page  = min(max(0, page), pages - 1)
+            hit = self._pages.get((query, page))
+            if hit is None:
+                start = page * LIST_PAGE
+                items = (found[start:start + LIST_PAGE] if query
+                         else self._slice(start, start + LIST_PAGE))
+                hit = self._pages[(query, page)] = (items, count)
+            return hit[0], pages, hit[1]
+
+    # ─── диск ───
+    def load(self) -> None:
+        """Снимок + журнал изменений; после загрузки журнал сворачивается в снимок."""
+        names = set(_load(self.path, list(self.default)))
+        replayed = 0
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        break   # недописанная последняя строка после падения
+                    if "+" in rec:
+                        names.add(rec["+"])
+                    elif "-" in rec:
+                        names.discard(rec["-"])
+                    elif "=" in rec:
+                        names = set(rec["="])
+                    replayed += 1
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._build(names)
+            self._pages.clear()
+            self._found.clear()
+            self._log_n = replayed
+        self.compact(force=True)
+
+    def compact(self, force: bool = False) -> None:
+        """Записать JSON-снимок и обнулить журнал (если в нём что-то есть)."""
+        with self._lock:
+            if dry_run or (not self._log_n and not force):
+                return
+            _save(self.path, list(self))
+            if self._fh is not None:
+                self._fh.close()
+            self._fh = open(self.log_path, "w", encoding="utf-8")
+            self._log_n = 0
+
+    def _maybe_compact(self) -> None:
+        if self._log_n >= LIST_LOG_COMPACT:
+            self.compact()
+
 # ─────────────────────────────────────────────
 #  ГЛОБАЛЬНОЕ СОСТОЯНИЕ
 # ─────────────────────────────────────────────
 _lock               = Lock()
 known_pids:         Set[int]              = set()
-ignored_procs:      Set[str]             = set()
-whitelist_procs:    Set[str]             = set()
+ignored_procs:      NameList             = NameList(IGNORED_FILE, DEFAULT_SYSTEM)
+whitelist_procs:    NameList             = NameList(WHITELIST_FILE)
 active_users:       Set[str]             = set()
 user_settings:      Dict[str, Dict]      = {}
-process_stats:      Dict[str, List]      = defaultdict(list)
+process_stats:      Dict[str, Dict]      = {}   # имя → запись history (сырые + агрегаты)
+group_stats:        Dict[str, Dict]      = {}   # "unit:…"/"ctr:…" → запись history
 pending:            Dict[str, List]      = defaultdict(list)   # chat_id → [info, ...]
 last_update_id:     int                  = 0
 stop_event:         Event                = Event()
+dry_run:            bool                 = False   # --replay: состояние читается, но не пишется
+hist_cache:         Dict[str, Dict]      = {}   # chat_id → последний результат /history
+
+# ─────────────────────────────────────────────
+#  МЕТРИКИ (Prometheus text exposition)
+# ─────────────────────────────────────────────
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS   = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+def _labels_str(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class CounterMetric:
+    """Монотонный счётчик с метками."""
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name, self.doc, self.labels = name, doc, labels
+        self._values: Dict[Tuple[str, ...], float] = {} if labels else {(): 0.0}
+        self._lock = Lock()
+
+    def inc(self, value: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels_str(self.labels, k)} {v:g}" for k, v in items]
+
+class GaugeMetric:
+    """Мгновенное значение; может вычисляться функцией в момент опроса."""
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, func: Callable[[], float] = None):
+        self.name, self.doc, self._func = name, doc, func
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def render(self) -> List[str]:
+        value = self._value
+        if self._func:
+            try:
+                value = self._func()
+            except Exception:
+                return []
+        return [f"{self.name} {value:g}"]
+
+class HistogramMetric:
+    """Гистограмма с фиксированными бакетами; observe() — O(log buckets)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                 labels: Tuple[str, ...] = ()):
+        self.name, self.doc, self.labels = name, doc, labels
+        self.buckets = tuple(buckets)
+        # метки → [счётчики по бакетам..., +Inf, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._series.get(labels)
+            if row is None:
+                row = self._series[labels] = [0] * (len(self.buckets) + 2)
+            row[idx] += 1
+            row[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        out = []
+        for labels, row in items:
+            acc = 0
+            for le, n in zip(self.buckets + (float("inf"),), row):
+                acc += n
+                le_str = "+Inf" if le == float("inf") else f"{le:g}"
+                lbl = _labels_str(self.labels, labels, f'le="{le_str}"')
+                out.append(f"{self.name}_bucket{lbl} {acc}")
+            plain = _labels_str(self.labels, labels)
+            out.append(f"{self.name}_sum{plain} {row[-1]:g}")
+            out.append(f"{self.name}_count{plain} {acc}")
+        return out
+
+M_SCAN_SECONDS  = HistogramMetric("pm_scan_duration_seconds", "Длительность цикла сканирования процессов")
+M_SCAN_PROCS    = GaugeMetric("pm_scan_processes", "Процессов в последнем скане")
+M_NEW_PER_CYCLE = HistogramMetric("pm_new_processes_per_cycle", "Новых процессов за цикл", COUNT_BUCKETS)
+M_NEW_TOTAL     = CounterMetric("pm_new_processes_total", "Обнаружено новых процессов")
+M_MONITOR_ERR   = CounterMetric("pm_monitor_errors_total", "Ошибки в цикле мониторинга", ("thread",))
+M_PENDING       = GaugeMetric("pm_pending_notifications", "Уведомлений в очереди группировки",
+                        lambda: sum(len(v) for v in list(pending.values())))
+M_FLUSH_SECONDS = HistogramMetric("pm_flush_duration_seconds", "Длительность прохода notification_flusher")
+M_NOTIFY_TOTAL  = CounterMetric("pm_notifications_sent_total", "Отправлено уведомлений", ("kind",))
+M_TG_SECONDS    = HistogramMetric("pm_telegram_request_duration_seconds", "Латентность вызовов Telegram API",
+                            LATENCY_BUCKETS, ("method",))
+M_TG_TOTAL      = CounterMetric("pm_telegram_requests_total", "Вызовы Telegram API", ("method", "result"))
+M_SAVE_SECONDS  = HistogramMetric("pm_save_duration_seconds", "Длительность записи JSON-файлов",
+                            LATENCY_BUCKETS, ("file",))
+M_START_TIME    = GaugeMetric("pm_start_time_seconds", "Время запуска демона (unix)")
+M_TRACKED       = GaugeMetric("pm_sampler_tracked_processes", "Процессов под наблюдением сэмплера",
+                              lambda: len(_tracked))
+M_SAMPLE_SECONDS= HistogramMetric("pm_sample_duration_seconds", "Длительность прохода resource_sampler")
+M_RES_ALERTS    = CounterMetric("pm_resource_alerts_total", "Алертов о длительной нагрузке")
+M_ANOMALIES     = CounterMetric("pm_anomalies_total", "Обнаружено аномалий", ("kind",))
+M_PORTS_LISTEN  = GaugeMetric("pm_listening_ports", "Слушающих сокетов (TCP/UDP, v4/v6)",
+                              lambda: len(listen_ports))
+M_PORT_CHANGES  = CounterMetric("pm_port_changes_total", "Открытых/закрытых портов", ("change",))
+M_PORTS_SECONDS = HistogramMetric("pm_ports_scan_duration_seconds", "Длительность снимка /proc/net")
+M_AGENTS        = GaugeMetric("pm_agents_connected", "Подключённых агентов (режим коллектора)",
+                              lambda: sum(1 for a in list(agents.values()) if a["online"]))
+M_AGENT_EVENTS  = CounterMetric("pm_agent_events_total", "Событий получено от агентов")
+M_SCANNER_RESTARTS = CounterMetric("pm_scanner_restarts_total", "Перезапусков процесса-сканера")
+M_DELIVERY_SECONDS = HistogramMetric("pm_delivery_seconds", "От постановки в рассылку до ответа Telegram",
+                                     LATENCY_BUCKETS)
+M_UI_EDITS      = CounterMetric("pm_message_edits_total", "Правки сообщений меню", ("result",))
+M_UI_RENDERS    = CounterMetric("pm_screen_renders_total", "Отрисовки тяжёлых экранов меню", ("result",))
+M_ROUTE_TOTAL   = CounterMetric("pm_route_calls_total", "Вызовы обработчиков команд и кнопок",
+                                ("kind", "route"))
+M_ROUTE_SECONDS = HistogramMetric("pm_route_duration_seconds", "Латентность обработчиков команд и кнопок",
+                                  LATENCY_BUCKETS, ("kind", "route"))
+
+METRICS = [M_SCAN_SECONDS, M_SCAN_PROCS, M_NEW_PER_CYCLE, M_NEW_TOTAL, M_MONITOR_ERR,
+           M_PENDING, M_FLUSH_SECONDS, M_NOTIFY_TOTAL, M_TG_SECONDS, M_TG_TOTAL,
+           M_SAVE_SECONDS, M_START_TIME, M_TRACKED, M_SAMPLE_SECONDS, M_RES_ALERTS,
+           M_ANOMALIES, M_PORTS_LISTEN, M_PORT_CHANGES, M_PORTS_SECONDS, M_ROUTE_TOTAL,
+           M_ROUTE_SECONDS, M_AGENTS, M_AGENT_EVENTS, M_SCANNER_RESTARTS, M_UI_EDITS,
+           M_UI_RENDERS, M_DELIVERY_SECONDS]
+
+def metrics_text() -> str:
+    lines = []
+    for m in METRICS:
+        lines.append(f"# HELP {m.name} {m.doc}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = metrics_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args) -> None:   # не засоряем monitor.log запросами скрейпера
+        pass
+
+def start_metrics_server() -> Optional[ThreadingHTTPServer]:
+    if not METRICS_ENABLED:
+        return None
+    try:
+        srv = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+    except OSError as e:
+        _log("errors", "error", "Metrics server bind %s:%d failed: %s", METRICS_HOST, METRICS_PORT, e)
+        return None
+    srv.daemon_threads = True
+    Thread(target=srv.serve_forever, name="Metrics", daemon=True).start()
+    _log("startup", "info", "📈 Metrics: http://%s:%d/metrics", METRICS_HOST, METRICS_PORT)
+    return srv
+
+# ─────────────────────────────────────────────
+#  ПРОИЗВОДИТЕЛЬНОСТЬ: скользящие перцентили, лаг потоков, профайлер
+# ─────────────────────────────────────────────
+_perf:       Dict[str, deque] = defaultdict(lambda: deque(maxlen=PERF_WINDOW))
+_loop_beats: Dict[str, float] = {}
+_profiling:  Event            = Event()
+
+PERF_OPS   = ("scan", "proc_info", "filter", "format", "send", "acct_sweep")
+PERF_LOOPS = ("bot_listener", "notification_flusher", "process_monitor", "resource_sampler",
+              "port_tracker", "scanner")
+
+def perf_observe(op: str, seconds: float) -> None:
+    # deque.append атомарен под GIL — без блокировок на горячем пути
+    _perf[op].append(seconds)
+
+def loop_beat(loop: str, lag: float) -> None:
+    """Отметка итерации потока: lag — насколько итерация началась позже плана."""
+    _loop_beats[loop] = time.time()
+    _perf["lag:" + loop].append(max(0.0, lag))
+
+def _percentiles(samples: List[float]) -> Tuple[float, float, float]:
+    s = sorted(samples)
+    n = len(s)
+    pick = lambda q: s[min(n - 1, int(q * n))]
+    return pick(0.50), pick(0.95), pick(0.99)
+
+def _deep_sizeof(obj) -> int:
+    """Приблизительный размер структуры в байтах (рекурсивно, без повторов)."""
+    seen, stack, total = set(), [obj], 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+    return total
+
+def _fmt_ms(sec: float) -> str:
+    return f"{sec * 1000:.1f}ms" if sec < 10 else f"{sec:.0f}s"
+
+def fmt_perf() -> str:
+    lines = ["⏱ <b>Производительность</b>\n", "<pre>",
+             f"{'операция':<14}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}"]
+    for op in PERF_OPS:
+        samples = list(_perf.get(op, ()))
+        if not samples:
+            lines.append(f"{op:<14}{0:>6}{'—':>9}{'—':>9}{'—':>9}")
+            continue
+        p50, p95, p99 = _percentiles(samples)
+        lines.append(f"{op:<14}{len(samples):>6}{_fmt_ms(p50):>9}{_fmt_ms(p95):>9}{_fmt_ms(p99):>9}")
+    lines.append("")
+    lines.append(f"{'лаг потока':<22}{'p95':>9}{'посл.':>9}")
+    now = time.time()
+    for loop in PERF_LOOPS:
+        samples = list(_perf.get("lag:" + loop, ()))
+        p95  = _fmt_ms(_percentiles(samples)[1]) if samples else "—"
+        beat = _loop_beats.get(loop)
+        ago  = f"{now - beat:.0f}s" if beat else "—"
+        lines.append(f"{loop:<22}{p95:>9}{ago:>9}")
+    routes = []
+    for key in [k for k in list(_perf) if k.startswith("route:")]:
+        samples = list(_perf[key])
+        if samples:
+            routes.append((_percentiles(samples)[1], key[6:], len(samples)))
+    if routes:
+        lines.append("")
+        lines.append(f"{'маршрут':<22}{'n':>6}{'p95':>9}")
+        for p95, route, n in heapq.nlargest(PERF_ROUTES, routes):
+            lines.append(f"{route[:21]:<22}{n:>6}{_fmt_ms(p95):>9}")
+    with _delivery_lock:
+        chats = [(st["fail"], st["lag"], cid, dict(st)) for cid, st in delivery.items()]
+    if chats:
+        lines.append("")
+        lines.append(f"{'доставка в чат':<16}{'задерж.':>9}{'посл.':>7}{'ошиб.':>6}")
+        for fail, lag, cid, st in heapq.nlargest(PERF_ROUTES, chats):
+            ago = f"{now - st['at']:.0f}s" if st["at"] else "—"
+            lines.append(f"{cid[-15:]:<16}{_fmt_ms(lag):>9}{ago:>7}{fail:>6}")
+    lines.append("</pre>")
+    with _lock:
+        pend_n  = sum(len(v) for v in pending.values())
+        pend_sz = _deep_sizeof(pending)
+    stats_sz = _deep_sizeof(process_stats)
+    rss = psutil.Process().memory_info().rss
+    lines += [
+        f"💾 <b>process_stats:</b> {stats_sz / 1024**2:.1f} MB ({len(process_stats)} имён)",
+        f"📤 <b>pending:</b> {pend_sz / 1024:.1f} KB ({pend_n} уведомлений)",
+        f"🧠 <b>RSS процесса:</b> {rss / 1024**2:.1f} MB",
+        "",
+        f"<i>/perf prof N — профилировать N сек (до {PROFILE_MAX_SECS})</i>",
+    ]
+    return "\n".join(lines)
+
+def _frame_stack(frame) -> List[str]:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def sample_profile(seconds: float) -> Dict[str, int]:
+    """Сэмплирующий профайлер: периодически снимает стеки всех потоков.
+    Возвращает collapsed stacks: "поток;f1;f2;..." → число сэмплов."""
+    me = threading.get_ident()
+    names: Dict[int, str] = {}
+    stacks: Dict[str, int] = defaultdict(int)
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and not stop_event.is_set():
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if ident not in names:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            key = ";".join([names.get(ident, str(ident))] + _frame_stack(frame))
+            stacks[key] += 1
+        time.sleep(PROFILE_INTERVAL)
+    return stacks
+
+def fmt_profile(stacks: Dict[str, int], seconds: float, top: int = 15) -> str:
+    total = sum(stacks.values()) or 1
+    lines = [f"🔬 <b>Профиль за {seconds:g} с</b> ({total} сэмплов)\n"]
+    for key, n in sorted(stacks.items(), key=lambda x: x[1], reverse=True)[:top]:
+        frames = key.split(";")
+        # поток + самые глубокие кадры: они и есть горячая точка
+        short = ";".join(frames[:1] + frames[-3:]) if len(frames) > 4 else key
+        # <lambda>, <genexpr> и т.п. — без экранирования Telegram отвергнет HTML
+        line = f"<code>{n * 100 / total:5.1f}% {html.escape(short[:200])}</code>"
+        if sum(len(x) + 1 for x in lines) + len(line) > 4000:
+            break   # режем по целым строкам, а не посреди тега
+        lines.append(line)
+    return "\n".join(lines)
+
+def run_profile(cid: str, seconds: float) -> None:
+    if _profiling.is_set():
+        send_message(cid, "⏳ Профилирование уже идёт.")
+        return
+    _profiling.set()
+    try:
+        stacks = sample_profile(seconds)
+        send_message(cid, fmt_profile(stacks, seconds))
+    except Exception as e:
+        _log("errors", "error", "Profiler error: %s", e)
+    finally:
+        _profiling.clear()
 
 # ─────────────────────────────────────────────
 #  УТИЛИТЫ: JSON-хранилище
@@ -107,30 +891,175 @@ def _load(path: str, default):
     except Exception:
         return default
 
-def _save(path: str, data) -> None:
+def _save(path: str, data, indent: Optional[int] = 2) -> None:
+    if dry_run:
+        return
+    t0 = time.perf_counter()
     with _lock:
         tmp = path + ".tmp"
         with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+            json.dump(data, f, indent=indent, ensure_ascii=False,
+                      separators=None if indent else (",", ":"))
         os.replace(tmp, path)   # атомарная запись
+    M_SAVE_SECONDS.observe(time.perf_counter() - t0, os.path.basename(path))
+    _log("save_load", "debug", "Saved: %s", path)
 
 def load_all() -> None:
-    global ignored_procs, whitelist_procs, active_users, user_settings, process_stats
-    ignored_procs   = set(_load(IGNORED_FILE,  list(DEFAULT_SYSTEM)))
-    whitelist_procs = set(_load(WHITELIST_FILE, []))
+    global active_users, user_settings, process_stats, group_stats
+    ignored_procs.load()
+    whitelist_procs.load()
     active_users    = set(str(u) for u in _load(USERS_FILE, []))
     user_settings   = _load(SETTINGS_FILE, {})
-    process_stats   = defaultdict(list, _load(STATS_FILE, {}))
+    process_stats   = history.migrate(_load(STATS_FILE, {}))
+    group_stats     = history.migrate(_load(GROUPS_FILE, {}))
+    history.prune_all(process_stats)
+    history.prune_all(group_stats)
     # гарантируем настройки для каждого пользователя
     for uid in active_users:
         user_settings.setdefault(uid, DEFAULT_SETTINGS.copy())
+    # новые ключи настроек у старых пользователей
+    for s in user_settings.values():
+        for key, value in DEFAULT_SETTINGS.items():
+            s.setdefault(key, value)
+    anomaly_state.update(_load(ANOMALY_FILE, {}))
+    digest = _load(DIGEST_FILE, {})
+    known_exes.update(digest.get("known_exes", []))
+    digest_state.update(digest.get("chats", {}))
+    _cb_tokens.update(_load(CB_TOKENS_FILE, {}))
+    _log("save_load", "info", "Data loaded")
 
 def save_all() -> None:
-    _save(IGNORED_FILE,  list(ignored_procs))
-    _save(WHITELIST_FILE, list(whitelist_procs))
+    ignored_procs.compact()
+    whitelist_procs.compact()
     _save(USERS_FILE,    list(active_users))
     _save(SETTINGS_FILE, user_settings)
-    _save(STATS_FILE,    dict(process_stats))
+    save_stats()
+    _save(ANOMALY_FILE,  dict(anomaly_state))
+    save_digest()
+    with _cb_lock:
+        tokens = dict(_cb_tokens)
+    _save(CB_TOKENS_FILE, tokens, indent=None)
+
+def save_stats() -> None:
+    # столбцы сырых событий — длинные списки чисел, без отступов файл в разы меньше
+    _save(STATS_FILE, dict(process_stats), indent=None)
+    _save(GROUPS_FILE, dict(group_stats), indent=None)
+
+# ─────────────────────────────────────────────
+#  ЖУРНАЛ УВЕДОМЛЕНИЙ (outbox)
+#  Append-only JSON-lines:
+#    {"q": id, "cid": ..., "info": {...}}  — уведомление поставлено в очередь
+#    {"a": [id, ...]}                        — успешно отправлены
+#    {"w": ts}                               — время последнего скана процессов
+#  Запись буферизуется, fsync — один на цикл (journal_sync).
+# ─────────────────────────────────────────────
+_journal_lock               = Lock()
+_journal_buf:  List[str]    = []
+_journal_open: Dict[str, Tuple[str, Dict]] = {}     # id → (chat_id, info), ждут отправки
+_journal_done: deque        = deque(maxlen=JOURNAL_KEEP_ACKED)
+_journal_done_set: Set[str] = set()
+_journal_mark: Optional[float] = None
+_journal_fh                 = None
+
+def event_id(cid: str, info: Dict) -> str:
+    host = f"{info['host']}:" if info.get("host") else ""
+    return f"{cid}:{host}{info['pid']}:{info['create_time']}"
+
+def _journal_mark_done(eid: str) -> None:
+    if eid in _journal_done_set:
+        return
+    if len(_journal_done) == _journal_done.maxlen:
+        _journal_done_set.discard(_journal_done[0])
+    _journal_done.append(eid)
+    _journal_done_set.add(eid)
+
+def journal_open() -> Optional[float]:
+    """Прочитать журнал, восстановить неподтверждённые уведомления в pending.
+    Возвращает время последнего скана до остановки (или None)."""
+    global _journal_fh, _journal_mark
+    try:
+        with open(JOURNAL_FILE, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break   # недописанная последняя строка после падения
+                if "q" in rec:
+                    if rec["q"] not in _journal_done_set:
+                        _journal_open[rec["q"]] = (rec["cid"], rec["info"])
+                elif "a" in rec:
+                    for eid in rec["a"]:
+                        _journal_open.pop(eid, None)
+                        _journal_mark_done(eid)
+                elif "w" in rec:
+                    _journal_mark = rec["w"]
+    except FileNotFoundError:
+        pass
+    with _lock:
+        for cid, info in _journal_open.values():
+            pending[cid].append(info)
+    _journal_compact()
+    if _journal_open:
+        _log("startup", "info", "Журнал: восстановлено неотправленных уведомлений: %d",
+             len(_journal_open))
+    return _journal_mark
+
+def _journal_compact() -> None:
+    """Переписать журнал: только ожидающие отправки записи + хвост подтверждённых."""
+    global _journal_fh
+    with _journal_lock:
+        if _journal_fh:
+            _journal_fh.close()
+        tmp = JOURNAL_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            if _journal_done:
+                f.write(json.dumps({"a": list(_journal_done)}) + "\n")
+            for eid, (cid, info) in _journal_open.items():
+                f.write(json.dumps({"q": eid, "cid": cid, "info": info}, ensure_ascii=False) + "\n")
+            if _journal_mark is not None:
+                f.write(json.dumps({"w": _journal_mark}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, JOURNAL_FILE)
+        _journal_buf.clear()
+        _journal_fh = open(JOURNAL_FILE, "a", encoding="utf-8")
+
+def journal_queue(cid: str, info: Dict) -> bool:
+    """Зарегистрировать уведомление. False — такое уже было (дубликат)."""
+    eid = event_id(cid, info)
+    with _journal_lock:
+        if eid in _journal_open or eid in _journal_done_set:
+            return False
+        _journal_open[eid] = (cid, info)
+        _journal_buf.append(json.dumps({"q": eid, "cid": cid, "info": info}, ensure_ascii=False))
+    return True
+
+def journal_ack(cid: str, infos: List[Dict]) -> None:
+    ids = [event_id(cid, i) for i in infos]
+    with _journal_lock:
+        for eid in ids:
+            _journal_open.pop(eid, None)
+            _journal_mark_done(eid)
+        _journal_buf.append(json.dumps({"a": ids}))
+
+def journal_watermark(ts: float) -> None:
+    global _journal_mark
+    with _journal_lock:
+        _journal_mark = ts
+        _journal_buf.append(json.dumps({"w": ts}))
+
+def journal_sync() -> None:
+    """Дописать буфер и сделать один fsync на всю пачку."""
+    with _journal_lock:
+        if not _journal_buf or _journal_fh is None:
+            return
+        _journal_fh.write("\n".join(_journal_buf) + "\n")
+        _journal_buf.clear()
+        _journal_fh.flush()
+        os.fsync(_journal_fh.fileno())
+        size = _journal_fh.tell()
+    if size > JOURNAL_COMPACT_BYTES:
+        _journal_compact()
 
 def get_settings(chat_id: str) -> Dict:
     if chat_id not in user_settings:
@@ -144,44 +1073,277 @@ def get_settings(chat_id: str) -> Dict:
 BASE_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}"
 SESSION  = requests.Session()
 SESSION.headers.update({"Content-Type": "application/json"})
+for _scheme in ("https://", "http://"):   # соединений хватает всем потокам рассылки
+    SESSION.mount(_scheme, requests.adapters.HTTPAdapter(pool_maxsize=SEND_WORKERS + 4))
 
-def _tg(method: str, **kwargs) -> Optional[Dict]:
-    """Универсальный вызов Telegram Bot API с логированием ошибок."""
+def _tg(method: str, files: Optional[Dict] = None, http_timeout: float = 15,
+        **kwargs) -> Optional[Dict]:
+    """Универсальный вызов Telegram Bot API с логированием ошибок.
+    files — загрузка файлов (multipart), остальные параметры идут полями формы.
+    http_timeout — таймаут запроса (long polling держит соединение дольше обычного)."""
+    t0 = time.perf_counter()
+    result = "exception"
     try:
-        r = SESSION.post(f"{BASE_URL}/{method}", json=kwargs, timeout=15)
+        if files:
+            # Content-Type: application/json из сессии убираем — его выставит multipart
+            r = SESSION.post(f"{BASE_URL}/{method}", data=kwargs, files=files,
+                             headers={"Content-Type": None}, timeout=120)
+        else:
+            r = SESSION.post(f"{BASE_URL}/{method}", json=kwargs, timeout=http_timeout)
         data = r.json()
         if not data.get("ok"):
-            log.warning("TG %s error: %s", method, data.get("description", "?"))
+            if "message is not modified" in data.get("description", ""):
+                # правка совпала с тем, что уже на экране, — не ошибка
+                result = "unchanged"
+                return {"ok": True, "unchanged": True}
+            result = "error"
+            _log("tg_warnings", "warning", "TG %s: %s", method, data.get("description", "?"))
             return None
+        result = "ok"
         return data.get("result")
+    except requests.exceptions.ReadTimeout:
+        result = "timeout"
+        _log("tg_timeouts", "warning", "TG %s: timeout", method)
+        return None
     except Exception as e:
-        log.error("TG %s exception: %s", method, e)
+        _log("tg_errors", "error", "TG %s exception: %s", method, e)
         return None
+    finally:
+        M_TG_SECONDS.observe(time.perf_counter() - t0, method)
+        M_TG_TOTAL.inc(1, method, result)
 
 def send_message(chat_id: str, text: str,
                  markup: dict = None,
                  edit_id: int = None,
                  parse_mode: str = "HTML") -> Optional[int]:
     """Отправить или отредактировать сообщение. Возвращает message_id."""
+    if edit_id:
+        return edit_message(chat_id, edit_id, text, markup, parse_mode)
+    t0 = time.perf_counter()
     params = dict(chat_id=chat_id, text=text, parse_mode=parse_mode)
     if markup:
         params["reply_markup"] = markup
-    if edit_id:
-        params["message_id"] = edit_id
-        res = _tg("editMessageText", **params)
-    else:
-        res = _tg("sendMessage", **params)
+    res = _tg("sendMessage", **params)
+    perf_observe("send", time.perf_counter() - t0)
     if isinstance(res, dict):
         return res.get("message_id")
     return None
 
+# ─── правки сообщений: повторы не отправляются, частые склеиваются ───
+# (chat_id, message_id) → {"hash": последнее на экране, "at": время правки,
+#                          "pending": отложенная правка, "timer": её таймер}
+_edits: "OrderedDict[Tuple[str, int], Dict]" = OrderedDict()
+_edits_lock = Lock()
+
+def _content_hash(text: str, markup: Optional[dict], parse_mode: str) -> bytes:
+    raw = json.dumps([text, markup, parse_mode], ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(raw.encode(), digest_size=16).digest()
+
+def edit_message(chat_id: str, mid: int, text: str, markup: Optional[dict] = None,
+                 parse_mode: str = "HTML") -> Optional[int]:
+    """editMessageText без лишних вызовов: то же содержимое не отправляется,
+    а правки чаще EDIT_COALESCE откладываются — уходит только последняя."""
+    key = (str(chat_id), mid)
+    h = _content_hash(text, markup, parse_mode)
+    with _edits_lock:
+        st = _edits.get(key)
+        if st is None:
+            st = _edits[key] = {"hash": None, "at": 0.0, "pending": None, "timer": None}
+            while len(_edits) > EDIT_CACHE_MAX:
+                _edits.popitem(last=False)
+        else:
+            _edits.move_to_end(key)
+        if st["timer"] is not None:
+            # правка уже ждёт — заменяем её содержимое свежим
+            st["pending"] = (text, markup, parse_mode, h)
+            M_UI_EDITS.inc(1, "coalesced")
+            return mid
+        if st["hash"] == h:
+            M_UI_EDITS.inc(1, "same")
+            return mid
+        wait = st["at"] + EDIT_COALESCE - time.monotonic()
+        if wait > 0:
+            st["pending"] = (text, markup, parse_mode, h)
+            st["timer"] = threading.Timer(wait, _edit_flush, (key, st))
+            st["timer"].daemon = True
+            st["timer"].start()
+            return mid
+        st["at"] = time.monotonic()
+    return _edit_send(key, st, text, markup, parse_mode, h)
+
+def _edit_flush(key: Tuple[str, int], st: Dict) -> None:
+    """Таймер склейки: отправить последнюю отложенную правку."""
+    with _edits_lock:
+        text, markup, parse_mode, h = st["pending"]
+        st["pending"] = st["timer"] = None
+        if st["hash"] == h:
+            M_UI_EDITS.inc(1, "same")
+            return
+        st["at"] = time.monotonic()
+    _edit_send(key, st, text, markup, parse_mode, h)
+
+def _edit_send(key: Tuple[str, int], st: Dict, text: str, markup: Optional[dict],
+               parse_mode: str, h: bytes) -> Optional[int]:
+    t0 = time.perf_counter()
+    params = dict(chat_id=key[0], message_id=key[1], text=text, parse_mode=parse_mode)
+    if markup:
+        params["reply_markup"] = markup
+    res = _tg("editMessageText", **params)
+    perf_observe("send", time.perf_counter() - t0)
+    if res is None:
+        M_UI_EDITS.inc(1, "error")
+        return None
+    with _edits_lock:
+        st["hash"] = h
+    unchanged = isinstance(res, dict) and res.get("unchanged")
+    M_UI_EDITS.inc(1, "unchanged" if unchanged else "sent")
+    return key[1]
+
+# ─── экраны меню: тяжёлый текст (статус, топ) живёт RENDER_TTL сек ───
+_renders: Dict[Tuple[str, str], Tuple[float, str, Optional[dict]]] = {}
+_renders_lock = Lock()   # сам словарь — под блокировкой, отрисовка экрана — вне её
+
+def render_cached(cid: str, screen: str,
+                  build: Callable[[], Tuple[str, Optional[dict]]]) -> Tuple[str, Optional[dict]]:
+    """(текст, клавиатура) экрана; частые нажатия не пересчитывают его заново."""
+    now = time.monotonic()
+    with _renders_lock:
+        hit = _renders.get((cid, screen))
+    if hit is not None and now - hit[0] < RENDER_TTL:
+        M_UI_RENDERS.inc(1, "cached")
+        return hit[1], hit[2]
+    text, markup = build()   # без блокировки: отрисовка бывает долгой
+    M_UI_RENDERS.inc(1, "built")
+    with _renders_lock:
+        if len(_renders) > 256:
+            for k in [k for k, v in _renders.items() if now - v[0] >= RENDER_TTL]:
+                del _renders[k]
+        _renders[(cid, screen)] = (time.monotonic(), text, markup)   # возраст — от конца отрисовки
+    return text, markup
+
+def render_drop(prefix: str = "") -> None:
+    """Забыть готовые экраны (данные под ними изменились)."""
+    with _renders_lock:
+        for k in [k for k in _renders if k[1].startswith(prefix)]:
+            del _renders[k]
+
+def send_document(chat_id: str, path: str, caption: str = "") -> Optional[int]:
+    """Отправить файл документом. Возвращает message_id."""
+    with open(path, "rb") as f:
+        res = _tg("sendDocument", files={"document": (os.path.basename(path), f)},
+                  chat_id=chat_id, caption=caption, parse_mode="HTML")
+    return res.get("message_id") if isinstance(res, dict) else None
+
 def answer_callback(callback_id: str, text: str = "") -> None:
     _tg("answerCallbackQuery", callback_query_id=callback_id, text=text)
 
-def get_updates(offset: int, timeout: int = 30) -> List[Dict]:
-    res = _tg("getUpdates", offset=offset, timeout=timeout,
-               allowed_updates=["message", "callback_query"])
-    return res if isinstance(res, list) else []
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+def get_updates(offset: int, timeout: int = 30) -> Optional[List[Dict]]:
+    """Обновления long polling; None — ошибка запроса (сеть, 401, 409)."""
+    res = _tg("getUpdates", http_timeout=timeout + 10, offset=offset, timeout=timeout,
+              allowed_updates=ALLOWED_UPDATES)
+    return res if isinstance(res, list) else None
+
+# ─────────────────────────────────────────────
+#  РАССЫЛКА
+#  Одно событие для многих чатов: текст и клавиатура готовятся один раз,
+#  отправляют SEND_WORKERS потоков параллельно, но все вместе не чаще
+#  SEND_RATE сообщений в секунду. Очередь приоритетная: белый список и
+#  аномалии уходят раньше обычных событий. По каждому чату помним
+#  последнюю доставку, задержку и число неудач подряд (/perf).
+# ─────────────────────────────────────────────
+PRIO_URGENT, PRIO_ROUTINE = 0, 1
+
+_send_q: "queue.PriorityQueue[Tuple]" = queue.PriorityQueue()
+_send_seq = iter(range(1 << 62))   # порядок внутри приоритета — порядок постановки
+_send_next = 0.0                   # monotonic — раньше него следующую отправку не начинать
+_send_pace = Lock()
+_senders: List[Thread] = []
+_senders_lock = Lock()
+delivery: Dict[str, Dict] = {}     # chat_id → {"at": последняя доставка, "lag", "fail": неудач подряд}
+_delivery_lock = Lock()
+
+def notify_priority(procs: List[Dict]) -> int:
+    urgent = any(p.get("anomaly") or in_list(p, whitelist_procs) for p in procs)
+    return PRIO_URGENT if urgent else PRIO_ROUTINE
+
+def _send_slot() -> None:
+    """Общий темп: отправки идут не чаще SEND_RATE в секунду."""
+    global _send_next
+    with _send_pace:
+        now = time.monotonic()
+        at = max(now, _send_next)
+        _send_next = at + 1.0 / SEND_RATE
+    if at > now:
+        time.sleep(at - now)
+
+def _sender() -> None:
+    while True:
+        _, _, cid, text, markup, queued, done = _send_q.get()
+        _send_slot()
+        try:
+            mid = send_message(cid, text, markup=markup)
+        except Exception as e:
+            _log("tg_errors", "error", "Broadcast to %s failed: %s", cid, e)
+            mid = None
+        lag = time.monotonic() - queued
+        M_DELIVERY_SECONDS.observe(lag)
+        with _delivery_lock:
+            st = delivery.setdefault(cid, {"at": 0.0, "lag": 0.0, "fail": 0})
+            st["lag"] = lag
+            if mid is None:
+                st["fail"] += 1
+            else:
+                st["at"], st["fail"] = time.time(), 0
+        try:
+            done(cid, mid)
+        except Exception as e:
+            _log("errors", "error", "Broadcast callback for %s failed: %s", cid, e)
+        finally:
+            _send_q.task_done()
+
+def broadcast_wait() -> None:
+    """Дождаться, пока очередь рассылки опустеет (воспроизведение, тесты)."""
+    _send_q.join()
+
+def _senders_start() -> None:
+    with _senders_lock:
+        while len(_senders) < SEND_WORKERS:
+            t = Thread(target=_sender, name=f"Sender-{len(_senders) + 1}", daemon=True)
+            t.start()
+            _senders.append(t)
+
+def broadcast(messages: List[Tuple[str, str, Optional[dict], int]],
+              on_sent: Optional[Callable[[str, Optional[int]], None]] = None) -> Dict[str, Optional[int]]:
+    """Разослать (chat_id, текст, клавиатура, приоритет) — по одному сообщению на чат.
+    Ждёт всех отправок; возвращает chat_id → message_id (None — не дошло).
+    on_sent — не ждать: поток рассылки вызовет on_sent(chat_id, message_id) сам."""
+    if not messages:
+        return {}
+    _senders_start()
+    if on_sent is not None:
+        queued = time.monotonic()
+        for cid, text, markup, prio in messages:
+            _send_q.put((prio, next(_send_seq), cid, text, markup, queued, on_sent))
+        return {}
+    results: Dict[str, Optional[int]] = {}
+    left = [len(messages)]
+    finished = Event()
+    lock = Lock()
+
+    def done(cid: str, mid: Optional[int]) -> None:
+        with lock:
+            results[cid] = mid
+            left[0] -= 1
+            if not left[0]:
+                finished.set()
+
+    queued = time.monotonic()
+    for cid, text, markup, prio in messages:
+        _send_q.put((prio, next(_send_seq), cid, text, markup, queued, done))
+    finished.wait()
+    return results
 
 # ─────────────────────────────────────────────
 #  МЕНЮ / КЛАВИАТУРЫ
@@ -196,6 +1358,8 @@ def kb_main() -> dict:
         [{"text": "🔕 Отключить уведомления","callback_data": "do_stop"}],
     ]}
 
+DIGEST_LABELS = {"off": "выкл", "daily": "ежедневно", "weekly": "еженедельно"}
+
 def kb_settings(cid: str) -> dict:
     s = get_settings(cid)
     mode_label = {"blacklist": "🚫 Чёрный список", "whitelist": "⭐ Белый список", "smart": "🧠 Умный"}
@@ -205,6 +1369,8 @@ def kb_settings(cid: str) -> dict:
         [{"text": ("✅" if s["group_notifications"] else "❌") + " Группировка уведомлений", "callback_data": "toggle_group"}],
         [{"text": ("✅" if s["ignore_system"]        else "❌") + " Игнорировать системные",  "callback_data": "toggle_system"}],
         [{"text": ("✅" if s["track_stats"]          else "❌") + " Сбор статистики",         "callback_data": "toggle_stats"}],
+        [{"text": ("✅" if s["notify_ports"]         else "❌") + " Уведомления о портах",    "callback_data": "toggle_ports"}],
+        [{"text": f"📰 Дайджест: {DIGEST_LABELS[s['digest']]}", "callback_data": "toggle_digest"}],
         [{"text": f"🔇 Тихие часы{qh}",             "callback_data": "menu_quiet"}],
         [{"text": f"⚙️ CPU порог: {s['min_cpu_percent']}%",   "callback_data": "set_cpu"}],
         [{"text": f"💾 RAM порог: {s['min_memory_mb']} MB",   "callback_data": "set_ram"}],
@@ -227,35 +1393,44 @@ def kb_lists() -> dict:
     ]}
 
 def kb_list_page(list_type: str, page: int, total_pages: int,
-                 items: List[str]) -> dict:
-    PER = 8
-    start = page * PER
+                 items: List[str], query: str = "") -> dict:
     rows = []
-    for item in items[start:start + PER]:
-        cb = f"rm_{list_type}_{item}"
-        rows.append([{"text": f"🗑 {item}", "callback_data": cb[:64]}])
+    for item in items:
+        rows.append([{"text": f"🗑 {item}", "callback_data": cb_pack(f"rm_{list_type}_{item}")}])
+    suffix = f"_{query}" if query else ""
     nav = []
     if page > 0:
-        nav.append({"text": "◀️ Назад", "callback_data": f"list_{list_type}_{page-1}"})
+        nav.append({"text": "◀️ Назад", "callback_data": cb_pack(f"list_{list_type}_{page-1}{suffix}")})
     if page < total_pages - 1:
-        nav.append({"text": "Вперёд ▶️", "callback_data": f"list_{list_type}_{page+1}"})
+        nav.append({"text": "Вперёд ▶️", "callback_data": cb_pack(f"list_{list_type}_{page+1}{suffix}")})
     if nav:
         rows.append(nav)
-    rows.append([{"text": f"🗑 Очистить всё", "callback_data": f"clear_{list_type}"}])
+    if query:
+        rows.append([{"text": "📋 Весь список", "callback_data": f"list_{list_type}_0"}])
+    else:
+        rows.append([{"text": f"🗑 Очистить всё", "callback_data": f"clear_{list_type}"}])
     rows.append([{"text": "🔙 Списки",        "callback_data": "menu_lists"}])
     return {"inline_keyboard": rows}
 
 def kb_stats_menu() -> dict:
-    top = sorted(process_stats.items(), key=lambda x: len(x[1]), reverse=True)[:5]
-    rows = [[{"text": f"📊 {n} ({len(v)} событий)", "callback_data": f"pstat_{n[:40]}"}]
+    top = heapq.nlargest(5, list(process_stats.items()), key=lambda x: x[1]["n"])
+    rows = [[{"text": f"📊 {n} ({v['n']} событий)", "callback_data": cb_pack(f"pstat_{n}")}]
             for n, v in top]
     rows += [
         [{"text": "📈 Общая сводка",     "callback_data": "stats_total"}],
+        [{"text": "📦 Юниты и контейнеры","callback_data": "stats_groups"}],
         [{"text": "🗑 Очистить статистику","callback_data": "stats_clear"}],
         [{"text": "🔙 Главное меню",      "callback_data": "menu_main"}],
     ]
     return {"inline_keyboard": rows}
 
+def kb_group_stats() -> dict:
+    top = heapq.nlargest(8, list(group_stats.items()), key=lambda x: x[1]["n"])
+    rows = [[{"text": f"📦 {g} ({v['n']})", "callback_data": cb_pack(f"pstat_{g}")}]
+            for g, v in top]
+    rows.append([{"text": "🔙 Статистика", "callback_data": "menu_stats"}])
+    return {"inline_keyboard": rows}
+
 def kb_help() -> dict:
     return {"inline_keyboard": [
         [{"text": "📖 Команды",           "callback_data": "help_cmds"}],
@@ -265,31 +1440,61 @@ def kb_help() -> dict:
         [{"text": "🔙 Главное меню",      "callback_data": "menu_main"}],
     ]}
 
-def kb_process(name: str) -> dict:
-    safe = name[:40]
-    return {"inline_keyboard": [
-        [{"text": "🚫 Игнорировать",    "callback_data": f"add_ignored_{safe}"},
-         {"text": "⭐ В белый список", "callback_data": f"add_whitelist_{safe}"}],
-        [{"text": "📊 Статистика",      "callback_data": f"pstat_{safe}"}],
+def kb_process(name: str, info: Optional[Dict] = None) -> dict:
+    rows = [
+        [{"text": "🚫 Игнорировать",    "callback_data": cb_pack(f"add_ignored_{name}")},
+         {"text": "⭐ В белый список", "callback_data": cb_pack(f"add_whitelist_{name}")}],
+    ]
+    group = proc_group(info) if info else ""
+    if group:
+        label = "контейнер" if group.startswith("ctr:") else "юнит"
+        rows.append([{"text": f"🚫 Весь {label}", "callback_data": cb_pack(f"add_ignored_{group}")},
+                     {"text": f"⭐ Весь {label}", "callback_data": cb_pack(f"add_whitelist_{group}")}])
+    rows += [
+        [{"text": "📊 Статистика",      "callback_data": cb_pack(f"pstat_{name}")}],
         [{"text": "🏠 Главное меню",    "callback_data": "menu_main"}],
+    ]
+    return {"inline_keyboard": rows}
+
+def kb_top(dim: Optional[str] = None) -> dict:
+    short = {"user": "👤 Польз.", "group": "📦 Юниты", "name": "📋 Имена"}
+    tabs = [{"text": ("• " if d == dim else "") + short[d], "callback_data": f"top_{d}"}
+            for d, _ in TOP_DIMS]
+    return {"inline_keyboard": [
+        tabs,
+        [{"text": "🔄 Обновить", "callback_data": f"top_{dim or 'all'}"},
+         {"text": "🏠 Меню",     "callback_data": "menu_main"}],
     ]}
 
 def kb_status() -> dict:
     return {"inline_keyboard": [[
         {"text": "🔄 Обновить", "callback_data": "sys_status"},
+        {"text": "🏋️ Top",      "callback_data": "top_all"},
         {"text": "🏠 Меню",     "callback_data": "menu_main"},
     ]]}
 
 # ─────────────────────────────────────────────
 #  ФОРМАТИРОВАНИЕ
 # ─────────────────────────────────────────────
+def _fmt_origin(info: Dict) -> str:
+    if info.get("container"):
+        return f"📦 <b>Контейнер:</b> {info['container']} ({info['runtime']})\n"
+    if info.get("unit"):
+        return f"🧩 <b>Юнит:</b> {info['unit']}\n"
+    return ""
+
 def fmt_process(info: Dict) -> str:
+    anomaly = f"🧠 <b>Аномалия:</b> {info['anomaly']}\n" if info.get("anomaly") else ""
+    host    = f"🛰 <b>Хост:</b> {info['host']}\n" if info.get("host") else ""
     return (
         f"🔔 <b>Новый процесс</b>\n"
+        f"{anomaly}"
         f"📋 <b>Название:</b> <code>{info['name']}</code>\n"
+        f"{host}"
         f"🆔 <b>PID:</b> {info['pid']}\n"
         f"👤 <b>Пользователь:</b> {info['username']}\n"
         f"📅 <b>Время:</b> {info['create_time']}\n"
+        f"{_fmt_origin(info)}"
         f"⚙️ <b>CPU:</b> {info['cpu']:.1f}%\n"
         f"💾 <b>RAM:</b> {info['memory_mb']} MB\n"
         f"📂 <b>Файл:</b> <code>{info['exe'][:200]}</code>\n"
@@ -300,9 +1505,12 @@ def fmt_grouped(procs: List[Dict]) -> str:
     lines = [f"🔔 <b>Новых процессов: {len(procs)}</b>\n"]
     for p in procs[:15]:
         lines.append(
-            f"• <b>{p['name']}</b> (PID {p['pid']}) "
+            f"{'🧠' if p.get('anomaly') else '•'} <b>{p['name']}</b> (PID {p['pid']}) "
             f"CPU {p['cpu']:.1f}% RAM {p['memory_mb']}MB "
             f"👤{p['username']}"
+            + (f" 📦{p['container']}" if p.get("container") else
+               f" 🧩{p['unit']}" if p.get("unit") else "")
+            + (f" 🛰{p['host']}" if p.get("host") else "")
         )
     if len(procs) > 15:
         lines.append(f"\n<i>…и ещё {len(procs)-15}</i>")
@@ -314,25 +1522,16 @@ def fmt_system_status() -> str:
     cpu  = psutil.cpu_percent(interval=0.5)
     disk = psutil.disk_usage("/")
 
-    # Открытые порты
-    ports = []
-    try:
-        seen = set()
-        for conn in psutil.net_connections(kind="inet"):
-            if conn.status == "LISTEN" and conn.laddr:
-                key = (conn.laddr.port, "TCP")
-                if key not in seen:
-                    seen.add(key)
-                    pname = "?"
-                    try:
-                        if conn.pid:
-                            pname = psutil.Process(conn.pid).name()
-                    except Exception:
-                        pass
-                    ports.append(f"  TCP:{conn.laddr.port} → {pname}")
-    except Exception:
-        pass
-    ports_str = "\n".join(sorted(ports[:25])) or "  нет"
+    # слушающие порты — из снимка port_tracker, без обхода сокетов
+    if not HAVE_PROC_NET:
+        ports_str = "  нет данных (/proc/net недоступен)"
+    else:
+        _ports_ready.wait(2)   # сразу после старта базовый снимок может быть ещё не готов
+        ports = sorted(list(listen_ports.values()), key=lambda p: (p["port"], p["proto"]))
+        lines = [f"  {_fmt_port(p)} → {p['name']}" for p in ports[:PORTS_MAX_LINES]]
+        if len(ports) > PORTS_MAX_LINES:
+            lines.append(f"  … ещё {len(ports) - PORTS_MAX_LINES}")
+        ports_str = "\n".join(lines) or "  нет"
 
     return (
         f"📊 <b>Статус системы</b>  <i>{datetime.now().strftime('%H:%M:%S')}</i>\n\n"
@@ -340,143 +1539,1130 @@ def fmt_system_status() -> str:
         f"💾 <b>RAM:</b> {mem.used/1024**3:.1f} / {mem.total/1024**3:.1f} GB ({mem.percent}%)\n"
         f"🔄 <b>Swap:</b> {swap.used/1024**3:.1f} / {swap.total/1024**3:.1f} GB ({swap.percent}%)\n\n"
         f"💿 <b>Диск /:</b> {disk.used/1024**3:.1f} / {disk.total/1024**3:.1f} GB ({disk.percent}%)\n\n"
-        f"🔌 <b>Открытые порты (TCP LISTEN):</b>\n{ports_str}"
+        f"🔌 <b>Слушающие порты (TCP/UDP):</b>\n{ports_str}"
     )
 
 def fmt_stats_total() -> str:
-    total = sum(len(v) for v in process_stats.values())
-    unique = len(process_stats)
-    top = sorted(process_stats.items(), key=lambda x: len(x[1]), reverse=True)[:10]
+    items = list(process_stats.items())
+    total = sum(v["n"] for _, v in items)
+    unique = len(items)
+    top = heapq.nlargest(10, items, key=lambda x: x[1]["n"])
     lines = [f"📈 <b>Общая статистика</b>\n",
              f"Всего событий: <b>{total}</b>",
              f"Уникальных процессов: <b>{unique}</b>\n",
              "<b>Топ-10:</b>"]
-    for i, (name, stats) in enumerate(top, 1):
-        lines.append(f"{i}. <code>{name}</code> — {len(stats)}")
+    for i, (name, entry) in enumerate(top, 1):
+        lines.append(f"{i}. <code>{name}</code> — {entry['n']}")
+    return "\n".join(lines)
+
+def fmt_group_stats() -> str:
+    items = list(group_stats.items())
+    if not items:
+        return "📦 Пока нет событий из юнитов или контейнеров"
+    now = time.time()
+    lines = ["📦 <b>Юниты и контейнеры</b>\n", f"Групп: <b>{len(items)}</b>\n",
+             "<b>Топ-10</b> (всего / за 24 ч):"]
+    for i, (group, entry) in enumerate(heapq.nlargest(10, items, key=lambda x: x[1]["n"]), 1):
+        lines.append(f"{i}. <code>{group}</code> — {entry['n']} / "
+                     f"{history.count_since(entry, now - 86400)}")
     return "\n".join(lines)
 
+def _fmt_ts(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+
 def fmt_proc_stats(name: str) -> str:
-    stats = process_stats.get(name, [])
-    if not stats:
+    entry = stats_lookup(name)
+    if not entry or not entry["n"]:
         return f"📊 Нет статистики для <code>{name}</code>"
-    last = stats[-1]
+    raw = entry["raw"]
+    now = time.time()
     lines = [
         f"📊 <b>Статистика: {name}</b>\n",
-        f"Всего событий: <b>{len(stats)}</b>",
-        f"Первый раз: {stats[0]['ts'][:16]}",
-        f"Последний раз: {last['ts'][:16]}\n",
-        f"Последнее: CPU {last['cpu']:.1f}%  RAM {last['mem']}MB  PID {last['pid']}",
+        f"Всего событий: <b>{entry['n']}</b>",
+        f"Первый раз: {_fmt_ts(entry['first'])}",
+        f"Последний раз: {_fmt_ts(entry['last'])}\n",
+        f"За 24 ч: {history.count_since(entry, now - 86400)}  "
+        f"7 дн: {history.count_since(entry, now - 7 * 86400)}  "
+        f"30 дн: {history.count_since(entry, now - 30 * 86400)}",
     ]
-    if len(stats) >= 2:
-        cpus = [s["cpu"] for s in stats[-20:]]
-        lines.append(f"Среднее CPU (посл.20): {sum(cpus)/len(cpus):.1f}%")
+    if raw["ts"]:
+        lines.append(f"Последнее: CPU {raw['cpu'][-1]:.1f}%  RAM {raw['mem'][-1]}MB  PID {raw['pid'][-1]}")
+    day = history.query(entry, now - 86400, now)
+    if day["count"] >= 2:
+        lines.append(f"CPU за сутки: {_fmt_pct(day['cpu'], '%')}")
+        lines.append(f"RAM за сутки: {_fmt_pct(day['mem'], ' MB')}")
+    load = series_summary(name)
+    if load:
+        lines.append(f"Нагрузка за час: CPU ср. {load[0]:.1f}% / макс. {load[1]:.1f}%, "
+                     f"RAM макс. {load[2]:.1f} MB")
+    return "\n".join(lines)
+
+def _fmt_pct(agg: Optional[tuple], unit: str) -> str:
+    if not agg:
+        return "—"
+    p50, p95, mx, mean = agg
+    if p50 is None:
+        return f"ср. {mean:.1f}{unit} / макс. {mx:.1f}{unit}"
+    return f"p50 {p50:.1f}{unit} / p95 {p95:.1f}{unit} / макс. {mx:.1f}{unit}"
+
+def fmt_history_page(res: Dict, page: int) -> Tuple[str, dict]:
+    rows  = res["rows"]
+    total = max(1, (len(rows) + HIST_PAGE - 1) // HIST_PAGE)
+    page  = max(0, min(page, total - 1))
+    head  = f"📊 <b>История {html.escape(res['name'])}</b>"
+    if res["user"]:
+        head += f"  (user={html.escape(res['user'])})"
+    lines = [head,
+             f"{_fmt_ts(res['since'])} — {_fmt_ts(res['until'])}\n",
+             f"Запусков: <b>{res['count']}</b>  ({res['rate']:.2f}/ч"
+             + (f", пик {res['peak']}/ч)" if res["peak"] else ")"),
+             f"CPU: {_fmt_pct(res['cpu'], '%')}",
+             f"RAM: {_fmt_pct(res['mem'], ' MB')}"]
+    if res["source"] != "raw":
+        width = {60: "минутным", 3600: "часовым", 86400: "суточным"}[res["source"]]
+        lines.append(f"<i>по {width} сводкам: без перцентилей и разбивки по пользователям</i>")
+    if res.get("truncated"):
+        lines.append("<i>фильтр user — только по событиям за последние сутки</i>")
+    if res["users"]:
+        lines.append("\n<b>Пользователи:</b> " + ", ".join(
+            f"{html.escape(u)} — {n}" for u, n in res["users"][:8]))
+    if res["tags"]:
+        title = "Процессы" if res["name"].startswith(("unit:", "ctr:")) else "Юниты/контейнеры"
+        lines.append(f"<b>{title}:</b> " + ", ".join(f"{html.escape(t)} — {n}" for t, n in res["tags"][:8]))
+    if rows:
+        lines.append("")
+        for r in rows[page * HIST_PAGE:(page + 1) * HIST_PAGE]:
+            if res["source"] == "raw":
+                ts, pid, cpu, mem, usr, tag = r
+                lines.append(f"• {_fmt_ts(ts)}  PID {int(pid)}  CPU {cpu:.1f}%  RAM {mem:.1f}MB  "
+                             f"{html.escape(usr)}" + (f"  {html.escape(tag)}" if tag else ""))
+            else:
+                start, cnt, cpu_sum, cpu_max, mem_sum, mem_max = r
+                lines.append(f"• {_fmt_ts(start)}  ×{int(cnt)}  CPU ср. {cpu_sum / cnt:.1f}%  "
+                             f"RAM макс. {mem_max:.1f}MB")
+    nav = []
+    if page > 0:
+        nav.append({"text": "◀️ Назад", "callback_data": f"hist_{page-1}"})
+    if total > 1:
+        nav.append({"text": f"{page+1}/{total}", "callback_data": f"hist_{page}"})
+    if page < total - 1:
+        nav.append({"text": "Вперёд ▶️", "callback_data": f"hist_{page+1}"})
+    markup = {"inline_keyboard": [nav] if nav else []}
+    return "\n".join(lines), markup
+
+# ─────────────────────────────────────────────
+#  ПОСЛЕДНИЕ СОБЫТИЯ
+#  Каждое событие (своё, агента, отфильтрованное или нет) пишется в
+#  кольцевой буфер ringbuf.py в /dev/shm. /recent и /history без
+#  статистики читают его, pmctl.py tail — снаружи, без Telegram.
+# ─────────────────────────────────────────────
+ring: Optional[ringbuf.Ring] = None
+
+def ring_open() -> None:
+    global ring
+    if not RING_FILE:
+        return
+    try:
+        ring = ringbuf.Ring(RING_FILE, RING_SLOTS, writable=True)
+    except (OSError, ValueError) as e:
+        _log("errors", "warning", "Кольцевой буфер %s недоступен: %s", RING_FILE, e)
+        return
+    _log("startup", "info", "🔁 Кольцевой буфер %s: %d слотов, записей %d",
+         RING_FILE, ring.slots, ring.head)
+
+def ring_note(info: Dict, notified: bool) -> None:
+    if ring is None or dry_run:
+        return
+    flags = ((ringbuf.FLAG_NOTIFIED if notified else 0)
+             | (ringbuf.FLAG_ANOMALY if info.get("anomaly") else 0)
+             | (ringbuf.FLAG_REMOTE if info.get("host") else 0))
+    ring.append(info, flags)
+
+def fmt_recent(recs: List[Dict], title: str) -> str:
+    lines = [title]
+    for r in recs:
+        mark = "🧠" if r["flags"] & ringbuf.FLAG_ANOMALY else ("🔔" if r["flags"] & ringbuf.FLAG_NOTIFIED else "•")
+        lines.append(
+            f"{mark} {datetime.fromtimestamp(r['seen']).strftime('%H:%M:%S')} <b>{html.escape(r['name'])}</b> "
+            f"(PID {r['pid']}) CPU {r['cpu']:.1f}% RAM {r['memory_mb']}MB 👤{html.escape(r['username'])}"
+            + (f" 📦{html.escape(r['group'])}" if r["group"] else "")
+            + (f" 🛰{html.escape(r['host'])}" if r["host"] else ""))
+    if not recs:
+        lines.append("Событий нет.")
     return "\n".join(lines)
 
+# ─────────────────────────────────────────────
+#  CGROUP, КОНТЕЙНЕРЫ, SYSTEMD-ЮНИТЫ
+#  На процесс — одно чтение /proc/<pid>/cgroup; разбор пути и поиск имени
+#  контейнера делаются один раз на cgroup и кэшируются по пути (LRU):
+#  сотни процессов в секунду приходятся на несколько десятков cgroup.
+# ─────────────────────────────────────────────
+# (runtime, id): docker-<id>.scope, cri-containerd-<id>.scope, crio-<id>.scope,
+# libpod-<id>.scope и cgroupfs-вариант /docker/<id>, /kubepods/…/<id>
+_CTR_SCOPE_RE = re.compile(r"(docker|cri-containerd|crio|libpod)-([0-9a-f]{12,64})\.scope")
+_CTR_PATH_RE  = re.compile(r"/(docker|kubepods|containerd|libpod)\b.*?/([0-9a-f]{64})(?:/|$)")
+_LXC_RE       = re.compile(r"/lxc(?:\.payload)?[./]([^/]+)")
+_UNIT_SUFFIX  = (".service", ".scope", ".socket", ".mount", ".swap", ".timer")
+_RUNTIME_NAME = {"cri-containerd": "containerd", "crio": "cri-o", "libpod": "podman",
+                 "kubepods": "k8s"}
+_NO_CGROUP    = {"cgroup": "", "unit": None, "container": None, "container_id": None,
+                 "runtime": None}
+_cgroup_cache: "OrderedDict[str, Dict]" = OrderedDict()
+_cgroup_lock  = Lock()   # кэш общий для ProcessMonitor и учёта ресурсов
+
+def _read_cgroup(pid: int) -> str:
+    """Путь cgroup процесса: v2 (0::) или, в гибридном режиме, name=systemd из v1."""
+    try:
+        with open(f"/proc/{pid}/cgroup") as f:
+            text = f.read()
+    except OSError:
+        return ""
+    v2 = sd = first = ""
+    for line in text.splitlines():
+        hid, ctrls, path = line.split(":", 2)
+        if hid == "0":
+            v2 = path
+        elif "name=systemd" in ctrls:
+            sd = path
+        elif not first:
+            first = path
+    return v2 if v2 not in ("", "/") else (sd or v2 or first)
+
+def _docker_name(cid: str) -> Optional[str]:
+    try:
+        with open(f"{DOCKER_ROOT}/containers/{cid}/config.v2.json", encoding="utf-8") as f:
+            return json.load(f).get("Name", "").lstrip("/") or None
+    except (OSError, ValueError):
+        return None
+
+def _parse_cgroup(path: str) -> Dict:
+    attrs = dict(_NO_CGROUP, cgroup=path)
+    for part in reversed(path.split("/")):
+        if part.endswith(_UNIT_SUFFIX):
+            attrs["unit"] = part
+            break
+    m = _CTR_SCOPE_RE.search(path) or _CTR_PATH_RE.search(path)
+    if m:
+        runtime, cid = m.group(1), m.group(2)
+        attrs["runtime"]      = _RUNTIME_NAME.get(runtime, runtime)
+        attrs["container_id"] = cid
+        attrs["container"]    = (_docker_name(cid) if runtime == "docker" else None) or cid[:12]
+    else:
+        m = _LXC_RE.search(path)
+        if m:
+            attrs.update(runtime="lxc", container_id=m.group(1), container=m.group(1))
+    return attrs
+
+def cgroup_attrs(pid: int) -> Dict:
+    """cgroup, юнит и контейнер процесса (словарь общий для всех процессов cgroup)."""
+    path = _read_cgroup(pid)
+    if not path:
+        return _NO_CGROUP
+    with _cgroup_lock:
+        attrs = _cgroup_cache.get(path)
+        if attrs is not None:
+            _cgroup_cache.move_to_end(path)
+            return attrs
+    attrs = _parse_cgroup(path)
+    with _cgroup_lock:
+        _cgroup_cache[path] = attrs
+        if len(_cgroup_cache) > CGROUP_CACHE_MAX:
+            _cgroup_cache.popitem(last=False)
+    return attrs
+
+def proc_group(info: Dict) -> str:
+    """Ключ группы для фильтров и статистики: «ctr:…», «unit:…» или ""."""
+    if info.get("container"):
+        return f"ctr:{info['container']}"
+    if info.get("unit"):
+        return f"unit:{info['unit']}"
+    return ""
+
 # ─────────────────────────────────────────────
 #  ЛОГИКА ПРОЦЕССОВ
 # ─────────────────────────────────────────────
 def get_proc_info(proc: psutil.Process) -> Optional[Dict]:
     try:
         with proc.oneshot():
-            return {
+            info = {
                 "pid":        proc.pid,
                 "name":       proc.name(),
                 "exe":        proc.exe() or "N/A",
                 "cmdline":    " ".join(proc.cmdline()) if proc.cmdline() else "N/A",
                 "username":   proc.username(),
                 "create_time":datetime.fromtimestamp(proc.create_time()).strftime("%Y-%m-%d %H:%M:%S"),
+                "create_ts":  proc.create_time(),
                 "status":     proc.status(),
                 "cpu":        proc.cpu_percent(interval=0.1),
                 "memory_mb":  round(proc.memory_info().rss / 1024**2, 1),
             }
     except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
         return None
+    info.update(cgroup_attrs(info["pid"]))
+    return info
 
 def should_notify(info: Dict, cid: str) -> bool:
     s = get_settings(cid)
+    if s["mode"] == "smart" and info.get("anomaly"):
+        return True   # аномалии в умном режиме проходят мимо порогов и чёрного списка
     if info["cpu"] < s["min_cpu_percent"]:
         return False
     if info["memory_mb"] < s["min_memory_mb"]:
         return False
+    return passes_filters(info, cid)
+
+def in_list(info: Dict, items: Set[str]) -> bool:
+    """Есть ли процесс в списке — по имени или группе («unit:nginx.service», «ctr:web»)."""
+    if info["name"] in items:
+        return True
+    if info.get("container") and f"ctr:{info['container']}" in items:
+        return True
+    return bool(info.get("unit")) and f"unit:{info['unit']}" in items
+
+def passes_filters(info: Dict, cid: str) -> bool:
+    """Фильтр по режиму и спискам, без порогов CPU/RAM."""
+    s = get_settings(cid)
     mode = s["mode"]
     name = info["name"]
-    in_wl = name in whitelist_procs
-    in_bl = name in ignored_procs
-    in_sys= name in DEFAULT_SYSTEM and s["ignore_system"]
+    in_wl = in_list(info, whitelist_procs)
+    in_bl = in_list(info, ignored_procs)
+    # системные имена внутри контейнеров — это уже чужие процессы, их не скрываем
+    in_sys= name in DEFAULT_SYSTEM and s["ignore_system"] and not info.get("container")
     if mode == "whitelist":
         return in_wl
     elif mode == "blacklist":
         return not in_bl and not in_sys
     elif mode == "smart":
-        if in_wl: return True
+        if in_wl or info.get("anomaly"): return True
         return not in_bl and not in_sys
     return True
 
-def is_quiet(cid: str) -> bool:
+def is_quiet(cid: str, now: Optional[datetime] = None) -> bool:
+    """now — время для проверки (при воспроизведении — время записи)."""
     s = get_settings(cid)
     if not s["quiet_hours_enabled"]:
         return False
-    now   = datetime.now().time()
+    now   = (now or datetime.now()).time()
     start = datetime.strptime(s["quiet_hours_start"], "%H:%M").time()
     end   = datetime.strptime(s["quiet_hours_end"],   "%H:%M").time()
     return (now >= start or now <= end) if start > end else (start <= now <= end)
 
+def _stats_entry(store: Dict[str, Dict], key: str) -> Dict:
+    entry = store.get(key)
+    if entry is None:
+        entry = store[key] = history.new_entry()
+    return entry
+
 def record_stat(info: Dict) -> None:
-    name = info["name"]
-    process_stats[name].append({
-        "ts":  info["create_time"],
-        "pid": info["pid"],
-        "cpu": info["cpu"],
-        "mem": info["memory_mb"],
-        "usr": info["username"],
-    })
-    if len(process_stats[name]) > 2000:
-        process_stats[name] = process_stats[name][-2000:]
+    name  = info["name"]
+    group = proc_group(info)
+    ts    = info.get("create_ts") or time.time()
+    history.record(_stats_entry(process_stats, name), ts, info["pid"],
+                   info["cpu"], info["memory_mb"], info["username"], group)
+    if group:
+        history.record(_stats_entry(group_stats, group), ts, info["pid"],
+                       info["cpu"], info["memory_mb"], info["username"], name)
+
+def stats_lookup(key: str) -> Optional[Dict]:
+    """Запись статистики по имени процесса или группе «unit:…»/«ctr:…»."""
+    if key.startswith(("unit:", "ctr:")):
+        return group_stats.get(key)
+    return process_stats.get(key)
 
 # ─────────────────────────────────────────────
-#  ОБРАБОТЧИКИ КОМАНД
+#  ДЕТЕКТОР АНОМАЛИЙ
+#  Онлайн-статистика на имя процесса, O(1) на событие:
+#  EWMA интервала между запусками (медленная — «обычно», быстрая —
+#  «сейчас») и экспоненциально взвешенные среднее/дисперсия CPU и RSS.
 # ─────────────────────────────────────────────
-def cmd_start(cid: str, username: str) -> None:
-    if cid not in active_users:
-        active_users.add(cid)
-        user_settings[cid] = DEFAULT_SETTINGS.copy()
-        save_all()
-    log.info("User %s (%s) started", username, cid)
-    send_message(cid,
-        "✅ <b>Process Monitor Pro</b> — активирован!\n\n"
-        "🔔 Уведомления о новых процессах включены.\n"
-        "Используй кнопки меню для управления.",
-        markup=kb_main())
+# имя → [n, last_ts, iv_slow, iv_fast, cpu_mean, cpu_var, mem_mean, mem_var, last_flag_ts]
+anomaly_state: "OrderedDict[str, List[float]]" = OrderedDict()
+_anomaly_started = time.time()
 
-def cmd_stop(cid: str) -> None:
-    active_users.discard(cid)
-    save_all()
-    send_message(cid, "👋 Уведомления отключены.\nНапиши /start чтобы включить снова.")
+def _ew_update(mean: float, var: float, x: float, alpha: float) -> Tuple[float, float]:
+    diff = x - mean
+    incr = alpha * diff
+    return mean + incr, (1 - alpha) * (var + diff * incr)
 
-def cmd_status(cid: str) -> None:
-    send_message(cid, fmt_system_status(), markup=kb_status())
+def _zscore(x: float, mean: float, var: float, floor: float) -> float:
+    return (x - mean) / max(math.sqrt(max(var, 0.0)), floor)
 
-def cmd_help(cid: str) -> None:
-    send_message(cid, "❓ <b>Помощь</b>\n\nВыберите раздел:", markup=kb_help())
+def anomaly_observe(info: Dict, now: Optional[float] = None) -> Optional[str]:
+    """Учесть событие; вернуть описание аномалии или None.
+    now — текущее время (при воспроизведении — время записи)."""
+    now  = time.time() if now is None else now
+    name = info["name"]
+    ts   = info.get("create_ts") or now
+    cpu, mem = info["cpu"], info["memory_mb"]
+    st = anomaly_state.get(name)
+    reason, kind = None, None
+    if st is None:
+        if now - _anomaly_started > ANOMALY_WARMUP and name not in process_stats:
+            reason, kind = "процесс с таким именем замечен впервые", "new_name"
+        if len(anomaly_state) >= ANOMALY_MAX_NAMES:
+            anomaly_state.popitem(last=False)
+        anomaly_state[name] = [1, ts, 0.0, 0.0, cpu, 0.0, mem, 0.0, ts if reason else 0.0]
+        if kind:
+            M_ANOMALIES.inc(1, kind)
+        return reason
 
-def cmd_settings(cid: str) -> None:
-    send_message(cid, "⚙️ <b>Настройки мониторинга</b>", markup=kb_settings(cid))
+    anomaly_state.move_to_end(name)
+    n, last_ts, iv_slow, iv_fast, cpu_m, cpu_v, mem_m, mem_v, flagged = st
+    iv = max(ts - last_ts, 1e-3)
+    if n == 1:
+        iv_slow = iv_fast = iv
+    else:
+        iv_slow += ANOMALY_ALPHA_SLOW * (iv - iv_slow)
+        iv_fast += ANOMALY_ALPHA_FAST * (iv - iv_fast)
 
-def cmd_list(cid: str, list_type: str = "ignored") -> None:
-    items = sorted(ignored_procs if list_type == "ignored" else whitelist_procs)
-    PER   = 8
-    total = max(1, (len(items) + PER - 1) // PER)
-    title = "🚫 Игнорируемые" if list_type == "ignored" else "⭐ Белый список"
-    send_message(cid,
-        f"<b>{title}</b>  (стр. 1/{total}, всего {len(items)})",
-        markup=kb_list_page(list_type, 0, total, items))
+    if n >= ANOMALY_MIN_EVENTS:
+        z_mem = _zscore(mem, mem_m, mem_v, max(1.0, 0.1 * mem_m))
+        z_cpu = _zscore(cpu, cpu_m, cpu_v, 1.0)
+        rate  = iv_slow / max(iv_fast, 1e-3)
+        if rate >= ANOMALY_RATE_FACTOR:
+            reason, kind = f"запускается в {rate:.0f}× чаще обычного", "spawn_rate"
+        elif z_mem >= ANOMALY_Z:
+            reason, kind = f"RAM {mem:.1f} MB при обычных {mem_m:.1f} MB", "memory"
+        elif z_cpu >= ANOMALY_Z:
+            reason, kind = f"CPU {cpu:.1f}% при обычных {cpu_m:.1f}%", "cpu"
 
-def cmd_quiet(cid: str, arg: str) -> None:
-    if arg == "off":
-        get_settings(cid)["quiet_hours_enabled"] = False
-        _save(SETTINGS_FILE, user_settings)
-        send_message(cid, "🔊 Тихие часы отключены.", markup=kb_settings(cid))
-        return
+    cpu_m, cpu_v = _ew_update(cpu_m, cpu_v, cpu, ANOMALY_ALPHA_SLOW)
+    mem_m, mem_v = _ew_update(mem_m, mem_v, mem, ANOMALY_ALPHA_SLOW)
+    if reason and ts - flagged < ANOMALY_COOLDOWN:
+        reason = None
+    if reason:
+        flagged = ts
+        M_ANOMALIES.inc(1, kind)
+    anomaly_state[name] = [n + 1, max(ts, last_ts), iv_slow, iv_fast,
+                           cpu_m, cpu_v, mem_m, mem_v, flagged]
+    return reason
+
+# ─────────────────────────────────────────────
+#  СЛЕЖЕНИЕ ЗА РЕСУРСАМИ
+#  При запуске процесс почти ничего не потребляет, поэтому интересные
+#  процессы (белый список или подпадающие под пороги какого-то чата)
+#  замеряются и дальше, раз в SAMPLE_INTERVAL.
+# ─────────────────────────────────────────────
+_sampler_lock = Lock()
+# pid → {"proc", "info", "streak": {cid: n}, "done": {cid, ...}}
+_tracked:       Dict[int, Dict]  = {}
+# имя → deque([bucket_ts, n, cpu_sum, cpu_max, rss_max_mb])
+resource_series: Dict[str, deque] = {}
+
+def _has_thresholds(s: Dict) -> bool:
+    return s["min_cpu_percent"] > 0 or s["min_memory_mb"] > 0
+
+def sampler_track(proc: psutil.Process, info: Dict, notified: Set[str]) -> None:
+    """Поставить процесс под наблюдение, если он кому-то интересен.
+    notified — чаты, уже получившие уведомление о запуске."""
+    watch = in_list(info, whitelist_procs) or any(
+        _has_thresholds(get_settings(cid)) and cid not in notified and passes_filters(info, cid)
+        for cid in list(active_users))
+    if not watch:
+        return
+    with _sampler_lock:
+        if len(_tracked) >= SAMPLE_MAX_TRACKED:
+            _tracked.pop(next(iter(_tracked)))   # вытесняем самый старый
+        _tracked[info["pid"]] = {"proc": proc, "info": info,
+                                 "streak": {}, "done": set(notified)}
+
+def _series_add(name: str, ts: float, cpu: float, rss_mb: float) -> None:
+    series = resource_series.get(name)
+    if series is None:
+        if len(resource_series) >= SERIES_MAX_NAMES:
+            resource_series.pop(next(iter(resource_series)))
+        series = resource_series[name] = deque(maxlen=SERIES_POINTS)
+    bucket = int(ts // SERIES_BUCKET * SERIES_BUCKET)
+    if series and series[-1][0] == bucket:
+        pt = series[-1]
+        pt[1] += 1
+        pt[2] += cpu
+        pt[3] = max(pt[3], cpu)
+        pt[4] = max(pt[4], rss_mb)
+    else:
+        series.append([bucket, 1, cpu, cpu, rss_mb])
+
+def series_summary(name: str, minutes: int = 60) -> Optional[Tuple[float, float, float]]:
+    """(средний CPU, максимальный CPU, максимальный RSS MB) за последние minutes."""
+    series = resource_series.get(name)
+    if not series:
+        return None
+    since = time.time() - minutes * 60
+    pts = [p for p in list(series) if p[0] >= since]
+    if not pts:
+        return None
+    n = sum(p[1] for p in pts)
+    return sum(p[2] for p in pts) / n, max(p[3] for p in pts), max(p[4] for p in pts)
+
+def fmt_resource_alert(info: Dict, cpu: float, mem: float) -> str:
+    held = SAMPLE_SUSTAIN * SAMPLE_INTERVAL
+    return (
+        f"🔥 <b>Длительная нагрузка</b> (≥ {held} с)\n"
+        f"📋 <b>Название:</b> <code>{info['name']}</code>\n"
+        f"🆔 <b>PID:</b> {info['pid']}\n"
+        f"👤 <b>Пользователь:</b> {info['username']}\n"
+        f"📅 <b>Запущен:</b> {info['create_time']}\n"
+        f"{_fmt_origin(info)}"
+        f"⚙️ <b>CPU:</b> {cpu:.1f}%\n"
+        f"💾 <b>RAM:</b> {mem:.1f} MB"
+    )
+
+def sample_tracked() -> None:
+    """Один проход: замер всех отслеживаемых процессов и проверка порогов."""
+    now = time.time()
+    with _sampler_lock:
+        entries = list(_tracked.items())
+    gone = []
+    readings = []
+    for pid, e in entries:
+        proc = e["proc"]
+        try:
+            with proc.oneshot():
+                cpu = proc.cpu_percent(None)   # с прошлого замера, без ожидания
+                mem = round(proc.memory_info().rss / 1024**2, 1)
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            gone.append(pid)
+            continue
+        readings.append((e, cpu, mem))
+        _series_add(e["info"]["name"], now, cpu, mem)
+    if gone:
+        with _sampler_lock:
+            for pid in gone:
+                _tracked.pop(pid, None)
+
+    users = list(active_users)
+    alerts = []
+    for e, cpu, mem in readings:
+        info = e["info"]
+        for cid in users:
+            if cid in e["done"]:
+                continue
+            s = get_settings(cid)
+            over = (_has_thresholds(s) and cpu >= s["min_cpu_percent"]
+                    and mem >= s["min_memory_mb"])
+            streak = e["streak"][cid] = e["streak"].get(cid, 0) + 1 if over else 0
+            if streak < SAMPLE_SUSTAIN or is_quiet(cid) or not passes_filters(info, cid):
+                continue
+            e["done"].add(cid)
+            M_RES_ALERTS.inc()
+            alerts.append((cid, fmt_resource_alert(info, cpu, mem),
+                           kb_process(info["name"], info), notify_priority([info])))
+    if alerts:
+        # замеры не ждут Telegram: отправку берут потоки рассылки
+        broadcast(alerts, on_sent=lambda cid, mid: None)
+
+# ─────────────────────────────────────────────
+#  УЧЁТ РЕСУРСОВ (/top)
+#  Раз в SAMPLE_INTERVAL — один проход по /proc/<pid>/stat всех процессов.
+#  Прирост CPU-тиков с прошлого прохода раскладывается по пользователю,
+#  группе (контейнер/юнит) и имени в минутные бакеты окна TOP_WINDOW;
+#  суммы по окну ведутся инкрементально (бакет, выпавший из окна,
+#  вычитается). Пользователь и группа определяются один раз на процесс.
+# ─────────────────────────────────────────────
+HAVE_PROC_STAT = os.path.exists("/proc/self/stat")
+_CLK_TCK   = os.sysconf("SC_CLK_TCK") if HAVE_PROC_STAT else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if HAVE_PROC_STAT else 4096
+TOP_DIMS   = (("user", "👤 Пользователи"), ("group", "📦 Юниты и контейнеры"), ("name", "📋 Процессы"))
+
+_acct_lock = Lock()
+# pid → (starttime в тиках, CPU-тики на прошлом проходе, ключи)
+_acct_procs:   Dict[int, Tuple[int, int, Tuple[Tuple[str, str], ...]]] = {}
+# [(начало бакета, {ключ: [CPU сек, пик суммарного RSS байт, запусков]})]
+_acct_buckets: deque = deque()
+_acct_totals:  Dict[Tuple[str, str], List[float]] = {}   # ключ → [CPU сек, запусков] за окно
+_acct_swept:   float = 0.0
+_uid_names:    Dict[int, str] = {}
+
+def _uid_name(uid: int) -> str:
+    name = _uid_names.get(uid)
+    if name is None:
+        try:
+            name = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            name = str(uid)
+        _uid_names[uid] = name
+    return name
+
+def _read_stat(pid: int) -> Optional[Tuple[str, int, int, int]]:
+    """(comm, utime+stime в тиках, starttime в тиках, RSS в байтах) из /proc/<pid>/stat."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    lp, rp = data.find(b"("), data.rfind(b")")   # comm может содержать пробелы и скобки
+    fields = data[rp + 2:].split()
+    try:
+        return (data[lp + 1:rp].decode(errors="replace"), int(fields[11]) + int(fields[12]),
+                int(fields[19]), int(fields[21]) * _PAGE_SIZE)
+    except (IndexError, ValueError):
+        return None
+
+def _acct_keys(pid: int, comm: str) -> Tuple[Tuple[str, str], ...]:
+    try:
+        user = _uid_name(os.stat(f"/proc/{pid}").st_uid)
+    except OSError:
+        user = "?"
+    return (("user", user), ("group", proc_group(cgroup_attrs(pid)) or "—"), ("name", comm))
+
+def _acct_bucket(now: float) -> Dict:
+    start = now // TOP_BUCKET * TOP_BUCKET
+    while _acct_buckets and _acct_buckets[0][0] <= now - TOP_WINDOW:
+        _, old = _acct_buckets.popleft()
+        for key, (cpu, _, spawns) in old.items():
+            tot = _acct_totals.get(key)
+            if tot is None:   # в бакете только RSS, в суммы ключ не попадал
+                continue
+            tot[0] -= cpu
+            tot[1] -= spawns
+            if tot[0] < 1e-9 and tot[1] <= 0:
+                del _acct_totals[key]
+    if not _acct_buckets or _acct_buckets[-1][0] != start:
+        _acct_buckets.append((start, {}))
+    return _acct_buckets[-1][1]
+
+def acct_sweep(now: Optional[float] = None) -> None:
+    """Один проход по /proc: приросты CPU, суммарный RSS и новые процессы."""
+    global _acct_swept
+    now = now or time.time()
+    baseline = not _acct_swept
+    procs: Dict[int, Tuple[int, int, Tuple[Tuple[str, str], ...]]] = {}
+    cpu_d:  Dict[Tuple[str, str], float] = defaultdict(float)
+    rss_d:  Dict[Tuple[str, str], int]   = defaultdict(int)
+    spawn_d:Dict[Tuple[str, str], int]   = defaultdict(int)
+    for d in os.listdir("/proc"):
+        if not d.isdigit():
+            continue
+        pid = int(d)
+        st  = _read_stat(pid)
+        if st is None:
+            continue
+        comm, ticks, start, rss = st
+        prev = _acct_procs.get(pid)
+        if prev is not None and prev[0] == start:
+            keys, delta = prev[2], ticks - prev[1]
+        else:
+            # новый процесс: всё его время — с прошлого прохода (на первом проходе — база)
+            keys, delta = _acct_keys(pid, comm), 0 if baseline else ticks
+            if not baseline:
+                for k in keys:
+                    spawn_d[k] += 1
+        procs[pid] = (start, ticks, keys)
+        for k in keys:
+            rss_d[k] += rss
+            if delta:
+                cpu_d[k] += delta / _CLK_TCK
+
+    with _acct_lock:
+        bucket = _acct_bucket(now)
+        for k, rss in rss_d.items():
+            row = bucket.get(k)
+            if row is None:
+                row = bucket[k] = [0.0, 0, 0]
+            cpu, spawns = cpu_d.get(k, 0.0), spawn_d.get(k, 0)
+            row[0] += cpu
+            row[1] = max(row[1], rss)
+            row[2] += spawns
+            if cpu or spawns:
+                tot = _acct_totals.get(k)
+                if tot is None:
+                    tot = _acct_totals[k] = [0.0, 0]
+                tot[0] += cpu
+                tot[1] += spawns
+        _acct_procs.clear()
+        _acct_procs.update(procs)
+        _acct_swept = now
+
+def top_rows(dim: str, n: int) -> List[Tuple[str, float, int, int]]:
+    """[(значение, CPU сек, пик RSS байт, запусков)] за окно, по убыванию CPU."""
+    with _acct_lock:
+        items = [(k[1], v) for k, v in _acct_totals.items() if k[0] == dim]
+        top   = heapq.nlargest(n, items, key=lambda x: (x[1][0], x[1][1]))
+        rows  = []
+        for value, (cpu, spawns) in top:
+            key  = (dim, value)
+            peak = max((b[key][1] for _, b in _acct_buckets if key in b), default=0)
+            rows.append((value, cpu, peak, int(spawns)))
+    return rows
+
+def fmt_top(dim: Optional[str] = None) -> str:
+    if not HAVE_PROC_STAT:
+        return "📊 /top недоступен: нет /proc"
+    if not _acct_swept:
+        return "📊 Данные ещё собираются, попробуйте через минуту"
+    span = min(TOP_WINDOW, time.time() - _acct_buckets[0][0]) if _acct_buckets else 0
+    lines = [f"🏋️ <b>Самые тяжёлые</b>  <i>за {max(1, round(span / 60))} мин</i>",
+             "<i>CPU-сек · пик RSS · запусков</i>"]
+    for d, title in TOP_DIMS:
+        if dim and d != dim:
+            continue
+        rows = top_rows(d, TOP_ROWS * 3 if dim else TOP_ROWS)
+        lines.append(f"\n<b>{title}</b>")
+        if not rows:
+            lines.append("  нет данных")
+        for value, cpu, peak, spawns in rows:
+            lines.append(f"<code>{value[:32]}</code>  {cpu:.1f} · {peak / 1024**2:.0f} MB · {spawns}")
+    return "\n".join(lines)
+
+# ─────────────────────────────────────────────
+#  СЛУШАЮЩИЕ ПОРТЫ
+#  Таблицы /proc/net/{tcp,udp}{,6} читаются напрямую и сравниваются между
+#  снимками по (протокол, адрес:порт). Владелец сокета ищется по inode
+#  в /proc/<pid>/fd только для новых слушателей: сначала у процессов,
+#  появившихся с прошлого поиска, и лишь затем у всех. Найденное кэшируется.
+# ─────────────────────────────────────────────
+HAVE_PROC_NET = os.path.exists("/proc/net/tcp")
+# (файл, протокол, состояние «слушает»: TCP_LISTEN / несоединённый UDP)
+_PROC_NET = (("tcp", "tcp", "0A"), ("tcp6", "tcp", "0A"),
+             ("udp", "udp", "07"), ("udp6", "udp", "07"))
+# (протокол, local_address как в /proc/net) → {"proto","addr","port","inode","pid","name"}
+listen_ports:  Dict[Tuple[str, str], Dict] = {}
+_ports_seen:   Dict[Tuple[str, str], int]  = {}   # ещё не подтверждённые → снимков подряд
+_inode_owner:  Dict[int, Tuple[int, str]]  = {}   # inode сокета → (pid, имя)
+_fd_scanned:   Set[int]                    = set()
+_ports_ready:  Event                       = Event()   # базовый снимок сделан
+
+def _read_listeners() -> Dict[Tuple[str, str], int]:
+    """Слушающие сокеты: (протокол, local_address) → inode."""
+    out: Dict[Tuple[str, str], int] = {}
+    for fname, proto, state in _PROC_NET:
+        try:
+            with open(f"/proc/net/{fname}") as f:
+                next(f, None)   # заголовок
+                for line in f:
+                    parts = line.split()
+                    if len(parts) > 9 and parts[3] == state:
+                        out[(proto, parts[1])] = int(parts[9])
+        except OSError:
+            continue
+    return out
+
+def _decode_addr(hexaddr: str) -> Tuple[str, int]:
+    """'0100007F:0035' → ('127.0.0.1', 53); IPv6 — четыре слова little-endian."""
+    ip_hex, port_hex = hexaddr.split(":")
+    raw = bytes.fromhex(ip_hex)
+    if len(raw) == 4:
+        ip = socket.inet_ntop(socket.AF_INET, raw[::-1])
+    else:
+        ip = socket.inet_ntop(socket.AF_INET6,
+                              b"".join(raw[i:i + 4][::-1] for i in range(0, 16, 4)))
+    return ip, int(port_hex, 16)
+
+def _proc_comm(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/comm") as f:
+            return f.read().strip()
+    except OSError:
+        return "?"
+
+def _scan_fds(pids: List[int], wanted: Set[int]) -> None:
+    """Найти владельцев inode из wanted (найденные убираются из wanted)."""
+    for pid in pids:
+        if not wanted:
+            return
+        try:
+            fds = os.scandir(f"/proc/{pid}/fd")
+        except OSError:
+            continue
+        with fds:
+            for fd in fds:
+                try:
+                    link = os.readlink(fd.path)
+                except OSError:
+                    continue
+                if link.startswith("socket:["):
+                    inode = int(link[8:-1])
+                    if inode in wanted:
+                        _inode_owner[inode] = (pid, _proc_comm(pid))
+                        wanted.discard(inode)
+
+def _resolve_owners(inodes: Set[int]) -> None:
+    wanted = {i for i in inodes if i not in _inode_owner}
+    if not wanted:
+        return
+    pids  = [int(d) for d in os.listdir("/proc") if d.isdigit()]
+    _fd_scanned.intersection_update(pids)
+    fresh = [p for p in pids if p not in _fd_scanned]
+    _scan_fds(fresh, wanted)          # новый слушатель — почти всегда новый процесс
+    _fd_scanned.update(fresh)
+    if wanted:
+        _scan_fds(pids, wanted)       # новый сокет у давно работающего процесса
+
+def ports_scan() -> Tuple[List[Dict], List[Dict]]:
+    """Снимок слушающих сокетов; возвращает (открытые, закрытые) с прошлого снимка.
+    Первый снимок — базовый: всё считается уже открытым, без уведомлений."""
+    cur = _read_listeners()
+    baseline = not _ports_ready.is_set()
+    for key in list(_ports_seen):
+        if key not in cur:
+            del _ports_seen[key]
+
+    confirmed, resolve = [], set()
+    for key, inode in cur.items():
+        known = listen_ports.get(key)
+        if known:
+            if known["inode"] != inode:   # перезапуск слушателя между снимками
+                known["inode"] = inode
+                resolve.add(inode)
+            continue
+        n = _ports_seen[key] = _ports_seen.get(key, 0) + 1
+        if baseline or n >= PORTS_CONFIRM:
+            del _ports_seen[key]
+            confirmed.append(key)
+            resolve.add(inode)
+    closed = [listen_ports.pop(key) for key in list(listen_ports) if key not in cur]
+
+    _resolve_owners(resolve)
+    opened = []
+    for key in confirmed:
+        addr, port = _decode_addr(key[1])
+        listen_ports[key] = {"proto": key[0], "addr": addr, "port": port, "inode": cur[key]}
+        opened.append(listen_ports[key])
+    for p in list(listen_ports.values()):
+        if p["inode"] in resolve:
+            p["pid"], p["name"] = _inode_owner.get(p["inode"], (None, "?"))
+
+    live = set(cur.values())
+    for inode in [i for i in _inode_owner if i not in live]:
+        del _inode_owner[inode]
+    _ports_ready.set()
+    return ([], []) if baseline else (opened, closed)
+
+def _fmt_port(p: Dict) -> str:
+    addr = f"[{p['addr']}]" if ":" in p["addr"] else p["addr"]
+    return f"{p['proto'].upper()} {addr}:{p['port']}"
+
+def fmt_ports_change(opened: List[Dict], closed: List[Dict]) -> str:
+    lines = ["🔌 <b>Изменились слушающие порты</b>"]
+    for title, items in (("🟢 Открыты:", opened), ("🔴 Закрыты:", closed)):
+        if not items:
+            continue
+        lines.append(f"\n<b>{title}</b>")
+        for p in items[:PORTS_MAX_LINES]:
+            owner = f"{p['name']} (PID {p['pid']})" if p.get("pid") else p.get("name", "?")
+            lines.append(f"• <code>{_fmt_port(p)}</code> → {owner}")
+        if len(items) > PORTS_MAX_LINES:
+            lines.append(f"… ещё {len(items) - PORTS_MAX_LINES}")
+    return "\n".join(lines)
+
+# ─────────────────────────────────────────────
+#  ДАЙДЖЕСТЫ
+#  Счётчики на чат обновляются по ходу событий (только у чатов с включённым
+#  дайджестом), в момент отправки остаётся лишь отформатировать их.
+# ─────────────────────────────────────────────
+_digest_lock = Lock()
+digest_state: Dict[str, Dict] = {}   # chat_id → счётчики текущего периода
+known_exes:   Set[str]         = set()
+
+def _digest_new(now: float) -> Dict:
+    return {"since": now, "due": 0, "mode": "off",
+            "events": 0, "muted": 0, "blacklisted": 0, "filtered": 0,
+            "spawners": {}, "spawners_other": 0,
+            "new_bins": [], "new_bins_n": 0,
+            "anomalies": [], "anomalies_n": 0,
+            "ports": [], "ports_opened": 0, "ports_closed": 0}
+
+def _digest_chats() -> List[Tuple[str, Dict]]:
+    """Чаты с включённым дайджестом и их счётчики (вызывать под _digest_lock)."""
+    now, out = time.time(), []
+    for cid in list(active_users):
+        if get_settings(cid)["digest"] == "off":
+            continue
+        st = digest_state.get(cid)
+        if st is None:
+            st = digest_state[cid] = _digest_new(now)
+        out.append((cid, st))
+    return out
+
+def _cap_append(items: list, value, limit: int = DIGEST_MAX_ITEMS) -> None:
+    if len(items) < limit:
+        items.append(value)
+
+def digest_note_event(info: Dict, verdicts: Dict[str, bool], now: Optional[datetime] = None) -> None:
+    """Учесть событие; verdicts — решение should_notify по каждому чату,
+    now — время события (при воспроизведении — время записи)."""
+    exe = info["exe"]
+    new_bin = exe not in ("", "N/A") and exe not in known_exes and len(known_exes) < DIGEST_MAX_EXES
+    if new_bin:
+        known_exes.add(exe)
+    with _digest_lock:
+        chats = _digest_chats()
+        if not chats:
+            return
+        name, ts = info["name"], (now.timestamp() if now else time.time())
+        blacklisted = in_list(info, ignored_procs)
+        for cid, st in chats:
+            if verdicts.get(cid):
+                st["events"] += 1
+                if is_quiet(cid, now):
+                    st["muted"] += 1
+            elif blacklisted:
+                st["blacklisted"] += 1
+            else:
+                st["filtered"] += 1
+            sp = st["spawners"]
+            if name in sp or len(sp) < DIGEST_MAX_NAMES:
+                sp[name] = sp.get(name, 0) + 1
+            else:
+                st["spawners_other"] += 1
+            if new_bin:
+                st["new_bins_n"] += 1
+                _cap_append(st["new_bins"], [exe, name, ts])
+            if info.get("anomaly"):
+                st["anomalies_n"] += 1
+                _cap_append(st["anomalies"], [name, info["anomaly"], ts])
+
+def digest_note_ports(opened: List[Dict], closed: List[Dict]) -> None:
+    with _digest_lock:
+        for _, st in _digest_chats():
+            st["ports_opened"] += len(opened)
+            st["ports_closed"] += len(closed)
+            for sign, items in (("+", opened), ("−", closed)):
+                for p in items:
+                    _cap_append(st["ports"], f"{sign} {_fmt_port(p)} → {p.get('name', '?')}")
+
+def digest_seed(exes: Iterable[str]) -> None:
+    """Первый запуск: всё, что уже работает, новым бинарником не считается."""
+    if not known_exes:
+        known_exes.update(e for e in exes if e)
+
+def _digest_next(s: Dict, after: float) -> float:
+    hh, mm = (int(x) for x in s["digest_time"].split(":"))
+    due = datetime.fromtimestamp(after).replace(hour=hh, minute=mm, second=0, microsecond=0)
+    if due.timestamp() <= after:
+        due += timedelta(days=1)
+    if s["digest"] == "weekly":
+        due += timedelta(days=(7 - due.weekday()) % 7)   # ближайший понедельник
+    return due.timestamp()
+
+def fmt_digest(st: Dict, mode: str) -> str:
+    period = "неделю" if mode == "weekly" else "сутки"
+    lines = [f"📰 <b>Дайджест за {period}</b>",
+             f"<i>{_fmt_ts(st['since'])} — {_fmt_ts(time.time())}</i>\n",
+             f"🔔 Подходящих под фильтры: <b>{st['events']}</b>"
+             + (f" (в тихие часы: {st['muted']})" if st["muted"] else ""),
+             f"🚫 Скрыто чёрным списком: <b>{st['blacklisted']}</b>, "
+             f"прочими фильтрами: {st['filtered']}"]
+    if st["spawners"]:
+        lines.append("\n<b>🔝 Чаще всего запускались:</b>")
+        for name, n in heapq.nlargest(5, st["spawners"].items(), key=lambda x: x[1]):
+            lines.append(f"• <code>{name}</code> — {n}")
+    if st["new_bins_n"]:
+        lines.append(f"\n<b>🆕 Новые бинарники: {st['new_bins_n']}</b>")
+        for exe, name, _ in st["new_bins"][:10]:
+            lines.append(f"• <code>{exe[:120]}</code> ({name})")
+    if st["anomalies_n"]:
+        lines.append(f"\n<b>🧠 Аномалии: {st['anomalies_n']}</b>")
+        for name, reason, ts in st["anomalies"][:10]:
+            lines.append(f"• {_fmt_ts(ts)} <code>{name}</code> — {reason}")
+    if st["ports_opened"] or st["ports_closed"]:
+        lines.append(f"\n<b>🔌 Порты: +{st['ports_opened']} / −{st['ports_closed']}</b>")
+        lines += [f"• <code>{line}</code>" for line in st["ports"][:10]]
+    return "\n".join(lines)
+
+def digest_tick() -> None:
+    """Отправить дайджесты, срок которых подошёл (зовётся из notification_flusher)."""
+    now = time.time()
+    due_now = []
+    with _digest_lock:
+        for cid, st in _digest_chats():
+            s = get_settings(cid)
+            if st["mode"] != s["digest"] or not st["due"]:
+                st["mode"], st["due"] = s["digest"], _digest_next(s, now)
+            elif now >= st["due"]:
+                due_now.append((cid, fmt_digest(st, st["mode"])))
+    for cid, text in due_now:
+        if send_message(cid, text) is None:
+            with _digest_lock:
+                st = digest_state.get(cid)
+                if st is None:
+                    continue
+                st["fails"] = st.get("fails", 0) + 1
+                if st["fails"] < JOURNAL_MAX_ATTEMPTS:
+                    # повтор с нарастающей паузой, а не на каждом проходе flusher
+                    st["due"] = now + FLUSH_INTERVAL * 4 ** st["fails"]
+                    continue
+            _log("tg_errors", "error", "Drop digest for %s after %d attempts", cid, st["fails"])
+        else:
+            M_NOTIFY_TOTAL.inc(1, "digest")
+        with _digest_lock:
+            st = digest_state[cid] = _digest_new(now)
+            s = get_settings(cid)
+            st["mode"], st["due"] = s["digest"], _digest_next(s, now)
+
+def digest_reset(cid: str) -> None:
+    """Сменился режим — начинаем период заново."""
+    with _digest_lock:
+        digest_state.pop(cid, None)
+
+def save_digest() -> None:
+    with _digest_lock:
+        chats = {cid: st for cid, st in digest_state.items() if cid in active_users}
+        data  = {"known_exes": list(known_exes), "chats": chats}
+        _save(DIGEST_FILE, data, indent=None)
+
+# ─────────────────────────────────────────────
+#  МАРШРУТИЗАЦИЯ КОМАНД И CALLBACK
+# ─────────────────────────────────────────────
+class Router:
+    """Точные ключи — словарь, префиксы — trie (побеждает самый длинный).
+    Точный обработчик вызывается как handler(*args), префиксный —
+    handler(*args, rest), где rest — ключ без префикса. На каждый маршрут
+    считаются вызовы и латентность (метрики и /perf)."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._exact: Dict[str, Tuple[str, Callable]] = {}
+        self._trie:  Dict[str, Any] = {}    # символ → узел; "" → (префикс, обработчик)
+
+    def add(self, keys: Tuple[str, ...], handler: Callable) -> None:
+        for key in keys:   # синонимы считаются под первым именем
+            self._exact[key] = (keys[0], handler)
+
+    def exact(self, *keys: str) -> Callable:
+        def deco(fn: Callable) -> Callable:
+            self.add(keys, fn)
+            return fn
+        return deco
+
+    def prefix(self, prefix: str) -> Callable:
+        def deco(fn: Callable) -> Callable:
+            node = self._trie
+            for ch in prefix:
+                node = node.setdefault(ch, {})
+            node[""] = (prefix, fn)
+            return fn
+        return deco
+
+    def resolve(self, key: str) -> Optional[Tuple[str, Callable, Optional[str]]]:
+        """(маршрут, обработчик, остаток ключа или None для точного) или None."""
+        hit = self._exact.get(key)
+        if hit:
+            return hit[0], hit[1], None
+        node, found, depth = self._trie, None, 0
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                break
+            depth += 1
+            if "" in node:
+                found = (node[""], depth)
+        if found is None:
+            return None
+        (route, fn), n = found
+        return route, fn, key[n:]
+
+    def dispatch(self, key: str, *args) -> bool:
+        hit = self.resolve(key)
+        if hit is None:
+            return False
+        route, fn, rest = hit
+        t0 = time.perf_counter()
+        try:
+            if rest is None:
+                fn(*args)
+            else:
+                fn(*args, rest)
+        finally:
+            dt = time.perf_counter() - t0
+            M_ROUTE_TOTAL.inc(1, self.kind, route)
+            M_ROUTE_SECONDS.observe(dt, self.kind, route)
+            perf_observe(f"route:{route}", dt)
+        return True
+
+commands  = Router("command")
+callbacks = Router("callback")
+
+# ─── версии callback_data ───
+# v0 — обычная строка маршрута (так выглядят все короткие кнопки, в том числе
+# на старых сообщениях). v1 — «~1:<токен>»: данные длиннее 64 байт лежат
+# в _cb_tokens, токен — хеш данных, поэтому перерисовка клавиатуры не плодит
+# новые записи. Новая схема = новая версия в _CB_DECODERS.
+CB_TOKEN_MARK = "~"
+_cb_lock   = Lock()
+_cb_tokens: "OrderedDict[str, str]" = OrderedDict()
+
+def cb_pack(data: str) -> str:
+    """callback_data для кнопки: как есть, если влезает в 64 байта, иначе токен v1."""
+    raw = data.encode()
+    if len(raw) <= CB_MAX_BYTES and not data.startswith(CB_TOKEN_MARK):
+        return data
+    token = base64.urlsafe_b64encode(hashlib.blake2b(raw, digest_size=12).digest()).decode()
+    with _cb_lock:
+        _cb_tokens[token] = data
+        _cb_tokens.move_to_end(token)
+        while len(_cb_tokens) > CB_TOKENS_MAX:
+            _cb_tokens.popitem(last=False)
+    return f"{CB_TOKEN_MARK}1:{token}"
+
+def _cb_decode_v1(token: str) -> Optional[str]:
+    with _cb_lock:
+        data = _cb_tokens.get(token)
+        if data is not None:
+            _cb_tokens.move_to_end(token)
+    return data
+
+_CB_DECODERS: Dict[str, Callable[[str], Optional[str]]] = {"1": _cb_decode_v1}
+
+def cb_unpack(data: str) -> Optional[str]:
+    """Исходные данные кнопки; None — токен неизвестен (вытеснен или другая версия)."""
+    if not data.startswith(CB_TOKEN_MARK):
+        return data
+    version, _, body = data[len(CB_TOKEN_MARK):].partition(":")
+    decoder = _CB_DECODERS.get(version)
+    return decoder(body) if decoder else None
+
+# ─────────────────────────────────────────────
+#  ОБРАБОТЧИКИ КОМАНД
+# ─────────────────────────────────────────────
+def cmd_start(cid: str, username: str) -> None:
+    if cid not in active_users:
+        active_users.add(cid)
+        user_settings[cid] = DEFAULT_SETTINGS.copy()
+        save_all()
+    _log("commands", "info", "User %s (%s) started", username, cid)
+    send_message(cid,
+        "✅ <b>Process Monitor Pro</b> — активирован!\n\n"
+        "🔔 Уведомления о новых процессах включены.\n"
+        "Используй кнопки меню для управления.",
+        markup=kb_main())
+
+def cmd_stop(cid: str) -> None:
+    active_users.discard(cid)
+    save_all()
+    send_message(cid, "👋 Уведомления отключены.\nНапиши /start чтобы включить снова.")
+
+def cmd_status(cid: str) -> None:
+    send_message(cid, fmt_system_status(), markup=kb_status())
+
+def cmd_help(cid: str) -> None:
+    send_message(cid, "❓ <b>Помощь</b>\n\nВыберите раздел:", markup=kb_help())
+
+def cmd_settings(cid: str) -> None:
+    send_message(cid, "⚙️ <b>Настройки мониторинга</b>", markup=kb_settings(cid))
+
+def fmt_list_page(list_type: str, page: int, query: str = "") -> Tuple[str, dict]:
+    names = ignored_procs if list_type == "ignored" else whitelist_procs
+    items, total, count = names.page(page, query)
+    page  = min(page, total - 1)
+    title = "🚫 Игнорируемые" if list_type == "ignored" else "⭐ Белый список"
+    if query:
+        title += f" · 🔍 <code>{html.escape(query)}</code>"
+    text = f"<b>{title}</b>  (стр. {page+1}/{total}, {'найдено' if query else 'всего'} {count})"
+    if query and not count:
+        text += "\n\nНичего не найдено."
+    return text, kb_list_page(list_type, page, total, items, query)
+
+def cmd_list(cid: str, list_type: str = "ignored", query: str = "") -> None:
+    text, markup = fmt_list_page(list_type, 0, query.strip())
+    send_message(cid, text, markup=markup)
+
+def cmd_quiet(cid: str, arg: str) -> None:
+    if arg == "off":
+        get_settings(cid)["quiet_hours_enabled"] = False
+        _save(SETTINGS_FILE, user_settings)
+        send_message(cid, "🔊 Тихие часы отключены.", markup=kb_settings(cid))
+        return
     try:
         start, end = arg.split("-")
         datetime.strptime(start, "%H:%M")
@@ -506,16 +2692,173 @@ def cmd_setram(cid: str, val: str) -> None:
     except Exception:
         send_message(cid, "❌ Пример: <code>/setram 100</code>")
 
-def cmd_history(cid: str, proc_name: str) -> None:
-    stats = process_stats.get(proc_name, [])
-    if not stats:
-        send_message(cid, f"📊 Нет истории для <code>{proc_name}</code>")
+def cmd_history(cid: str, arg: str) -> None:
+    # /history <имя> [since] [until] [user=...]
+    parts = arg.split()
+    user  = None
+    times = []
+    for p in parts[1:]:
+        if p.startswith("user="):
+            user = p[len("user="):] or None
+        else:
+            times.append(p)
+    name  = parts[0]
+    entry = stats_lookup(name)
+    if not entry or not entry["n"]:
+        # статистика пишется только по уведомлениям — последние запуски есть в буфере
+        recs = ring.latest(RECENT_SHOW, time.time() - 86400, [name],
+                           lambda r: name in (r["name"], r["group"])) if ring else []
+        if recs:
+            send_message(cid, fmt_recent(recs, f"📊 Статистики по <code>{html.escape(name)}</code> нет, "
+                                               f"последние запуски за сутки:\n"))
+        else:
+            send_message(cid, f"📊 Нет истории для <code>{html.escape(name)}</code>")
+        return
+    now = time.time()
+    try:
+        since = history.parse_time(times[0], now) if times else now - 86400
+        until = history.parse_time(times[1], now) if len(times) > 1 else now
+    except ValueError as e:
+        send_message(cid, f"❌ {html.escape(str(e))}\nПример: <code>/history nginx 7d now user=www-data</code>")
         return
-    last20 = stats[-20:]
-    lines  = [f"📊 <b>История {proc_name}</b>  ({len(stats)} событий)\n"]
-    for s in last20:
-        lines.append(f"• {s['ts'][:16]}  CPU {s['cpu']:.1f}%  RAM {s['mem']}MB")
-    send_message(cid, "\n".join(lines))
+    if since >= until:
+        send_message(cid, "❌ Начало интервала должно быть раньше конца")
+        return
+    res = history.query(entry, since, until, user)
+    res["name"] = name
+    res["ts"]   = now
+    hist_cache[cid] = res
+    text, markup = fmt_history_page(res, 0)
+    send_message(cid, text, markup=markup)
+
+_export_lock = Lock()   # одна выгрузка за раз: сбор столбцов — это CPU бота
+
+def cmd_export(cid: str, arg: str) -> None:
+    # /export [raw|m|h|d] [groups] [с] [по] [parquet|npz|csv]
+    level, fmt, store, times = "h", None, process_stats, []
+    for p in arg.lower().split():
+        if p in ("raw",) + tuple(k for k, _, _ in history.TIERS):
+            level = p
+        elif p in history.EXPORT_FORMATS:
+            fmt = p
+        elif p in ("groups", "group"):
+            store = group_stats
+        else:
+            times.append(p)
+    formats = history.export_formats()
+    fmt = fmt or formats[0]
+    if fmt not in formats:
+        send_message(cid, f"❌ {fmt} недоступен на сервере, есть: {', '.join(formats)}")
+        return
+    now = time.time()
+    keep = history.RAW_RETENTION if level == "raw" else {k: t for k, _, t in history.TIERS}[level]
+    try:
+        since = history.parse_time(times[0], now) if times else now - keep
+        until = history.parse_time(times[1], now) if len(times) > 1 else now
+    except ValueError as e:
+        send_message(cid, f"❌ {e}\nПример: <code>/export h 30d</code>, <code>/export raw 6h csv</code>")
+        return
+    if not _export_lock.acquire(blocking=False):
+        send_message(cid, "⏳ Выгрузка уже готовится, подожди немного.")
+        return
+    send_message(cid, f"📦 Готовлю выгрузку ({level}, {fmt})…")
+    Thread(target=_export_job, args=(cid, store, level, since, until, fmt),
+           name="Export", daemon=True).start()
+
+def _export_job(cid: str, store: Dict[str, Dict], level: str, since: float, until: float, fmt: str) -> None:
+    # свой каталог 0700: в общем /tmp предсказуемое имя — повод для подмены symlink-ом
+    tmpdir = tempfile.mkdtemp(prefix="process-history-")
+    path = os.path.join(tmpdir, f"process-history-{level}-{datetime.now():%Y%m%d-%H%M}.{fmt}")
+    try:
+        t0 = time.perf_counter()
+        cols = history.collect_columns(list(store.items()), level, since, until)
+        rows = history.write_columns(cols, path, fmt)
+        del cols
+        took = time.perf_counter() - t0
+        size = os.path.getsize(path)
+        if size > EXPORT_MAX_BYTES:
+            send_message(cid, f"❌ Файл {size / 1024**2:.0f} MB — больше лимита Telegram. "
+                              f"На сервере: <code>python3 pmctl.py export --level {level} "
+                              f"--format {fmt} -o history.{fmt}</code>")
+            return
+        caption = (f"📦 {rows} строк, {_fmt_ts(since)} — {_fmt_ts(until)}, "
+                   f"{size / 1024:.0f} KB, {took:.1f} с")
+        if send_document(cid, path, caption) is None:
+            send_message(cid, "❌ Не удалось отправить файл.")
+    except Exception as e:
+        _log("errors", "error", "Export error: %s", e)
+        send_message(cid, f"❌ Ошибка выгрузки: {e}")
+    finally:
+        _export_lock.release()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def cmd_recent(cid: str, arg: str) -> None:
+    # /recent [N | 10m | 2h] [текст]
+    if ring is None:
+        send_message(cid, "🔁 Кольцевой буфер выключен (RING_FILE).")
+        return
+    limit, after, words = RECENT_SHOW, 0.0, []
+    now = time.time()
+    for p in arg.split():
+        if p.isdigit():
+            limit = max(1, min(int(p), 50))
+        elif re.fullmatch(r"\d+[mhdw]", p.lower()):
+            after = history.parse_time(p, now)
+        else:
+            words.append(p.lower())
+    recs = ring.latest(limit, after, words)
+    title = "🔁 <b>Последние процессы</b>" + (f" «{html.escape(' '.join(words))}»" if words else "") + "\n"
+    send_message(cid, fmt_recent(recs, title))
+
+def cmd_digest(cid: str, arg: str) -> None:
+    # /digest [daily|weekly|off] [HH:MM] | /digest now
+    s = get_settings(cid)
+    parts = arg.lower().split()
+    if parts and parts[0] == "now":
+        if s["digest"] == "off":
+            send_message(cid, "📰 Дайджест выключен — включите: <code>/digest daily 09:00</code>")
+            return
+        with _digest_lock:
+            text = fmt_digest(digest_state.get(cid) or _digest_new(time.time()), s["digest"])
+        send_message(cid, text)
+        return
+    for p in parts:
+        if p in DIGEST_LABELS:
+            if p != s["digest"]:
+                digest_reset(cid)
+            s["digest"] = p
+        else:
+            try:
+                datetime.strptime(p, "%H:%M")
+            except ValueError:
+                send_message(cid, "❌ Пример: <code>/digest daily 09:00</code>, "
+                                  "<code>/digest weekly</code>, <code>/digest off</code>, <code>/digest now</code>")
+                return
+            s["digest_time"] = p
+    _save(SETTINGS_FILE, user_settings)
+    with _digest_lock:
+        st = digest_state.get(cid)
+        if st:
+            st["due"] = 0   # пересчитать время следующей отправки
+    when = f" в {s['digest_time']}" + (" по понедельникам" if s["digest"] == "weekly" else "")
+    send_message(cid, f"📰 Дайджест: <b>{DIGEST_LABELS[s['digest']]}</b>"
+                      + (when if s["digest"] != "off" else ""))
+
+def cmd_perf(cid: str, arg: str) -> None:
+    if cid not in ADMIN_IDS:
+        send_message(cid, "⛔ Команда доступна только администраторам.")
+        return
+    parts = arg.split()
+    if parts and parts[0] == "prof":
+        try:
+            secs = min(float(parts[1]) if len(parts) > 1 else 10.0, PROFILE_MAX_SECS)
+        except ValueError:
+            send_message(cid, "❌ Пример: <code>/perf prof 10</code>")
+            return
+        send_message(cid, f"🔬 Профилирую {secs:g} с…")
+        Thread(target=run_profile, args=(cid, secs), name="Profiler", daemon=True).start()
+        return
+    send_message(cid, fmt_perf())
 
 def handle_command(msg: dict) -> None:
     text = msg.get("text", "").strip()
@@ -526,46 +2869,58 @@ def handle_command(msg: dict) -> None:
     cmd   = parts[0].lower().split("@")[0]
     arg   = parts[1].strip() if len(parts) > 1 else ""
 
-    log.info("CMD '%s' arg='%s' from @%s (%s)", cmd, arg, uname, cid)
-
-    if cmd == "/start":
-        cmd_start(cid, uname)
-    elif cmd == "/stop":
-        cmd_stop(cid)
-    elif cmd in ("/status", "/stat"):
-        cmd_status(cid)
-    elif cmd == "/help":
-        cmd_help(cid)
-    elif cmd in ("/settings", "/config"):
-        cmd_settings(cid)
-    elif cmd == "/list":
-        cmd_list(cid, "ignored")
-    elif cmd == "/whitelist":
-        cmd_list(cid, "whitelist")
-    elif cmd == "/quiet":
-        if arg:
-            cmd_quiet(cid, arg)
-        else:
-            send_message(cid, "Пример: <code>/quiet 22:00-08:00</code> или <code>/quiet off</code>")
-    elif cmd == "/setcpu":
-        cmd_setcpu(cid, arg)
-    elif cmd == "/setram":
-        cmd_setram(cid, arg)
-    elif cmd == "/history":
-        if arg:
-            cmd_history(cid, arg)
-        else:
-            send_message(cid, "Пример: <code>/history python3</code>")
-    elif cid not in active_users:
+    _log("commands", "info", "CMD '%s' arg='%s' from @%s (%s)", cmd, arg, uname, cid)
+
+    if commands.dispatch(cmd, cid, arg, uname):
+        return
+    if cid not in active_users:
         send_message(cid, "⚠️ Напиши /start для активации бота.")
     else:
         send_message(cid, "❓ Неизвестная команда.\n\nДоступные команды:\n"
             "/start /stop /status /help /settings /list /whitelist\n"
-            "/quiet /setcpu /setram /history",
+            "/quiet /setcpu /setram /history /recent /export /top /digest /agents",
             markup=kb_main())
 
+def _cmd_quiet(cid: str, arg: str, uname: str) -> None:
+    if arg:
+        cmd_quiet(cid, arg)
+    else:
+        send_message(cid, "Пример: <code>/quiet 22:00-08:00</code> или <code>/quiet off</code>")
+
+def _cmd_history(cid: str, arg: str, uname: str) -> None:
+    if arg:
+        cmd_history(cid, arg)
+    else:
+        send_message(cid, "Пример: <code>/history python3 7d now user=root</code>\n"
+                          "Время: 90m, 24h, 7d, 2w, 2024-05-01, 2024-05-01T10:00, now")
+
+def _cmd_top(cid: str, arg: str, uname: str) -> None:
+    dim = {"user": "user", "users": "user", "unit": "group", "ctr": "group",
+           "group": "group", "name": "name", "proc": "name"}.get(arg.lower())
+    send_message(cid, fmt_top(dim), markup=kb_top(dim))
+
+# обработчик команды: handler(cid, arg, uname)
+commands.add(("/start",),             lambda cid, arg, uname: cmd_start(cid, uname))
+commands.add(("/stop",),              lambda cid, arg, uname: cmd_stop(cid))
+commands.add(("/status", "/stat"),    lambda cid, arg, uname: cmd_status(cid))
+commands.add(("/help",),              lambda cid, arg, uname: cmd_help(cid))
+commands.add(("/settings", "/config"),lambda cid, arg, uname: cmd_settings(cid))
+commands.add(("/list",),              lambda cid, arg, uname: cmd_list(cid, "ignored", arg))
+commands.add(("/whitelist",),         lambda cid, arg, uname: cmd_list(cid, "whitelist", arg))
+commands.add(("/quiet",),             _cmd_quiet)
+commands.add(("/setcpu",),            lambda cid, arg, uname: cmd_setcpu(cid, arg))
+commands.add(("/setram",),            lambda cid, arg, uname: cmd_setram(cid, arg))
+commands.add(("/history",),           _cmd_history)
+commands.add(("/recent",),            lambda cid, arg, uname: cmd_recent(cid, arg))
+commands.add(("/export",),            lambda cid, arg, uname: cmd_export(cid, arg))
+commands.add(("/agents",),            lambda cid, arg, uname: send_message(cid, fmt_agents()))
+commands.add(("/perf",),              lambda cid, arg, uname: cmd_perf(cid, arg))
+commands.add(("/digest",),            lambda cid, arg, uname: cmd_digest(cid, arg))
+commands.add(("/top",),               _cmd_top)
+
 # ─────────────────────────────────────────────
 #  ОБРАБОТЧИКИ CALLBACK
+#  Точный маршрут: handler(cid, mid); префиксный: handler(cid, mid, rest).
 # ─────────────────────────────────────────────
 def handle_callback(cq: dict) -> None:
     cd      = cq.get("data", "")
@@ -573,7 +2928,7 @@ def handle_callback(cq: dict) -> None:
     mid     = cq["message"]["message_id"]
     cb_id   = cq["id"]
 
-    log.info("CB '%s' from %s", cd, chat_id)
+    _log("callbacks", "info", "CB '%s' from %s", cd, chat_id)
 
     # ─── гарантируем ответ на callback ───
     # (будет вызван в конце или при ошибке)
@@ -582,350 +2937,1446 @@ def handle_callback(cq: dict) -> None:
     try:
         _dispatch_callback(cd, chat_id, mid)
     except Exception as e:
-        log.error("Callback dispatch error: %s", e)
+        _log("errors", "error", "Callback dispatch error: %s", e)
         answer_text = "⚠️ Ошибка обработки"
     finally:
         answer_callback(cb_id, answer_text)
 
 def _dispatch_callback(cd: str, cid: str, mid: int) -> None:
     """Маршрутизация callback без дублирования answerCallbackQuery."""
+    data = cb_unpack(cd)
+    if data is None:
+        send_message(cid, "⌛ Кнопка устарела — откройте меню заново.", markup=kb_main(), edit_id=mid)
+        return
+    if not callbacks.dispatch(data, cid, mid):
+        _log("callbacks", "warning", "Unknown callback: %s", data)
+        send_message(cid, "⚠️ Неизвестное действие.", markup=kb_main(), edit_id=mid)
 
-    # ─── навигация по меню ───
-    if cd == "menu_main":
-        send_message(cid, "🏠 <b>Главное меню</b>", markup=kb_main(), edit_id=mid)
+# ─── навигация по меню ───
+@callbacks.exact("menu_main")
+def _cb_menu_main(cid: str, mid: int) -> None:
+    send_message(cid, "🏠 <b>Главное меню</b>", markup=kb_main(), edit_id=mid)
 
-    elif cd == "menu_settings":
-        send_message(cid, "⚙️ <b>Настройки мониторинга</b>",
-                     markup=kb_settings(cid), edit_id=mid)
+@callbacks.exact("menu_settings")
+def _cb_menu_settings(cid: str, mid: int) -> None:
+    send_message(cid, "⚙️ <b>Настройки мониторинга</b>",
+                 markup=kb_settings(cid), edit_id=mid)
 
-    elif cd == "menu_quiet":
-        s = get_settings(cid)
-        qh = f"{s['quiet_hours_start']}–{s['quiet_hours_end']}" if s["quiet_hours_enabled"] else "выкл"
-        send_message(cid, f"🔇 <b>Тихие часы</b>  ({qh})",
-                     markup=kb_quiet(cid), edit_id=mid)
+@callbacks.exact("menu_quiet")
+def _cb_menu_quiet(cid: str, mid: int) -> None:
+    s = get_settings(cid)
+    qh = f"{s['quiet_hours_start']}–{s['quiet_hours_end']}" if s["quiet_hours_enabled"] else "выкл"
+    send_message(cid, f"🔇 <b>Тихие часы</b>  ({qh})",
+                 markup=kb_quiet(cid), edit_id=mid)
 
-    elif cd == "menu_lists":
-        send_message(cid, "📋 <b>Управление списками</b>",
-                     markup=kb_lists(), edit_id=mid)
+@callbacks.exact("menu_lists")
+def _cb_menu_lists(cid: str, mid: int) -> None:
+    send_message(cid, "📋 <b>Управление списками</b>",
+                 markup=kb_lists(), edit_id=mid)
 
-    elif cd == "menu_stats":
-        send_message(cid, "📈 <b>Статистика процессов</b>",
-                     markup=kb_stats_menu(), edit_id=mid)
+@callbacks.exact("menu_stats")
+def _cb_menu_stats(cid: str, mid: int) -> None:
+    send_message(cid, "📈 <b>Статистика процессов</b>",
+                 markup=kb_stats_menu(), edit_id=mid)
 
-    elif cd == "menu_help":
-        send_message(cid, "❓ <b>Помощь и документация</b>\n\nВыберите раздел:",
-                     markup=kb_help(), edit_id=mid)
+@callbacks.exact("menu_help")
+def _cb_menu_help(cid: str, mid: int) -> None:
+    send_message(cid, "❓ <b>Помощь и документация</b>\n\nВыберите раздел:",
+                 markup=kb_help(), edit_id=mid)
 
-    # ─── системный статус ───
-    elif cd == "sys_status":
-        send_message(cid, fmt_system_status(), markup=kb_status(), edit_id=mid)
+# ─── системный статус ───
+@callbacks.exact("sys_status")
+def _cb_sys_status(cid: str, mid: int) -> None:
+    text, markup = render_cached(cid, "sys_status", lambda: (fmt_system_status(), kb_status()))
+    send_message(cid, text, markup=markup, edit_id=mid)
 
-    # ─── переключатели настроек ───
-    elif cd == "toggle_mode":
-        s = get_settings(cid)
-        modes = ["blacklist", "whitelist", "smart"]
-        s["mode"] = modes[(modes.index(s["mode"]) + 1) % 3]
-        _save(SETTINGS_FILE, user_settings)
-        send_message(cid, f"✅ Режим изменён: <b>{s['mode']}</b>",
-                     markup=kb_settings(cid), edit_id=mid)
+# ─── переключатели настроек ───
+@callbacks.exact("toggle_mode")
+def _cb_toggle_mode(cid: str, mid: int) -> None:
+    s = get_settings(cid)
+    modes = ["blacklist", "whitelist", "smart"]
+    s["mode"] = modes[(modes.index(s["mode"]) + 1) % 3]
+    _save(SETTINGS_FILE, user_settings)
+    send_message(cid, f"✅ Режим изменён: <b>{s['mode']}</b>",
+                 markup=kb_settings(cid), edit_id=mid)
 
-    elif cd == "toggle_group":
+def _toggle(key: str, done: str, kb: Callable[[str], dict] = kb_settings) -> Callable:
+    """Обработчик кнопки-переключателя булевой настройки."""
+    def handler(cid: str, mid: int) -> None:
         s = get_settings(cid)
-        s["group_notifications"] = not s["group_notifications"]
+        s[key] = not s[key]
         _save(SETTINGS_FILE, user_settings)
-        send_message(cid, "✅ Группировка уведомлений изменена",
-                     markup=kb_settings(cid), edit_id=mid)
+        send_message(cid, done, markup=kb(cid), edit_id=mid)
+    return handler
 
-    elif cd == "toggle_system":
-        s = get_settings(cid)
-        s["ignore_system"] = not s["ignore_system"]
-        _save(SETTINGS_FILE, user_settings)
-        send_message(cid, "✅ Фильтр системных процессов изменён",
-                     markup=kb_settings(cid), edit_id=mid)
+callbacks.add(("toggle_group",),  _toggle("group_notifications", "✅ Группировка уведомлений изменена"))
+callbacks.add(("toggle_system",), _toggle("ignore_system",       "✅ Фильтр системных процессов изменён"))
+callbacks.add(("toggle_stats",),  _toggle("track_stats",         "✅ Сбор статистики изменён"))
+callbacks.add(("toggle_ports",),  _toggle("notify_ports",        "✅ Уведомления о портах изменены"))
+callbacks.add(("toggle_quiet",),  _toggle("quiet_hours_enabled", "✅ Тихие часы изменены", kb_quiet))
 
-    elif cd == "toggle_stats":
-        s = get_settings(cid)
-        s["track_stats"] = not s["track_stats"]
-        _save(SETTINGS_FILE, user_settings)
-        send_message(cid, "✅ Сбор статистики изменён",
-                     markup=kb_settings(cid), edit_id=mid)
+@callbacks.exact("toggle_digest")
+def _cb_toggle_digest(cid: str, mid: int) -> None:
+    s = get_settings(cid)
+    modes = list(DIGEST_LABELS)
+    s["digest"] = modes[(modes.index(s["digest"]) + 1) % len(modes)]
+    digest_reset(cid)
+    _save(SETTINGS_FILE, user_settings)
+    send_message(cid, f"✅ Дайджест: <b>{DIGEST_LABELS[s['digest']]}</b> "
+                      f"({s['digest_time']}, время — /digest daily 09:00)",
+                 markup=kb_settings(cid), edit_id=mid)
 
-    elif cd == "toggle_quiet":
-        s = get_settings(cid)
-        s["quiet_hours_enabled"] = not s["quiet_hours_enabled"]
-        _save(SETTINGS_FILE, user_settings)
-        send_message(cid, "✅ Тихие часы изменены",
-                     markup=kb_quiet(cid), edit_id=mid)
-
-    elif cd in ("set_cpu", "hint_quiet", "set_ram"):
-        hints = {
-            "set_cpu":    "Введите CPU порог командой:\n<code>/setcpu 5</code>",
-            "set_ram":    "Введите RAM порог командой:\n<code>/setram 100</code>",
-            "hint_quiet": "Установите тихие часы командой:\n<code>/quiet 22:00-08:00</code>\nили отключите: <code>/quiet off</code>",
-        }
-        send_message(cid, hints[cd], edit_id=mid)
+_HINTS = {
+    "set_cpu":    "Введите CPU порог командой:\n<code>/setcpu 5</code>",
+    "set_ram":    "Введите RAM порог командой:\n<code>/setram 100</code>",
+    "hint_quiet": "Установите тихие часы командой:\n<code>/quiet 22:00-08:00</code>\nили отключите: <code>/quiet off</code>",
+}
+for _key, _hint in _HINTS.items():
+    callbacks.add((_key,), lambda cid, mid, hint=_hint: send_message(cid, hint, edit_id=mid))
 
-    # ─── отключение уведомлений ───
-    elif cd == "do_stop":
-        active_users.discard(cid)
-        save_all()
-        send_message(cid, "🔕 Уведомления отключены.\n/start чтобы включить.", edit_id=mid)
-
-    # ─── просмотр списков с пагинацией ───
-    elif cd.startswith("list_"):
-        # формат: list_{type}_{page}
-        parts = cd.split("_", 2)
-        if len(parts) == 3:
-            ltype, page = parts[1], int(parts[2])
-            items = sorted(ignored_procs if ltype == "ignored" else whitelist_procs)
-            PER   = 8
-            total = max(1, (len(items) + PER - 1) // PER)
-            title = "🚫 Игнорируемые" if ltype == "ignored" else "⭐ Белый список"
-            send_message(cid,
-                f"<b>{title}</b>  (стр. {page+1}/{total}, всего {len(items)})",
-                markup=kb_list_page(ltype, page, total, items), edit_id=mid)
-
-    # ─── удаление из списка ───
-    elif cd.startswith("rm_"):
-        # формат: rm_{type}_{name}
-        parts = cd.split("_", 2)
-        if len(parts) == 3:
-            ltype, name = parts[1], parts[2]
-            if ltype == "ignored":
-                ignored_procs.discard(name)
-                _save(IGNORED_FILE, list(ignored_procs))
-                send_message(cid, f"🔔 <code>{name}</code> удалён из игнорируемых",
-                             markup=kb_lists(), edit_id=mid)
-            else:
-                whitelist_procs.discard(name)
-                _save(WHITELIST_FILE, list(whitelist_procs))
-                send_message(cid, f"❌ <code>{name}</code> удалён из белого списка",
-                             markup=kb_lists(), edit_id=mid)
-
-    # ─── очистка списка ───
-    elif cd.startswith("clear_"):
-        ltype = cd.split("_", 1)[1]
+# ─── отключение уведомлений ───
+@callbacks.exact("do_stop")
+def _cb_do_stop(cid: str, mid: int) -> None:
+    active_users.discard(cid)
+    save_all()
+    send_message(cid, "🔕 Уведомления отключены.\n/start чтобы включить.", edit_id=mid)
+
+# ─── просмотр списков с пагинацией ───
+@callbacks.prefix("list_")
+def _cb_list_page(cid: str, mid: int, rest: str) -> None:
+    # формат: list_{type}_{page}[_{запрос}]
+    parts = rest.split("_", 2)
+    if len(parts) >= 2:
+        ltype, page = parts[0], int(parts[1])
+        text, markup = fmt_list_page(ltype, page, parts[2] if len(parts) == 3 else "")
+        send_message(cid, text, markup=markup, edit_id=mid)
+
+# ─── удаление из списка ───
+@callbacks.prefix("rm_")
+def _cb_list_remove(cid: str, mid: int, rest: str) -> None:
+    # формат: rm_{type}_{name}
+    parts = rest.split("_", 1)
+    if len(parts) == 2:
+        ltype, name = parts
         if ltype == "ignored":
-            ignored_procs.clear()
-            ignored_procs.update(DEFAULT_SYSTEM)
-            _save(IGNORED_FILE, list(ignored_procs))
-            send_message(cid, "✅ Игнорируемые очищены (восстановлены системные)",
+            ignored_procs.discard(name)
+            send_message(cid, f"🔔 <code>{name}</code> удалён из игнорируемых",
+                         markup=kb_lists(), edit_id=mid)
+        else:
+            whitelist_procs.discard(name)
+            send_message(cid, f"❌ <code>{name}</code> удалён из белого списка",
                          markup=kb_lists(), edit_id=mid)
-        elif ltype == "whitelist":
-            whitelist_procs.clear()
-            _save(WHITELIST_FILE, list(whitelist_procs))
-            send_message(cid, "✅ Белый список очищен", markup=kb_lists(), edit_id=mid)
-
-    # ─── добавить в игнорируемые ───
-    elif cd.startswith("add_ignored_"):
-        name = cd[len("add_ignored_"):]
-        ignored_procs.add(name)
-        _save(IGNORED_FILE, list(ignored_procs))
-        send_message(cid, f"🚫 <code>{name}</code> добавлен в игнорируемые", edit_id=mid)
-
-    # ─── добавить в белый список ───
-    elif cd.startswith("add_whitelist_"):
-        name = cd[len("add_whitelist_"):]
-        whitelist_procs.add(name)
-        _save(WHITELIST_FILE, list(whitelist_procs))
-        send_message(cid, f"⭐ <code>{name}</code> добавлен в белый список", edit_id=mid)
-
-    # ─── статистика процесса ───
-    elif cd.startswith("pstat_"):
-        name = cd[len("pstat_"):]
-        send_message(cid, fmt_proc_stats(name), edit_id=mid)
-
-    elif cd == "stats_total":
-        send_message(cid, fmt_stats_total(), markup=kb_stats_menu(), edit_id=mid)
-
-    elif cd == "stats_clear":
-        process_stats.clear()
-        _save(STATS_FILE, {})
-        send_message(cid, "✅ Статистика очищена", markup=kb_stats_menu(), edit_id=mid)
-
-    # ─── разделы помощи ───
-    elif cd == "help_cmds":
-        send_message(cid,
-            "<b>📖 Основные команды</b>\n\n"
-            "/start — активировать бот\n"
-            "/stop — отключить уведомления\n"
-            "/status — RAM, CPU, диск, порты\n"
-            "/settings — настройки фильтров\n"
-            "/list — игнорируемые процессы\n"
-            "/whitelist — белый список\n"
-            "/history &lt;имя&gt; — история процесса\n"
-            "/quiet 22:00-08:00 — тихие часы\n"
-            "/setcpu 5 — CPU порог (%)\n"
-            "/setram 100 — RAM порог (MB)",
-            markup=kb_help(), edit_id=mid)
-
-    elif cd == "help_filters":
-        send_message(cid,
-            "<b>⚙️ Режимы работы</b>\n\n"
-            "🚫 <b>Чёрный список</b> — уведомлять обо всём кроме игнорируемых\n"
-            "⭐ <b>Белый список</b> — только явно разрешённые процессы\n"
-            "🧠 <b>Умный</b> — белый список имеет приоритет, остальные фильтруются чёрным\n\n"
-            "<b>Пороги CPU/RAM</b> — игнорировать процессы ниже порога\n"
-            "<b>Тихие часы</b> — нет уведомлений в указанное время",
-            markup=kb_help(), edit_id=mid)
-
-    elif cd == "help_stats":
-        send_message(cid,
-            "<b>📊 Статистика и мониторинг</b>\n\n"
-            "• /status — CPU, RAM, диск, открытые порты\n"
-            "• /history &lt;имя&gt; — история запусков процесса\n"
-            "• Меню Статистика — топ процессов\n\n"
-            "История хранится до 2000 событий на процесс.\n"
-            "Данные сохраняются в <code>stats.json</code>",
-            markup=kb_help(), edit_id=mid)
-
-    elif cd == "help_lists":
-        send_message(cid,
-            "<b>🔧 Управление списками</b>\n\n"
-            "При получении уведомления о процессе нажми:\n"
-            "• 🚫 Игнорировать — добавить в чёрный список\n"
-            "• ⭐ В белый список — добавить в белый список\n\n"
-            "Просмотр и удаление через /list и /whitelist.\n"
-            "Удали нажав кнопку 🗑 рядом с именем процесса.",
-            markup=kb_help(), edit_id=mid)
 
+# ─── очистка списка ───
+@callbacks.exact("clear_ignored")
+def _cb_clear_ignored(cid: str, mid: int) -> None:
+    ignored_procs.reset(DEFAULT_SYSTEM)
+    send_message(cid, "✅ Игнорируемые очищены (восстановлены системные)",
+                 markup=kb_lists(), edit_id=mid)
+
+@callbacks.exact("clear_whitelist")
+def _cb_clear_whitelist(cid: str, mid: int) -> None:
+    whitelist_procs.reset()
+    send_message(cid, "✅ Белый список очищен", markup=kb_lists(), edit_id=mid)
+
+# ─── добавить в игнорируемые ───
+@callbacks.prefix("add_ignored_")
+def _cb_add_ignored(cid: str, mid: int, name: str) -> None:
+    ignored_procs.add(name)
+    send_message(cid, f"🚫 <code>{name}</code> добавлен в игнорируемые", edit_id=mid)
+
+# ─── добавить в белый список ───
+@callbacks.prefix("add_whitelist_")
+def _cb_add_whitelist(cid: str, mid: int, name: str) -> None:
+    whitelist_procs.add(name)
+    send_message(cid, f"⭐ <code>{name}</code> добавлен в белый список", edit_id=mid)
+
+# ─── статистика процесса ───
+@callbacks.prefix("pstat_")
+def _cb_proc_stats(cid: str, mid: int, name: str) -> None:
+    send_message(cid, fmt_proc_stats(name), edit_id=mid)
+
+# ─── листание результата /history (из кэша запроса) ───
+@callbacks.prefix("hist_")
+def _cb_history_page(cid: str, mid: int, page: str) -> None:
+    res = hist_cache.get(cid)
+    if not res or time.time() - res["ts"] > HIST_CACHE_TTL:
+        hist_cache.pop(cid, None)
+        send_message(cid, "⌛ Результат устарел — повторите /history", edit_id=mid)
     else:
-        log.warning("Unknown callback: %s", cd)
-        send_message(cid, "⚠️ Неизвестное действие.", markup=kb_main(), edit_id=mid)
+        text, markup = fmt_history_page(res, int(page))
+        send_message(cid, text, markup=markup, edit_id=mid)
+
+@callbacks.exact("stats_total")
+def _cb_stats_total(cid: str, mid: int) -> None:
+    text, markup = render_cached(cid, "stats_total", lambda: (fmt_stats_total(), kb_stats_menu()))
+    send_message(cid, text, markup=markup, edit_id=mid)
+
+@callbacks.prefix("top_")
+def _cb_top(cid: str, mid: int, dim: str) -> None:
+    dim = dim if dim in ("user", "group", "name") else None
+    text, markup = render_cached(cid, f"stats_top_{dim}", lambda: (fmt_top(dim), kb_top(dim)))
+    send_message(cid, text, markup=markup, edit_id=mid)
+
+@callbacks.exact("stats_groups")
+def _cb_stats_groups(cid: str, mid: int) -> None:
+    text, markup = render_cached(cid, "stats_groups", lambda: (fmt_group_stats(), kb_group_stats()))
+    send_message(cid, text, markup=markup, edit_id=mid)
+
+@callbacks.exact("stats_clear")
+def _cb_stats_clear(cid: str, mid: int) -> None:
+    process_stats.clear()
+    group_stats.clear()
+    _save(STATS_FILE, {})
+    _save(GROUPS_FILE, {})
+    render_drop("stats_")
+    send_message(cid, "✅ Статистика очищена", markup=kb_stats_menu(), edit_id=mid)
+
+# ─── разделы помощи ───
+_HELP = {
+    "help_cmds":
+        "<b>📖 Основные команды</b>\n\n"
+        "/start — активировать бот\n"
+        "/stop — отключить уведомления\n"
+        "/status — RAM, CPU, диск, порты\n"
+        "/top [user|unit|name] — кто грузит машину за последний час\n"
+        "/digest daily 09:00 — сводка раз в сутки (weekly, off, now)\n"
+        "/agents — агенты на других серверах (режим коллектора)\n"
+        "/settings — настройки фильтров\n"
+        "/list [текст] — игнорируемые процессы (с поиском)\n"
+        "/whitelist [текст] — белый список (с поиском)\n"
+        "/history &lt;имя&gt; [с] [по] [user=…] — история процесса\n"
+        "/recent [N] [10m] [текст] — последние запуски (все, не только с уведомлением)\n"
+        "/export [raw|m|h|d] [с] [по] [parquet|npz|csv] — история файлом для анализа\n"
+        "/quiet 22:00-08:00 — тихие часы\n"
+        "/setcpu 5 — CPU порог (%)\n"
+        "/setram 100 — RAM порог (MB)",
+    "help_filters":
+        "<b>⚙️ Режимы работы</b>\n\n"
+        "🚫 <b>Чёрный список</b> — уведомлять обо всём кроме игнорируемых\n"
+        "⭐ <b>Белый список</b> — только явно разрешённые процессы\n"
+        "🧠 <b>Умный</b> — белый список имеет приоритет, остальные фильтруются чёрным; "
+        "аномалии (новое имя, всплеск запусков, выброс CPU/RAM) приходят всегда\n\n"
+        "<b>Пороги CPU/RAM</b> — игнорировать процессы ниже порога\n"
+        "<b>Тихие часы</b> — нет уведомлений в указанное время",
+    "help_stats":
+        "<b>📊 Статистика и мониторинг</b>\n\n"
+        "• /status — CPU, RAM, диск, открытые порты\n"
+        "• /history &lt;имя&gt; 7d now user=root — запуски, p50/p95\n"
+        "  CPU и RAM, частота и разбивка по пользователям\n"
+        "• Меню Статистика — топ процессов\n\n"
+        "Отдельные события хранятся сутки, дальше — сводки\n"
+        "по минутам (2 дня), часам (45 дней) и суткам (400 дней).\n"
+        "Данные сохраняются в <code>stats.json</code>",
+    "help_lists":
+        "<b>🔧 Управление списками</b>\n\n"
+        "При получении уведомления о процессе нажми:\n"
+        "• 🚫 Игнорировать — добавить в чёрный список\n"
+        "• ⭐ В белый список — добавить в белый список\n"
+        "• 🚫/⭐ Весь контейнер (юнит) — правило на все процессы\n"
+        "  контейнера или systemd-юнита: <code>ctr:web</code>, <code>unit:nginx.service</code>\n\n"
+        "Просмотр и удаление через /list и /whitelist.\n"
+        "Удали нажав кнопку 🗑 рядом с именем процесса.",
+}
+for _key, _text in _HELP.items():
+    callbacks.add((_key,), lambda cid, mid, text=_text: send_message(cid, text, markup=kb_help(), edit_id=mid))
+
+# ─────────────────────────────────────────────
+#  ПАРАЛЛЕЛЬНЫЙ СКАН
+#  На хостах с SCAN_PARALLEL_MIN+ процессов проход по /proc делится между
+#  подпроцессами scanpool.py по pid % N (шарды равномерны при любом
+#  распределении PID). Воркер помнит свой шард, так что между проходами
+#  передаются только списки PID и сведения о новых процессах.
+#  Упал воркер — пул закрывается, на следующем проходе создаётся заново.
+# ─────────────────────────────────────────────
+_scan_pool: Optional[scanpool.ScanPool] = None
+
+def _scan_workers() -> int:
+    if SCAN_WORKERS:
+        return SCAN_WORKERS
+    cpus = os.cpu_count() or 1
+    return min(4, cpus) if cpus >= 2 else 1
+
+def _scan_pool_for(nprocs: int) -> Optional[scanpool.ScanPool]:
+    """Пул, если он нужен при таком числе процессов, иначе None.
+    Выключается только когда процессов стало вдвое меньше порога — без дребезга."""
+    global _scan_pool, known_pids
+    workers = _scan_workers()
+    limit = SCAN_PARALLEL_MIN // 2 if _scan_pool else SCAN_PARALLEL_MIN
+    want = workers > 1 and nprocs >= limit
+    if want and _scan_pool is None:
+        _scan_pool = scanpool.ScanPool(workers)
+        known_pids |= set(_scan_pool.pids)   # свои воркеры — не новые процессы
+        _scan_pool.seed(known_pids)
+        _log("threads", "info", "🔀 Parallel scan on: %d workers, %d processes", workers, nprocs)
+    elif not want and _scan_pool is not None:
+        _scan_pool.close()
+        _scan_pool = None
+        _log("threads", "info", "🔀 Parallel scan off: %d processes", nprocs)
+    return _scan_pool
 
 # ─────────────────────────────────────────────
 #  ПОТОКИ
 # ─────────────────────────────────────────────
+def handle_update(upd: dict) -> None:
+    if "callback_query" in upd:
+        handle_callback(upd["callback_query"])
+    elif "message" in upd and "text" in upd["message"]:
+        handle_command(upd["message"])
+
 def bot_listener() -> None:
     """Polling Telegram updates."""
     global last_update_id
-    log.info("🤖 Bot listener started")
+    _log("threads", "info", "🤖 Bot listener started")
+    _tg("deleteWebhook")   # иначе getUpdates конфликтует с ранее выставленным webhook
+    backoff = 0.0
     while not stop_event.is_set():
         try:
+            # long polling сам ждёт до 25 с — дополнительный sleep не нужен
             updates = get_updates(last_update_id + 1, timeout=25)
+            if updates is None:
+                # _tg уже записал причину; без паузы сбой сети превратится в цикл запросов
+                backoff = min(POLL_RETRY_MAX, backoff * 2 or 1.0)
+                stop_event.wait(backoff)
+                continue
+            backoff = 0.0
+            t0 = time.monotonic()
             for upd in updates:
                 last_update_id = upd["update_id"]
-                if "callback_query" in upd:
-                    handle_callback(upd["callback_query"])
-                elif "message" in upd and "text" in upd["message"]:
-                    handle_command(upd["message"])
+                handle_update(upd)
+            # лаг — сколько следующий getUpdates ждал обработки пачки
+            loop_beat("bot_listener", time.monotonic() - t0)
         except Exception as e:
-            log.error("Bot listener error: %s", e)
+            _log("tg_errors", "error", "Bot listener error: %s", e)
             time.sleep(3)
-        else:
-            time.sleep(0.3)
 
+# ─── webhook: HTTP-приёмник → очередь → update_dispatcher ───
+updates_q: "queue.Queue[Tuple[float, dict]]" = queue.Queue()
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    secret = ""
+
+    def _reply(self, code: int) -> None:
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self) -> None:
+        if self.path.split("?")[0] != WEBHOOK_PATH:
+            self._reply(404)
+            return
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            _log("tg_warnings", "warning", "Webhook: bad secret token from %s", self.client_address[0])
+            self._reply(403)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > WEBHOOK_MAX_BODY:
+            self._reply(413 if length > 0 else 400)
+            return
+        try:
+            upd = json.loads(self.rfile.read(length))
+            if not isinstance(upd, dict) or "update_id" not in upd:
+                raise ValueError("no update_id")
+        except ValueError:
+            self._reply(400)
+            return
+        # отвечаем сразу: обработка идёт в update_dispatcher
+        updates_q.put((time.monotonic(), upd))
+        self._reply(200)
+
+    def log_message(self, fmt, *args) -> None:
+        pass
+
+def start_webhook() -> Optional[ThreadingHTTPServer]:
+    """Поднять приёмник webhook и зарегистрировать его в Telegram."""
+    _WebhookHandler.secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    try:
+        srv = ThreadingHTTPServer((WEBHOOK_LISTEN, WEBHOOK_PORT), _WebhookHandler)
+    except OSError as e:
+        _log("errors", "error", "Webhook bind %s:%d failed: %s", WEBHOOK_LISTEN, WEBHOOK_PORT, e)
+        return None
+    srv.daemon_threads = True
+    Thread(target=srv.serve_forever, name="Webhook", daemon=True).start()
+    ok = _tg("setWebhook", url=WEBHOOK_URL, secret_token=_WebhookHandler.secret,
+             allowed_updates=ALLOWED_UPDATES)
+    if not ok:
+        # без зарегистрированного webhook обновления не придут — main перейдёт на polling
+        _log("errors", "error", "🪝 setWebhook %s failed, falling back to polling", WEBHOOK_URL)
+        srv.shutdown()
+        srv.server_close()
+        return None
+    _log("startup", "info", "🪝 Webhook %s → http://%s:%d%s", WEBHOOK_URL,
+         WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+    return srv
+
+def update_dispatcher() -> None:
+    """Разбор обновлений, пришедших через webhook."""
+    _log("threads", "info", "🪝 Update dispatcher started")
+    seen: deque = deque(maxlen=1000)   # Telegram повторяет доставку при таймаутах
+    seen_set: Set[int] = set()
+    while not stop_event.is_set():
+        try:
+            queued_at, upd = updates_q.get(timeout=1)
+        except queue.Empty:
+            continue
+        uid = upd["update_id"]
+        if uid in seen_set:
+            continue
+        if len(seen) == seen.maxlen:
+            seen_set.discard(seen[0])
+        seen.append(uid)
+        seen_set.add(uid)
+        loop_beat("bot_listener", time.monotonic() - queued_at)
+        try:
+            handle_update(upd)
+        except Exception as e:
+            _log("errors", "error", "Update dispatch error: %s", e)
+
+
+def flush_pending(failures: Dict[str, int], now: Optional[datetime] = None) -> None:
+    """Один проход по pending: отправить группы, у которых истёк group_interval.
+    now — «текущее» время для группировки (при воспроизведении — время записи)."""
+    now = now or datetime.now()
+    with _lock:
+        ready: List[Tuple[str, List[Dict]]] = []
+        for cid in list(pending.keys()):
+            procs = pending[cid]
+            if not procs:
+                continue
+            if is_quiet(cid, now):
+                continue
+            s = get_settings(cid)
+            if s["group_notifications"]:
+                # ждём group_interval секунд с момента первого процесса
+                try:
+                    first_time = datetime.strptime(procs[0]["create_time"], "%Y-%m-%d %H:%M:%S")
+                    if (now - first_time).total_seconds() < s["group_interval"]:
+                        continue
+                except Exception:
+                    pass
+            ready.append((cid, list(procs)))   # снимок: пока идёт отправка, pending пополняется
+    if not ready:
+        return
+    # чаты с одинаковой пачкой событий получают одно и то же сообщение — форматируем его раз
+    rendered: Dict[Tuple[str, ...], Tuple[str, Optional[dict], str, int]] = {}
+    messages, kinds = [], {}
+    for cid, procs in ready:
+        key = tuple(event_id("", p) for p in procs)
+        msg = rendered.get(key)
+        if msg is None:
+            tf = time.perf_counter()
+            if len(procs) == 1:
+                msg = fmt_process(procs[0]), kb_process(procs[0]["name"], procs[0]), "single"
+            else:
+                msg = fmt_grouped(procs), None, "grouped"
+            msg = rendered[key] = msg + (notify_priority(procs),)
+            perf_observe("format", time.perf_counter() - tf)
+        text, markup, kinds[cid], prio = msg
+        messages.append((cid, text, markup, prio))
+    sent = broadcast(messages)   # без _lock: сканер и команды не ждут Telegram
+    with _lock:
+        for cid, procs in ready:
+            if sent.get(cid) is None:
+                # остаются в pending и журнале до следующей попытки
+                failures[cid] += 1
+                if failures[cid] < JOURNAL_MAX_ATTEMPTS:
+                    continue
+                _log("tg_errors", "error", "Drop %d notifications for %s after %d attempts",
+                     len(procs), cid, failures[cid])
+            else:
+                M_NOTIFY_TOTAL.inc(1, kinds[cid])
+            failures.pop(cid, None)
+            journal_ack(cid, procs)
+            done = {id(p) for p in procs}
+            pending[cid][:] = [p for p in pending[cid] if id(p) not in done]
 
 def notification_flusher() -> None:
     """Отправка сгруппированных уведомлений."""
-    log.info("📤 Notification flusher started")
+    _log("threads", "info", "📤 Notification flusher started")
+    failures: Dict[str, int] = defaultdict(int)
     while not stop_event.is_set():
-        time.sleep(5)
+        slept = time.monotonic()
+        stop_event.wait(FLUSH_INTERVAL)
+        loop_beat("notification_flusher", time.monotonic() - slept - FLUSH_INTERVAL)
+        t0 = time.perf_counter()
         try:
-            with _lock:
-                for cid in list(pending.keys()):
-                    procs = pending[cid]
-                    if not procs:
-                        continue
-                    if is_quiet(cid):
-                        continue
-                    s = get_settings(cid)
-                    if s["group_notifications"]:
-                        # ждём group_interval секунд с момента первого процесса
-                        try:
-                            first_time = datetime.strptime(procs[0]["create_time"], "%Y-%m-%d %H:%M:%S")
-                            if (datetime.now() - first_time).seconds < s["group_interval"]:
-                                continue
-                        except Exception:
-                            pass
-                    if len(procs) == 1:
-                        send_message(cid, fmt_process(procs[0]),
-                                     markup=kb_process(procs[0]["name"]))
-                    else:
-                        send_message(cid, fmt_grouped(procs))
-                    pending[cid].clear()
+            flush_pending(failures)
+        except Exception as e:
+            M_MONITOR_ERR.inc(1, "flusher")
+            _log("errors", "error", "Flusher error: %s", e)
+        journal_sync()
+        M_FLUSH_SECONDS.observe(time.perf_counter() - t0)
+        try:
+            digest_tick()
         except Exception as e:
-            log.error("Flusher error: %s", e)
+            M_MONITOR_ERR.inc(1, "digest")
+            _log("errors", "error", "Digest error: %s", e)
 
 
-def process_monitor() -> None:
-    """Основной цикл мониторинга новых процессов."""
+def resource_sampler() -> None:
+    """Периодические замеры CPU/RAM отслеживаемых процессов."""
+    _log("threads", "info", "🌡 Resource sampler started")
+    while not stop_event.is_set():
+        slept = time.monotonic()
+        stop_event.wait(SAMPLE_INTERVAL)
+        loop_beat("resource_sampler", time.monotonic() - slept - SAMPLE_INTERVAL)
+        t0 = time.perf_counter()
+        try:
+            sample_tracked()
+            if HAVE_PROC_STAT:
+                ta = time.perf_counter()
+                acct_sweep()
+                perf_observe("acct_sweep", time.perf_counter() - ta)
+        except Exception as e:
+            M_MONITOR_ERR.inc(1, "sampler")
+            _log("errors", "error", "Sampler error: %s", e)
+        M_SAMPLE_SECONDS.observe(time.perf_counter() - t0)
+
+
+def port_tracker() -> None:
+    """Снимки слушающих портов и уведомления об изменениях."""
+    _log("threads", "info", "🔌 Port tracker started")
+    while not stop_event.is_set():
+        t0 = time.perf_counter()
+        try:
+            opened, closed = ports_scan()
+            M_PORTS_SECONDS.observe(time.perf_counter() - t0)
+            if opened or closed:
+                digest_note_ports(opened, closed)
+                M_PORT_CHANGES.inc(len(opened), "opened")
+                M_PORT_CHANGES.inc(len(closed), "closed")
+                _log("new_processes", "info", "Ports: +%d -%d", len(opened), len(closed))
+                text = fmt_ports_change(opened, closed)
+                sent = broadcast([(cid, text, None, PRIO_ROUTINE) for cid in list(active_users)
+                                  if get_settings(cid)["notify_ports"] and not is_quiet(cid)])
+                M_NOTIFY_TOTAL.inc(sum(mid is not None for mid in sent.values()), "ports")
+        except Exception as e:
+            M_MONITOR_ERR.inc(1, "ports")
+            _log("errors", "error", "Port tracker error: %s", e)
+        slept = time.monotonic()
+        stop_event.wait(PORTS_INTERVAL)
+        loop_beat("port_tracker", time.monotonic() - slept - PORTS_INTERVAL)
+
+
+def scan_new_procs() -> List[psutil.Process]:
+    """Один проход по процессам: появившиеся с прошлого скана (known_pids обновляется)."""
     global known_pids
-    log.info("🔍 Process monitor started, known pids: %d", len(known_pids))
+    t0 = time.perf_counter()
+    current = set()
+    new_procs: List[psutil.Process] = []
+    for proc in psutil.process_iter():
+        current.add(proc.pid)
+        if proc.pid not in known_pids:
+            new_procs.append(proc)
+    known_pids = current
+    perf_observe("scan", time.perf_counter() - t0)
+    M_SCAN_PROCS.set(len(current))
+    M_NEW_PER_CYCLE.observe(len(new_procs))
+    M_NEW_TOTAL.inc(len(new_procs))
+    return new_procs
+
+def scan_cycle() -> List[Tuple[Optional[psutil.Process], Dict]]:
+    """Новые процессы за проход: (процесс, сведения). На больших хостах — через ScanPool."""
+    global known_pids, _scan_pool
+    pool = _scan_pool_for(len(known_pids))
+    if pool is None:
+        found = []
+        for proc in scan_new_procs():
+            tp = time.perf_counter()
+            info = get_proc_info(proc)
+            perf_observe("proc_info", time.perf_counter() - tp)
+            if info:
+                found.append((proc, info))
+        return found
+    t0 = time.perf_counter()
+    pids = [int(d) for d in os.listdir("/proc") if d.isdigit()]
+    try:
+        infos = pool.scan(pids)
+    except scanpool.PoolError as e:
+        # known_pids не трогаем: новый пул засеется старым набором и покажет пропущенное
+        _log("errors", "error", "Scan pool failed, restarting: %s", e)
+        pool.close()
+        _scan_pool = None
+        return []
+    known_pids = set(pids)
+    perf_observe("scan", time.perf_counter() - t0)
+    M_SCAN_PROCS.set(len(pids))
+    M_NEW_PER_CYCLE.observe(len(infos))
+    M_NEW_TOTAL.inc(len(infos))
+    found = []
+    for info in infos:
+        info.update(cgroup_attrs(info["pid"]))
+        try:
+            proc = psutil.Process(info["pid"])
+        except psutil.Error:
+            continue
+        found.append((proc, info))
+    return found
+
+def handle_new_process(info: Dict, proc: Optional[psutil.Process] = None,
+                       now: Optional[datetime] = None) -> None:
+    """Аномалии, фильтры, уведомления, статистика и дайджест для одного события.
+    proc — локальный процесс (для наблюдения за ресурсами); у событий агентов его нет.
+    now — время для тихих часов (при воспроизведении — время записи)."""
+    _log("new_processes", "info", "New: %s (pid %d)", info["name"], info["pid"])
+    # один раз на событие, до фильтров: от него зависит умный режим
+    anomaly = anomaly_observe(info, now.timestamp() if now else None)
+    if anomaly:
+        info["anomaly"] = anomaly
+        _log("new_processes", "info", "Anomaly: %s (pid %d): %s",
+             info["name"], info["pid"], anomaly)
+    notified: Set[str] = set()
+    verdicts: Dict[str, bool] = {}
+    direct: List[str] = []   # чаты без группировки — им сообщение сразу
+    want_stats = False
+    for cid in list(active_users):
+        tf = time.perf_counter()
+        ok = verdicts[cid] = should_notify(info, cid)
+        perf_observe("filter", time.perf_counter() - tf)
+        if not ok:
+            continue
+        notified.add(cid)
+        s = get_settings(cid)
+        want_stats = want_stats or s["track_stats"]
+        if s["group_notifications"]:
+            if journal_queue(cid, info):
+                with _lock:
+                    pending[cid].append(info)
+        else:
+            if not is_quiet(cid, now) and journal_queue(cid, info):
+                direct.append(cid)
+    if direct:
+        tf = time.perf_counter()
+        text, markup = fmt_process(info), kb_process(info["name"], info)   # одно на все чаты
+        perf_observe("format", time.perf_counter() - tf)
+        prio = notify_priority([info])
+
+        def on_sent(cid: str, mid: Optional[int]) -> None:
+            if mid is None:
+                with _lock:   # повторит notification_flusher
+                    pending[cid].append(info)
+            else:
+                M_NOTIFY_TOTAL.inc(1, "single")
+                journal_ack(cid, [info])
+
+        # скан не ждёт Telegram: результат разберёт поток рассылки
+        broadcast([(cid, text, markup, prio) for cid in direct], on_sent)
+    if want_stats:   # одно событие — одна запись, сколько бы ни было чатов
+        record_stat(info)
+    ring_note(info, bool(notified))
+    digest_note_event(info, verdicts, now)
+    if proc is not None:
+        sampler_track(proc, info, notified)
+
+def process_monitor() -> None:
+    """Основной цикл мониторинга новых процессов (и событий агентов и процесса-сканера)."""
+    _log("threads", "info", "🔍 Process monitor started, known pids: %d", len(known_pids))
     save_counter = 0
+    slept = None
     while not stop_event.is_set():
+        if slept is not None:
+            loop_beat("process_monitor", time.monotonic() - slept - CHECK_INTERVAL)
+        t0 = time.perf_counter()
+        scan_ts = time.time()
         try:
-            current = set()
-            new_procs: List[psutil.Process] = []
-            for proc in psutil.process_iter():
-                current.add(proc.pid)
-                if proc.pid not in known_pids:
-                    new_procs.append(proc)
-            known_pids = current
-
-            for proc in new_procs:
-                info = get_proc_info(proc)
-                if not info:
-                    continue
-                for cid in list(active_users):
-                    if not should_notify(info, cid):
-                        continue
-                    s = get_settings(cid)
-                    if s["track_stats"]:
-                        record_stat(info)
-                    if s["group_notifications"]:
-                        with _lock:
-                            pending[cid].append(info)
-                    else:
-                        if not is_quiet(cid):
-                            send_message(cid, fmt_process(info),
-                                         markup=kb_process(info["name"]))
+            if scanner_proc is None:   # иначе события приходят в collector_drain
+                batch = []
+                for proc, info in scan_cycle():
+                    batch.append(info)
+                    handle_new_process(info, proc)
+                record_batch(scan_ts, batch)
 
             save_counter += 1
             if save_counter >= 60:   # сохраняем раз в ~5 минут
                 save_counter = 0
-                _save(STATS_FILE, dict(process_stats))
+                history.prune_all(process_stats)
+                history.prune_all(group_stats)
+                save_stats()
+                save_digest()
+
+        except Exception as e:
+            M_MONITOR_ERR.inc(1, "monitor")
+            _log("errors", "error", "Monitor error: %s", e)
+        else:
+            if scanner_proc is None:
+                journal_watermark(scan_ts)
+        journal_sync()
+        if scanner_proc is None:
+            M_SCAN_SECONDS.observe(time.perf_counter() - t0)
+
+        slept = time.monotonic()
+        if collector_server is None and scanner_proc is None:
+            stop_event.wait(CHECK_INTERVAL)
+        else:
+            collector_drain(slept + CHECK_INTERVAL)
+
+# ─────────────────────────────────────────────
+#  АГЕНТ И КОЛЛЕКТОР
+#  Агент — только сканер: новые процессы раз в CHECK_INTERVAL уходят пачкой
+#  коллектору. Коллектор — обычный бот (Telegram, фильтры, статистика),
+#  который вдобавок принимает агентов (один поток, selectors) и обрабатывает
+#  их события в process_monitor как свои, с пометкой info["host"].
+#  Протокол — JSON-строки поверх unix-сокета или TCP:
+#    коллектор → {"nonce": случайная строка}  — своя на каждое соединение
+#    агент → {"hello": хост, "run": id запуска, "key": hmac(AGENT_SECRET, хост, run, nonce)}
+#    агент → {"s": номер, "e": [info, ...]}    (пустая пачка — heartbeat)
+#    агент → {"s": номер, "w": base64(wire.encode(...))} — то же в формате wire
+#    коллектор → {"a": номер}                  — пачка принята
+#  Неподтверждённые пачки агент переотправляет после переподключения,
+#  коллектор пропускает уже принятые номера (в пределах одного run).
+# ─────────────────────────────────────────────
+agents: Dict[str, Dict] = {}     # хост → {"addr", "run", "seq", "since", "seen", "events", "online"}
+remote_events: "queue.Queue[Tuple[Optional[str], Any]]" = queue.Queue(maxsize=COLLECTOR_QUEUE)   # события или пачка wire
+# (хост None — кадр своего процесса-сканера, см. ScannerProcess)
+collector_server: Optional["CollectorServer"] = None
+
+# обязательные поля события: агент не шлёт пустые, коллектор восстанавливает
+_REMOTE_DEFAULTS = {"exe": "N/A", "cmdline": "N/A", "username": "?", "status": "",
+                    "create_time": "?", "cpu": 0.0, "memory_mb": 0.0}
+
+def _parse_addr(addr: str) -> Tuple[int, Any]:
+    if addr.startswith("unix:"):
+        return socket.AF_UNIX, addr[5:]
+    host, _, port = addr.rpartition(":")
+    host = host.strip("[]") or "0.0.0.0"
+    return (socket.AF_INET6 if ":" in host else socket.AF_INET), (host, int(port))
+
+def _agent_key(host: str, run: str, nonce: str) -> str:
+    # nonce коллектора — ключ из перехваченного hello не подойдёт для другого соединения
+    msg = "\n".join((host, run, nonce)).encode()
+    return hmac.new(AGENT_SECRET.encode(), msg, hashlib.sha256).hexdigest()
+
+def _wire(msg: Dict) -> bytes:
+    return json.dumps(msg, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+# ─── агент ───
+def _agent_connect(addr: str, run: str) -> socket.socket:
+    family, target = _parse_addr(addr)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(10)
+        sock.connect(target)
+        buf = b""
+        while b"\n" not in buf:
+            data = sock.recv(4096)
+            if not data or len(buf) > 4096:
+                raise ConnectionResetError("collector sent no challenge")
+            buf += data
+        try:
+            nonce = str(json.loads(buf.split(b"\n", 1)[0])["nonce"])
+        except (ValueError, KeyError, TypeError):
+            raise ConnectionResetError("bad challenge from collector") from None
+        sock.sendall(_wire({"hello": HOST_NAME, "run": run, "key": _agent_key(HOST_NAME, run, nonce)}))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def _agent_acks(sock: socket.socket, buf: bytes) -> Tuple[List[int], bytes]:
+    """Прочитать без ожидания всё, что прислал коллектор."""
+    acks = []
+    sock.settimeout(0)
+    try:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                raise ConnectionResetError("collector closed connection")
+            buf += data
+    except BlockingIOError:
+        pass
+    finally:
+        sock.settimeout(10)
+    *lines, buf = buf.split(b"\n")
+    for line in lines:
+        try:
+            acks.append(int(json.loads(line)["a"]))
+        except (ValueError, KeyError, TypeError):
+            pass
+    return acks, buf
+
+def _agent_batch(seq: int, events: List[Dict]) -> bytes:
+    """Строка протокола с пачкой: кодируется один раз, переотправляется как есть."""
+    if AGENT_WIRE:
+        return _wire({"s": seq, "w": base64.b64encode(wire.encode(events)).decode()})
+    # пустые поля не шлём — коллектор подставит значения по умолчанию
+    return _wire({"s": seq, "e": [{k: v for k, v in e.items() if v not in (None, "")}
+                                  for e in events]})
 
+def agent_main(addr: str) -> None:
+    """Режим агента: сканер без Telegram и файлов данных, события — коллектору."""
+    global known_pids
+    run = secrets.token_hex(4)
+    known_pids = {p.pid for p in psutil.process_iter()}
+    outq: deque = deque()     # (номер, событий, строка) — отправлены или ждут, без подтверждения
+    queued = dropped = 0      # событий в outq / отброшено из-за переполнения
+    seq = sent = 0            # последний номер пачки / последний отправленный в это соединение
+    sock, inbuf = None, b""
+    retry_at, backoff, last_send = 0.0, 1.0, time.monotonic()
+    _log("startup", "info", "🛰 Агент %s → %s (процессов: %d)", HOST_NAME, addr, len(known_pids))
+    while not stop_event.is_set():
+        t0 = time.monotonic()
+        try:
+            events = [info for _, info in scan_cycle()]
+            for i in range(0, len(events), AGENT_BATCH_MAX):
+                seq += 1
+                batch = events[i:i + AGENT_BATCH_MAX]
+                outq.append((seq, len(batch), _agent_batch(seq, batch)))
+                queued += len(batch)
+            while queued > AGENT_BUFFER and len(outq) > 1:
+                lost = outq.popleft()[1]
+                queued  -= lost
+                dropped += lost
+            if sock is None and t0 >= retry_at:
+                try:
+                    sock, inbuf, sent = _agent_connect(addr, run), b"", 0
+                    backoff = 1.0
+                    _log("startup", "info", "🛰 Подключён к коллектору %s (в очереди: %d)", addr, queued)
+                except OSError as e:
+                    retry_at, backoff = t0 + backoff, min(backoff * 2, AGENT_RETRY_MAX)
+                    _log("errors", "warning", "Коллектор %s недоступен: %s", addr, e)
+            if sock is not None:
+                if not outq and t0 - last_send >= AGENT_HEARTBEAT:
+                    seq += 1
+                    outq.append((seq, 0, _wire({"s": seq, "e": []})))
+                for n, _, line in outq:
+                    if n > sent:
+                        sock.sendall(line)
+                        sent, last_send = n, t0
+                acks, inbuf = _agent_acks(sock, inbuf)
+                if acks:
+                    top = max(acks)
+                    while outq and outq[0][0] <= top:
+                        queued -= outq.popleft()[1]
+            if dropped:
+                _log("errors", "warning", "Агент: очередь переполнена, отброшено событий: %d", dropped)
+                dropped = 0
+        except OSError as e:
+            _log("errors", "warning", "Соединение с коллектором потеряно: %s", e)
+            if sock is not None:
+                sock.close()
+            sock, retry_at = None, t0 + backoff
         except Exception as e:
-            log.error("Monitor error: %s", e)
+            M_MONITOR_ERR.inc(1, "agent")
+            _log("errors", "error", "Agent error: %s", e)
+        stop_event.wait(max(0.0, CHECK_INTERVAL - (time.monotonic() - t0)))
+    if sock is not None:
+        sock.close()
+    if _scan_pool is not None:
+        _scan_pool.close()
 
-        time.sleep(CHECK_INTERVAL)
+# ─── коллектор ───
+class _AgentConn:
+    __slots__ = ("sock", "addr", "buf", "host", "nonce")
+
+    def __init__(self, sock: socket.socket, addr: str):
+        self.sock, self.addr, self.buf, self.host = sock, addr, b"", None
+        self.nonce = secrets.token_hex(16)
+
+class CollectorServer:
+    """Приём событий от агентов: один поток, неблокирующие сокеты, selectors."""
+
+    def __init__(self, addr: str):
+        family, target = _parse_addr(addr)
+        if family == socket.AF_UNIX:
+            try:
+                os.unlink(target)   # сокет от прошлого запуска
+            except FileNotFoundError:
+                pass
+        self.addr = addr
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        if family != socket.AF_UNIX:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(target)
+        if family == socket.AF_UNIX:
+            os.chmod(target, 0o600)   # подключаться может только владелец — вместо секрета
+        self.sock.listen(512)
+        self.sock.setblocking(False)
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.sock, selectors.EVENT_READ, None)
+
+    def serve(self) -> None:
+        _log("threads", "info", "🛰 Collector listening on %s", self.addr)
+        while not stop_event.is_set():
+            for key, _ in self.sel.select(timeout=1):
+                if key.data is None:
+                    self._accept()
+                    continue
+                try:
+                    self._read(key.data)
+                except Exception as e:
+                    # ошибка одного соединения не должна останавливать приём остальных
+                    _log("errors", "error", "Коллектор: ошибка соединения %s: %s",
+                         key.data.host or key.data.addr, e)
+                    if key.data.sock.fileno() != -1:
+                        self._close(key.data)
+        for key in list(self.sel.get_map().values()):
+            key.fileobj.close()
+        self.sel.close()
+
+    def _accept(self) -> None:
+        try:
+            sock, peer = self.sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        addr = f"{peer[0]}:{peer[1]}" if isinstance(peer, tuple) else "unix"
+        c = _AgentConn(sock, addr)
+        try:
+            sock.send(_wire({"nonce": c.nonce}))   # пустой буфер свежего сокета — строка уйдёт целиком
+        except OSError:
+            sock.close()
+            return
+        self.sel.register(sock, selectors.EVENT_READ, c)
+
+    def _close(self, c: _AgentConn) -> None:
+        self.sel.unregister(c.sock)
+        c.sock.close()
+        ag = agents.get(c.host) if c.host else None
+        if ag and ag.get("conn") is c:
+            ag["online"], ag["conn"] = False, None
+            _log("threads", "info", "🛰 Агент отключился: %s", c.host)
+
+    def _read(self, c: _AgentConn) -> None:
+        try:
+            data = c.sock.recv(262144)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(c)
+            return
+        c.buf += data
+        *lines, c.buf = c.buf.split(b"\n")
+        if len(c.buf) > COLLECTOR_LINE_MAX:
+            _log("errors", "warning", "Коллектор: слишком длинная строка от %s", c.host or c.addr)
+            self._close(c)
+            return
+        for line in lines:
+            if line and not self._handle(c, line):
+                self._close(c)
+                return
+
+    def _handle(self, c: _AgentConn, line: bytes) -> bool:
+        """False — закрыть соединение."""
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            return False
+        if not isinstance(msg, dict):
+            return False
+        now = time.time()
+        if c.host is None:
+            host, run, key = msg.get("hello"), msg.get("run") or "", msg.get("key")
+            if not (isinstance(host, str) and isinstance(run, str) and isinstance(key, str)):
+                _log("errors", "warning", "Коллектор: неверное приветствие (%s)", c.addr)
+                return False
+            if not host or not hmac.compare_digest(key, _agent_key(host, run, c.nonce)):
+                _log("errors", "warning", "Коллектор: агент %r не прошёл проверку (%s)", host, c.addr)
+                return False
+            c.host = host
+            ag = agents.setdefault(host, {"run": None, "seq": 0, "since": now, "events": 0})
+            if ag["run"] != msg.get("run"):   # агент перезапущен — нумерация заново
+                ag.update(run=msg.get("run"), seq=0, since=now)
+            ag.update(addr=c.addr, seen=now, online=True, conn=c)
+            _log("threads", "info", "🛰 Агент подключился: %s (%s)", host, c.addr)
+            return True
+        ag = agents[c.host]
+        ag["seen"] = now
+        seq, events = msg.get("s"), msg.get("e") or []
+        if not isinstance(seq, int) or not isinstance(events, list):
+            return False
+        if seq > ag["seq"]:
+            if "w" in msg:   # двоичная пачка: разбирается в process_monitor, здесь — только заголовок
+                try:
+                    events = base64.b64decode(msg["w"])
+                    count = wire.peek(events)[1]
+                except (TypeError, ValueError, wire.WireError) as e:
+                    _log("errors", "warning", "Коллектор: битая пачка от %s: %s", c.host, e)
+                    return False
+            else:
+                count = len(events)
+            if count:
+                try:
+                    remote_events.put_nowait((c.host, events))
+                except queue.Full:
+                    # без подтверждения: агент переподключится и отправит пачку снова
+                    _log("errors", "warning", "Коллектор: очередь полна, отключаю %s", c.host)
+                    return False
+                ag["events"] += count
+                M_AGENT_EVENTS.inc(count)
+            ag["seq"] = seq
+        try:
+            c.sock.send(_wire({"a": seq}))
+        except BlockingIOError:
+            pass   # подтверждение потеряно — агент переотправит, дубликат будет пропущен
+        except OSError:
+            return False
+        return True
+
+def collector_drain(deadline: float) -> None:
+    """Вместо сна между сканами: обрабатывать события агентов и сканера до deadline (monotonic)."""
+    while not stop_event.is_set():
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return
+        try:
+            host, events = remote_events.get(timeout=min(left, 1.0))
+        except queue.Empty:
+            continue
+        if host is None:
+            scanner_batch(*events)
+            continue
+        if isinstance(events, bytes):
+            try:
+                events = wire.decode(events)
+            except wire.WireError as e:
+                _log("errors", "warning", "Коллектор: не разобрать пачку от %s: %s", host, e)
+                continue
+        for info in events:
+            if not isinstance(info, dict) or "name" not in info or "pid" not in info:
+                continue
+            for key, value in _REMOTE_DEFAULTS.items():
+                info.setdefault(key, value)
+            info["host"] = host
+            try:
+                handle_new_process(info)
+            except Exception as e:
+                M_MONITOR_ERR.inc(1, "collector")
+                _log("errors", "error", "Collector event error (%s): %s", host, e)
+
+def fmt_agents() -> str:
+    if collector_server is None:
+        return ("🛰 Режим коллектора выключен.\n"
+                "Запуск: <code>monitor.py --collector unix:/run/pm.sock</code>")
+    items = sorted(list(agents.items()), key=lambda x: (not x[1]["online"], x[0]))
+    online = sum(1 for _, a in items if a["online"])
+    now = time.time()
+    lines = [f"🛰 <b>Агенты</b>: {online} в сети из {len(items)}\n"]
+    for host, a in items[:40]:
+        lines.append(f"{'🟢' if a['online'] else '🔴'} <code>{host}</code> — "
+                     f"событий {a['events']}, был {now - a['seen']:.0f}s назад")
+    if len(items) > 40:
+        lines.append(f"\n<i>…и ещё {len(items) - 40}</i>")
+    if not items:
+        lines.append("Пока никто не подключился.")
+    return "\n".join(lines)
+
+# ─────────────────────────────────────────────
+#  ЗАПИСЬ И ВОСПРОИЗВЕДЕНИЕ
+#  --record: каждый скан с новыми процессами дописывается в файл как
+#  время скана (8 байт, double) + пачка wire.encode(результатов get_proc_info).
+#  --replay: те же пачки по порядку проходят через handle_new_process
+#  (фильтры, статистика, аномалии) и flush_pending (группировка,
+#  форматирование), а Telegram подменяется локальным HTTP-сервером.
+#  Группировка, тихие часы, дайджест и прогрев детектора аномалий считаются
+#  по времени записи, а не по часам, так что прогон одной записи с одними
+#  настройками даёт одни и те же сообщения.
+#  Состояние (настройки, списки, статистика) читается с диска, но не пишется.
+# ─────────────────────────────────────────────
+_REC_TS = struct.Struct(">d")
+_rec_fh = None
+
+def record_open(path: str) -> None:
+    global _rec_fh
+    _rec_fh = open(path, "ab")
+    _log("startup", "info", "⏺ Запись событий в %s", path)
+
+def record_batch(ts: float, events: List[Dict]) -> None:
+    if _rec_fh is None or not events:
+        return
+    _rec_fh.write(_REC_TS.pack(ts) + wire.encode(events))
+    _rec_fh.flush()
+
+def read_recording(path: str) -> Iterable[Tuple[float, List[Dict]]]:
+    """(время скана, события) по порядку; недописанный хвост пропускается."""
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(_REC_TS.size + wire.HEADER.size)
+            if len(head) < _REC_TS.size + wire.HEADER.size:
+                return
+            length = wire.HEADER.unpack_from(head, _REC_TS.size)[4]
+            body = f.read(length)
+            if len(body) < length:
+                return
+            yield _REC_TS.unpack_from(head)[0], wire.decode(head[_REC_TS.size:] + body)
+
+class _FakeTelegram(BaseHTTPRequestHandler):
+    """Bot API для воспроизведения: на всё отвечает ok, считает вызовы."""
+    latency = 0.0
+    calls: Counter = Counter()
+    _ids = iter(range(1, 1 << 62))
+
+    def do_POST(self) -> None:
+        method = self.path.rsplit("/", 1)[-1]
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        result = [] if method == "getUpdates" else {"message_id": next(self._ids)}
+        body = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args) -> None:
+        pass
+
+def replay_main(path: str, speed: float, tg_latency: float) -> None:
+    """Прогнать запись через обработку событий и отправку; отчёт — в stdout."""
+    global BASE_URL, dry_run, _anomaly_started
+    dry_run = True
+    _FakeTelegram.latency = tg_latency
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _FakeTelegram)
+    srv.daemon_threads = True
+    Thread(target=srv.serve_forever, name="FakeTelegram", daemon=True).start()
+    BASE_URL = f"http://127.0.0.1:{srv.server_address[1]}/botREPLAY"
+    load_all()
+
+    failures: Dict[str, int] = defaultdict(int)
+    events = batches = 0
+    first = last = next_flush = None
+    wall0 = t0 = time.perf_counter()
+    for ts, batch in read_recording(path):
+        if first is None:
+            first, next_flush = ts, ts + FLUSH_INTERVAL
+            _anomaly_started = ts   # прогрев детектора — от начала записи, а не от запуска
+        if speed > 0:
+            delay = wall0 + (ts - first) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        while next_flush <= ts:   # проходы flusher, которые были бы между сканами
+            flush_pending(failures, datetime.fromtimestamp(next_flush))
+            next_flush += FLUSH_INTERVAL
+        for info in batch:
+            handle_new_process(info, now=datetime.fromtimestamp(ts))
+        events += len(batch)
+        batches += 1
+        last = ts
+        if stop_event.is_set():
+            break
+    broadcast_wait()       # прямые уведомления уходят в фоне — дождаться их
+    if last is not None:   # дослать то, что ещё ждало группировки
+        flush_pending(failures, datetime.fromtimestamp(last + 86400))
+    elapsed = time.perf_counter() - t0
+    srv.shutdown()
+
+    span = (last - first) if last is not None else 0.0
+    print(f"Запись: {path}")
+    print(f"  пачек {batches}, событий {events}, охват {span:.0f} с")
+    print(f"Прогон: {elapsed:.2f} с, {events / elapsed if elapsed else 0:,.0f} событий/с"
+          f" (скорость {'макс.' if speed <= 0 else f'×{speed:g}'})")
+    print("Telegram: " + (", ".join(f"{m} {n}" for m, n in sorted(_FakeTelegram.calls.items()))
+                          or "вызовов не было"))
+    print(f"\n{'операция':<14}{'n':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for op in ("filter", "format", "send"):
+        samples = list(_perf.get(op, ()))
+        if samples:
+            p50, p95, p99 = _percentiles(samples)
+            print(f"{op:<14}{len(samples):>8}{_fmt_ms(p50):>10}{_fmt_ms(p95):>10}{_fmt_ms(p99):>10}")
+
+# ─────────────────────────────────────────────
+#  ПРОЦЕСС-СКАНЕР
+#  --scan-process: process_monitor сканирует не сам, а получает кадры от
+#  дочернего «monitor.py --scanner FD» — того же скана (scan_cycle, пул
+#  scanpool.py на больших хостах) в отдельном интерпретаторе со своим GIL.
+#  Кадр в канале FD: время начала скана (double), длительность (float),
+#  процессов (u32) + пачка wire.encode(новых процессов); пустая пачка —
+#  heartbeat. Поток надзора читает канал и кладёт кадры в remote_events,
+#  где их обрабатывает collector_drain. Сканер умер, прислал мусор или
+#  молчит SCANNER_STALL с — перезапускается (пауза растёт до
+#  SCANNER_RESTART_MAX); новый сканер считает новым всё, что запустилось
+#  после начала последнего полученного скана. Умер бот — сканер получает
+#  EPIPE на записи и выходит.
+# ─────────────────────────────────────────────
+_SCAN_HEAD = struct.Struct(">dfI")
+scanner_proc: Optional["ScannerProcess"] = None
+
+def _initial_known(since: Optional[float]) -> List[psutil.Process]:
+    """Процессы хоста; known_pids — те, что запущены до since (None — все)."""
+    global known_pids
+    procs = list(psutil.process_iter(["create_time", "exe"]))
+    known_pids = {p.pid for p in procs
+                  if since is None or (p.info["create_time"] or 0) < since}
+    return procs
+
+def scanner_main(fd: int, since: Optional[float]) -> None:
+    """Режим --scanner: только скан, кадры — в fd. Выход, когда родитель закрыл канал."""
+    out = os.fdopen(fd, "wb")
+    _initial_known(since)
+    known_pids.add(os.getpid())   # сам сканер запущен после since — он не новый процесс
+    parent = os.getppid()
+    try:
+        while not stop_event.is_set() and os.getppid() == parent:
+            t0 = time.monotonic()
+            ts = time.time()
+            try:
+                events = [info for _, info in scan_cycle()]
+            except Exception as e:
+                _log("errors", "error", "Scanner error: %s", e)
+                events = []
+            took = time.monotonic() - t0
+            try:
+                out.write(_SCAN_HEAD.pack(ts, took, len(known_pids)) + wire.encode(events))
+                out.flush()
+            except OSError:   # бот завершился
+                return
+            stop_event.wait(max(0.0, CHECK_INTERVAL - (time.monotonic() - t0)))
+    finally:
+        if _scan_pool is not None:
+            _scan_pool.close()
+
+def _local_proc(info: Dict) -> Optional[psutil.Process]:
+    """psutil.Process для события сканера — если PID ещё принадлежит тому же процессу."""
+    try:
+        proc = psutil.Process(info["pid"])
+        if abs(proc.create_time() - info["create_ts"]) < 0.01:
+            return proc
+    except psutil.Error:
+        pass
+    return None
+
+def scanner_batch(ts: float, took: float, nprocs: int, frame: bytes) -> None:
+    """Кадр процесса-сканера — как один проход scan_cycle в process_monitor."""
+    # задержка в боте: от конца скана до начала обработки
+    loop_beat("scanner", time.time() - ts - took)
+    try:
+        events = wire.decode(frame)
+    except wire.WireError as e:
+        _log("errors", "warning", "Сканер: не разобрать пачку: %s", e)
+        return
+    perf_observe("scan", took)
+    M_SCAN_SECONDS.observe(took)
+    M_SCAN_PROCS.set(nprocs)
+    M_NEW_PER_CYCLE.observe(len(events))
+    M_NEW_TOTAL.inc(len(events))
+    for info in events:
+        try:
+            handle_new_process(info, _local_proc(info))
+        except Exception as e:
+            M_MONITOR_ERR.inc(1, "monitor")
+            _log("errors", "error", "Monitor error: %s", e)
+    record_batch(ts, events)
+    journal_watermark(ts)
+
+class ScannerProcess:
+    """Дочерний сканер и надзор за ним (поток ScannerSupervisor)."""
+
+    def __init__(self, since: Optional[float]):
+        self.since = since   # начало последнего полученного скана
+        self.proc: Optional[subprocess.Popen] = None
+        self.last_frame = 0.0
+
+    def _start(self) -> int:
+        r, w = os.pipe()
+        cmd = [sys.executable, os.path.abspath(__file__), "--scanner", str(w)]
+        if self.since is not None:
+            cmd += ["--since", repr(self.since)]
+        try:
+            self.proc = subprocess.Popen(cmd, pass_fds=(w,), stdin=subprocess.DEVNULL)
+        except OSError:
+            os.close(r)
+            raise
+        finally:
+            os.close(w)
+        self.last_frame = time.monotonic()
+        return r
+
+    def stop(self) -> None:
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self.proc = None
+
+    def _pump(self, fd: int) -> str:
+        """Читать кадры, пока сканер жив; вернуть причину остановки."""
+        buf = b""
+        head = _SCAN_HEAD.size + wire.HEADER.size
+        while not stop_event.is_set():
+            ready, _, _ = select.select([fd], [], [], 1.0)
+            if not ready:
+                if time.monotonic() - self.last_frame > SCANNER_STALL:
+                    return f"stalled ({SCANNER_STALL}s without frames)"
+                continue
+            data = os.read(fd, 262144)
+            if not data:
+                return f"exited with code {self.proc.wait()}"
+            buf += data
+            while len(buf) >= head:
+                frame_end = head + wire.HEADER.unpack_from(buf, _SCAN_HEAD.size)[4]
+                if len(buf) < frame_end:
+                    break
+                try:
+                    wire.peek(buf[_SCAN_HEAD.size:head])
+                except wire.WireError as e:
+                    return f"sent garbage ({e})"
+                ts, took, nprocs = _SCAN_HEAD.unpack_from(buf)
+                item = (None, (ts, took, nprocs, buf[_SCAN_HEAD.size:frame_end]))
+                buf = buf[frame_end:]
+                self.last_frame, self.since = time.monotonic(), ts
+                # очередь полна — бот не успевает; ждём, сканер подождёт на записи в канал
+                while not stop_event.is_set():
+                    try:
+                        remote_events.put(item, timeout=1.0)
+                        break
+                    except queue.Full:
+                        pass
+        return "stopped"
+
+    def supervise(self) -> None:
+        backoff = 1.0
+        while not stop_event.is_set():
+            started = time.monotonic()
+            try:
+                fd = self._start()
+            except OSError as e:
+                reason = f"failed to start ({e})"
+            else:
+                _log("threads", "info", "🧭 Scanner process started: pid %d", self.proc.pid)
+                try:
+                    reason = self._pump(fd)
+                finally:
+                    os.close(fd)
+                    self.stop()
+            if stop_event.is_set():
+                break
+            M_SCANNER_RESTARTS.inc()
+            # проработал долго — значит, сбой разовый: паузы заново с 1 с
+            backoff = 1.0 if time.monotonic() - started > SCANNER_STALL else min(backoff * 2, SCANNER_RESTART_MAX)
+            _log("errors", "error", "Scanner process %s, restarting in %.0fs", reason, backoff)
+            stop_event.wait(backoff)
+        self.stop()
 
 # ─────────────────────────────────────────────
 #  ТОЧКА ВХОДА
 # ─────────────────────────────────────────────
 def main() -> None:
-    log.info("=" * 55)
-    log.info("🚀  Process Monitor Pro  v2.0")
-    log.info("=" * 55)
+    global HOST_NAME, collector_server, scanner_proc, _log_listener
+    parser = argparse.ArgumentParser(description="Process Monitor Pro")
+    parser.add_argument("--agent", metavar="АДРЕС", default=AGENT_COLLECTOR,
+                        help="режим агента: только сканер, события — коллектору по адресу")
+    parser.add_argument("--collector", metavar="АДРЕС", default=COLLECTOR_LISTEN,
+                        help="принимать события агентов (unix:/путь или хост:порт)")
+    parser.add_argument("--host", default=HOST_NAME, help="имя хоста в событиях агента")
+    parser.add_argument("--record", metavar="ФАЙЛ", default=RECORD_FILE,
+                        help="дописывать новые процессы в файл для --replay")
+    parser.add_argument("--replay", metavar="ФАЙЛ",
+                        help="воспроизвести запись против локального фейкового Telegram и выйти")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="скорость воспроизведения: 1 — как в записи, 10 — в 10 раз быстрее, "
+                             "0 — без пауз (по умолчанию)")
+    parser.add_argument("--tg-latency", type=float, default=0, metavar="МС",
+                        help="задержка ответа фейкового Telegram, мс")
+    parser.add_argument("--scan-process", action="store_true", default=SCAN_PROCESS,
+                        help="сканировать процессы в отдельном дочернем процессе")
+    parser.add_argument("--scanner", type=int, metavar="FD", help=argparse.SUPPRESS)
+    parser.add_argument("--since", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    HOST_NAME = args.host
+    for addr in (args.agent, args.collector):
+        if addr and not addr.startswith("unix:") and not AGENT_SECRET:
+            # с пустым секретом ключ агента может посчитать кто угодно
+            parser.error(f"{addr}: для TCP нужен AGENT_SECRET в начале monitor.py")
+
+    if args.scanner is not None:
+        # дочерний сканер: лог только в stdout (файл ротирует бот), Ctrl+C — дело родителя
+        _log_listener.stop()
+        for h in _log_listener.handlers:
+            h.close()
+        _log_listener = _setup_logging(to_file=False, tag="[scanner] ")
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        scanner_main(args.scanner, args.since)
+        _log_listener.stop()
+        return
+
+    if args.replay:
+        replay_main(args.replay, args.speed, args.tg_latency / 1000)
+        _log_listener.stop()
+        return
+
+    _log("startup", "info", "=" * 55)
+    _log("startup", "info", "🚀  Process Monitor Pro  v2.1")
+    _log("startup", "info", "=" * 55)
+
+    if args.agent:
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        try:
+            agent_main(args.agent)
+        except KeyboardInterrupt:
+            stop_event.set()
+        _log("startup", "info", "✅ Агент остановлен.")
+        _log_listener.stop()
+        return
 
     load_all()
-    log.info("Пользователей: %d  Игнорируемых: %d  Белый список: %d",
-             len(active_users), len(ignored_procs), len(whitelist_procs))
+    ring_open()
+    if args.record:
+        record_open(args.record)
+    _log("startup", "info", "Пользователей: %d  Игнорируемых: %d  Белый список: %d",
+         len(active_users), len(ignored_procs), len(whitelist_procs))
 
-    # инициализация известных процессов
-    global known_pids
-    known_pids = {p.pid for p in psutil.process_iter()}
-    log.info("Процессов при старте: %d", len(known_pids))
+    # инициализация известных процессов: всё, что запустилось после
+    # последнего скана прошлого запуска (например, во время рестарта
+    # при деплое), считаем новым и сообщаем о нём
+    last_scan = journal_open()
+    procs = _initial_known(last_scan)
+    _log("startup", "info", "Процессов при старте: %d (новых с прошлого запуска: %d)",
+         len(procs), len(procs) - len(known_pids))
+    digest_seed(p.info["exe"] for p in procs)
+
+    M_START_TIME.set(time.time())
+    start_metrics_server()
+
+    if WEBHOOK_URL and start_webhook():
+        listener = Thread(target=update_dispatcher, name="UpdateDispatcher", daemon=True)
+    else:
+        listener = Thread(target=bot_listener, name="BotListener", daemon=True)
 
     threads = [
-        Thread(target=bot_listener,       name="BotListener",   daemon=True),
+        listener,
         Thread(target=notification_flusher,name="Flusher",       daemon=True),
+        Thread(target=resource_sampler,   name="Sampler",        daemon=True),
         Thread(target=process_monitor,    name="ProcessMonitor", daemon=False),
     ]
+    if HAVE_PROC_NET:
+        threads.insert(-1, Thread(target=port_tracker, name="PortTracker", daemon=True))
+    if args.collector:
+        collector_server = CollectorServer(args.collector)
+        threads.insert(-1, Thread(target=collector_server.serve, name="Collector", daemon=True))
+    if args.scan_process:
+        scanner_proc = ScannerProcess(last_scan)
+        threads.insert(-1, Thread(target=scanner_proc.supervise, name="ScannerSupervisor", daemon=True))
     for t in threads:
         t.start()
-        log.info("Thread started: %s", t.name)
+        _log("threads", "info", "Thread started: %s", t.name)
 
+    # systemctl stop/restart шлёт SIGTERM — завершаемся штатно, с сохранением
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
     try:
         # основной поток — process_monitor, ждём его
         threads[-1].join()
     except KeyboardInterrupt:
-        log.info("Остановка по Ctrl+C...")
+        _log("startup", "info", "Остановка по Ctrl+C...")
         stop_event.set()
     finally:
+        if _scan_pool is not None:
+            _scan_pool.close()
+        if scanner_proc is not None:
+            scanner_proc.stop()
+        journal_sync()
         save_all()
-        log.info("✅ Данные сохранены. Выход.")
+        _log("startup", "info", "✅ Данные сохранены. Выход.")
+        _log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Утилита командной строки к данным Process Monitor Pro — без бота и Telegram.
+
+    python3 pmctl.py tail [-n 20] [-f] [--json] [--ring ПУТЬ] [текст ...]
+    python3 pmctl.py top [-n 20] [--since 7d] [--until now] [--name 'py*']
+    python3 pmctl.py timeline ИМЯ [--bucket 1h] [--since 7d]
+    python3 pmctl.py users [--since 24h]
+    python3 pmctl.py export [--level raw|m|h|d] [--format csv|jsonl|npz|parquet] [-o ФАЙЛ]
+
+tail — последние события из кольцевого буфера бота (ringbuf.py), с -f —
+следить за новыми, как tail -f. Текст фильтрует по имени, команде,
+пользователю, юниту/контейнеру и хосту. Буфер только читается: бот
+при этом не блокируется.
+
+top, timeline, users, export — запросы к сохранённой истории (stats.json,
+с --groups — group_stats.json). Файл читается потоком по одной записи
+(history.iter_store), так что память не зависит от его размера; писать
+в него бот может одновременно — он заменяет файл атомарно. Ответы —
+таблицей или, с --format, CSV / JSON-строками; export умеет ещё
+столбцовые .npz (numpy) и Parquet (pyarrow) для ноутбуков.
+"""
+
+import argparse
+import csv
+import fnmatch
+import heapq
+import json
+import os
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import history
+import ringbuf
+
+DATA_DIR = "/root/Desktop/process-monitor"   # BASE_DIR бота
+
+FLAG_MARKS = ((ringbuf.FLAG_ANOMALY, "A"), (ringbuf.FLAG_NOTIFIED, "N"), (ringbuf.FLAG_REMOTE, "R"))
+
+
+def _print(rec: dict, as_json: bool) -> None:
+    if as_json:
+        print(json.dumps(rec, ensure_ascii=False))
+        return
+    flags = "".join(c for bit, c in FLAG_MARKS if rec["flags"] & bit) or "-"
+    print(f"{datetime.fromtimestamp(rec['seen']).strftime('%Y-%m-%d %H:%M:%S')} {flags:<3} "
+          f"{rec['pid']:>7} {rec['username'][:12]:<12} {rec['cpu']:>5.1f}% {rec['memory_mb']:>8.1f}MB "
+          f"{rec['host'] + ':' if rec['host'] else ''}{rec['name']}"
+          + (f" [{rec['group']}]" if rec["group"] else "") + f"  {rec['cmdline']}")
+
+
+def cmd_tail(args) -> int:
+    try:
+        ring = ringbuf.Ring(args.ring)
+    except (OSError, ringbuf.RingError) as e:
+        print(f"pmctl: {args.ring}: {e}", file=sys.stderr)
+        return 1
+    words = [w.lower() for w in args.text]
+    for rec in reversed(ring.latest(args.n, words=words)):
+        _print(rec, args.json)
+    if not args.follow:
+        return 0
+    seq = ring.head
+    try:
+        while True:
+            time.sleep(args.interval)
+            if ring.replaced():   # бот пересоздал буфер — читаем новый с начала
+                try:
+                    fresh = ringbuf.Ring(args.ring)
+                except (OSError, ringbuf.RingError):
+                    continue
+                ring.close()
+                ring, seq = fresh, 0
+            recs = ring.since(seq)
+            if recs:
+                seq = recs[-1]["seq"]
+            for rec in recs:
+                if all(any(w in rec[k].lower() for k in ringbuf.TEXT_FIELDS) for w in words):
+                    _print(rec, args.json)
+            sys.stdout.flush()
+    except (KeyboardInterrupt, BrokenPipeError):
+        return 0
+
+
+# ─── история (stats.json) ───
+def _entries(args) -> Iterator[Tuple[str, Dict]]:
+    path = args.file or os.path.join(DATA_DIR, "group_stats.json" if args.groups else "stats.json")
+    for name, entry in history.iter_store(path):
+        if not args.name or any(fnmatch.fnmatchcase(name, pat) for pat in args.name):
+            yield name, entry
+
+
+def _interval(args) -> Tuple[float, float]:
+    now = time.time()
+    return history.parse_time(args.since, now), history.parse_time(args.until, now)
+
+
+def _fmt_time(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class _Writer:
+    """Строки ответа: таблица (выравнивается в конце), CSV или JSON-строки (сразу)."""
+
+    def __init__(self, fmt: str, header: Sequence[str], out=None):
+        self.fmt, self.header = fmt, list(header)
+        self.out = out or sys.stdout
+        self.rows: List[list] = []
+        if fmt == "csv":
+            self.csv = csv.writer(self.out)
+            self.csv.writerow(self.header)
+
+    def row(self, values: Sequence) -> None:
+        if self.fmt == "csv":
+            self.csv.writerow(values)
+        elif self.fmt == "jsonl":
+            self.out.write(json.dumps(dict(zip(self.header, values)), ensure_ascii=False) + "\n")
+        else:
+            self.rows.append([f"{v:.1f}" if isinstance(v, float) else str(v) for v in values])
+
+    def close(self) -> None:
+        if self.fmt != "table":
+            return
+        widths = [max(len(h), *(len(r[i]) for r in self.rows)) if self.rows else len(h)
+                  for i, h in enumerate(self.header)]
+        for r in [self.header] + self.rows:
+            self.out.write("  ".join(v.ljust(w) for v, w in zip(r, widths)).rstrip() + "\n")
+
+
+def cmd_top(args) -> int:
+    since, until = _interval(args)
+    best = heapq.nlargest(args.n, ((history.count_between(e, since, until), name, e["last"] or 0)
+                                   for name, e in _entries(args)))
+    w = _Writer(args.format, ("name", "count", "last_seen"))
+    for count, name, last in best:
+        if count:
+            w.row((name, count, _fmt_time(last)))
+    w.close()
+    return 0
+
+
+def cmd_timeline(args) -> int:
+    since, until = _interval(args)
+    now = time.time()
+    want = max(60, int(now - history.parse_time(args.bucket, now)))
+    args.name = None
+    for name, entry in _entries(args):
+        if name != args.proc:
+            continue
+        width, rows = history.timeline(entry, since, until, want)
+        if width != want:
+            print(f"pmctl: за этот интервал есть только сводки по {width} с", file=sys.stderr)
+        w = _Writer(args.format, ("start", "count", "cpu_avg", "cpu_max", "mem_avg", "mem_max"))
+        for start, cnt, cpu_sum, cpu_max, mem_sum, mem_max in rows:
+            w.row((_fmt_time(start), int(cnt), cpu_sum / cnt, cpu_max, mem_sum / cnt, mem_max))
+        w.close()
+        return 0
+    print(f"pmctl: нет истории для {args.proc}", file=sys.stderr)
+    return 1
+
+
+def cmd_users(args) -> int:
+    since, until = _interval(args)
+    if since < time.time() - history.RAW_RETENTION - 60:
+        print("pmctl: пользователи есть только в сырых событиях — за последние сутки",
+              file=sys.stderr)
+    counts: Counter = Counter()
+    names: Dict[str, set] = {}
+    for name, entry in _entries(args):
+        raw = entry["raw"]
+        ts = raw["ts"]
+        lo, hi = bisect_left(ts, since), bisect_right(ts, until)
+        for usr in raw["usr"][lo:hi]:
+            counts[usr] += 1
+            names.setdefault(usr, set()).add(name)
+    w = _Writer(args.format, ("user", "count", "names"))
+    for usr, count in counts.most_common(args.n or None):
+        w.row((usr or "?", count, len(names[usr])))
+    w.close()
+    return 0
+
+
+def cmd_export(args) -> int:
+    since, until = _interval(args)
+    if args.format in ("npz", "parquet"):
+        if not args.output:
+            print(f"pmctl: для {args.format} нужен -o ФАЙЛ", file=sys.stderr)
+            return 2
+        if args.format not in history.export_formats():
+            print(f"pmctl: {args.format} недоступен (нет {'pyarrow' if args.format == 'parquet' else 'numpy'})",
+                  file=sys.stderr)
+            return 1
+        cols = history.collect_columns(_entries(args), args.level, since, until)
+        rows = history.write_columns(cols, args.output, args.format)
+        print(f"{args.output}: {rows} строк", file=sys.stderr)
+        return 0
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        if args.level == "raw":
+            w = _Writer(args.format, ("name",) + history.COLUMNS, out)
+            for name, entry in _entries(args):
+                raw = entry["raw"]
+                n = min(len(raw[c]) for c in history.COLUMNS)
+                ts = raw["ts"][:n]
+                lo, hi = bisect_left(ts, since), bisect_right(ts, until)
+                for row in zip(*(raw[c][lo:hi] for c in history.COLUMNS)):
+                    w.row((name,) + row)
+        else:
+            width = {key: width for key, width, _ in history.TIERS}[args.level]
+            w = _Writer(args.format, ("name", "start", "count", "cpu_sum", "cpu_max", "mem_sum", "mem_max"), out)
+            for name, entry in _entries(args):
+                rows = entry[args.level]
+                starts = [r[history.B_START] for r in rows]
+                for r in rows[bisect_left(starts, since // width * width):
+                              bisect_right(starts, until)]:
+                    w.row([name] + r)
+        w.close()
+    except BrokenPipeError:
+        pass
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="pmctl", description="Данные Process Monitor Pro без бота")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("tail", help="последние события из кольцевого буфера")
+    p.add_argument("text", nargs="*", help="фильтр: все слова должны встретиться")
+    p.add_argument("-n", type=int, default=20, help="сколько последних событий показать")
+    p.add_argument("-f", "--follow", action="store_true", help="следить за новыми событиями")
+    p.add_argument("--json", action="store_true", help="JSON-строки вместо таблицы")
+    p.add_argument("--ring", default=ringbuf.DEFAULT_PATH, help="файл буфера (RING_FILE бота)")
+    p.add_argument("--interval", type=float, default=0.5, help="период опроса для -f, сек")
+    p.set_defaults(func=cmd_tail)
+
+    store = argparse.ArgumentParser(add_help=False)
+    store.add_argument("--file", help="файл истории (по умолчанию stats.json бота)")
+    store.add_argument("--groups", action="store_true", help="история юнитов и контейнеров")
+    store.add_argument("--name", action="append", metavar="ШАБЛОН",
+                       help="только эти имена (glob, можно несколько раз)")
+    store.add_argument("--until", default="now", help="конец интервала (как в /history)")
+
+    def fmt_opt(p, choices=("table", "csv", "jsonl"), default="table"):
+        p.add_argument("--format", choices=choices, default=default, help="формат вывода")
+
+    p = sub.add_parser("top", parents=[store], help="самые частые процессы за интервал")
+    p.add_argument("-n", type=int, default=20, help="сколько строк")
+    p.add_argument("--since", default="24h", help="начало интервала: 90m, 7d, 2024-05-01…")
+    fmt_opt(p)
+    p.set_defaults(func=cmd_top)
+
+    p = sub.add_parser("timeline", parents=[store], help="запуски процесса по интервалам")
+    p.add_argument("proc", metavar="ИМЯ", help="процесс (или unit:…/ctr:… с --groups)")
+    p.add_argument("--bucket", default="1h", help="ширина интервала: 10m, 1h, 1d")
+    p.add_argument("--since", default="24h", help="начало интервала")
+    fmt_opt(p)
+    p.set_defaults(func=cmd_timeline)
+
+    p = sub.add_parser("users", parents=[store], help="запуски по пользователям (сырые события)")
+    p.add_argument("-n", type=int, default=0, help="сколько строк (0 — все)")
+    p.add_argument("--since", default="24h", help="начало интервала")
+    fmt_opt(p)
+    p.set_defaults(func=cmd_users)
+
+    p = sub.add_parser("export", parents=[store], help="выгрузить события или сводки")
+    p.add_argument("--level", choices=("raw",) + tuple(k for k, _, _ in history.TIERS), default="raw",
+                   help="raw — сырые события, m/h/d — сводки по минутам/часам/суткам")
+    p.add_argument("--since", default="400d", help="начало интервала")
+    p.add_argument("-o", "--output", help="файл (по умолчанию stdout)")
+    fmt_opt(p, ("csv", "jsonl", "npz", "parquet"), "csv")
+    p.set_defaults(func=cmd_export)
+
+    args = parser.parse_args()
+    try:
+        return args.func(args)
+    except (OSError, ValueError) as e:
+        print(f"pmctl: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
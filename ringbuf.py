@@ -0,0 +1,225 @@
+"""
+Кольцевой буфер последних событий «новый процесс» для Process Monitor Pro.
+
+Файл фиксированного размера, отображённый в память (mmap), обычно в /dev/shm:
+  заголовок, 64 байта, little-endian: магия b"PMRB", версия (u16),
+                                      размер записи (u16), слотов (u32),
+                                      head (u64) — номер последней записи
+  слоты по RECORD.size байт; запись с номером seq (с 1) — в слоте (seq − 1) % слотов
+Запись: seq (u64), время обнаружения и create_ts (double), pid (u32),
+memory_mb×10 (u32), cpu×10 (u16), флаги (u16), затем строки UTF-8
+фиксированной длины (обрезаются, добиваются нулями): name, username,
+host, группа («ctr:…»/«unit:…»), cmdline.
+
+Писатель один (бот): слот сначала помечается seq = 0, затем пишется тело,
+затем настоящий seq, и только потом head. Читатели (обработчики бота,
+pmctl.py tail) ничего не блокируют: запись считается целой, если seq в
+слоте равен ожидаемому и до, и после чтения; иначе её уже перезаписали.
+Память постоянна: старые события вытесняются новыми.
+Файл — только владельца (0600); чужой файл или symlink на его месте писатель
+не использует, а заменяет новым.
+
+Модуль не зависит от бота: его используют monitor.py и pmctl.py.
+"""
+
+import errno
+import mmap
+import os
+import stat
+import struct
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+MAGIC   = b"PMRB"
+VERSION = 1
+
+HEADER      = struct.Struct("<4sHHIQ")
+HEADER_SIZE = 64
+RECORD      = struct.Struct("<QddIIHH32s24s24s48s92s")
+_SEQ        = struct.Struct("<Q")
+_SEEN       = struct.Struct("<d")
+_HEAD_AT    = 12   # смещение head в заголовке
+_TEXT_AT    = 36   # смещение строк в записи
+TEXT_FIELDS = ("name", "username", "host", "group", "cmdline")
+
+FLAG_NOTIFIED = 0x01   # ушло хотя бы в один чат
+FLAG_ANOMALY  = 0x02   # детектор аномалий
+FLAG_REMOTE   = 0x04   # событие агента
+
+DEFAULT_PATH  = "/dev/shm/process-monitor.ring"
+DEFAULT_SLOTS = 1 << 18   # × 256 байт = 64 МБ
+
+
+class RingError(ValueError):
+    """Файл не кольцевой буфер или другой версии."""
+
+
+def _enc(value: str) -> bytes:
+    # длину режет struct ("32s" и т.п.) и добивает нулями
+    return value.encode("utf-8", "surrogateescape")
+
+
+def _dec(raw: bytes) -> str:
+    # обрезка могла разрезать символ — хвост отбрасываем
+    return raw.rstrip(b"\0").decode("utf-8", "ignore")
+
+
+class Ring:
+    def __init__(self, path: str = DEFAULT_PATH, slots: int = 0, writable: bool = False):
+        """writable — открыть на запись (создать или пересоздать под slots);
+        иначе только чтение существующего файла, slots берутся из заголовка."""
+        self.path = path
+        self.writable = writable
+        if writable:
+            self._open_writer(slots or DEFAULT_SLOTS)
+        else:
+            fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+            try:
+                self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+                self.ino = os.fstat(fd).st_ino
+            finally:
+                os.close(fd)
+        if len(self.map) < HEADER_SIZE:
+            raise RingError("короткий файл")
+        magic, version, size, self.slots, _ = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise RingError("не кольцевой буфер")
+        if version != VERSION or size != RECORD.size:
+            raise RingError(f"неизвестная версия {version}")
+        if len(self.map) < HEADER_SIZE + self.slots * RECORD.size:
+            raise RingError("файл короче заявленного")
+
+    def _open_writer(self, slots: int) -> None:
+        size = HEADER_SIZE + slots * RECORD.size
+        # /dev/shm доступен на запись всем: symlink не разыменовываем, чужой файл
+        # не используем; 0600 — в строках команд бывают пароли
+        flags = os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW
+        try:
+            fd = os.open(self.path, flags, 0o600)
+        except OSError as e:
+            if e.errno != errno.ELOOP:
+                raise
+            os.unlink(self.path)
+            fd = os.open(self.path, flags | os.O_EXCL, 0o600)
+        st = os.fstat(fd)
+        if (st.st_uid != os.geteuid() or not stat.S_ISREG(st.st_mode) or st.st_size != size
+                or not self._same(os.pread(fd, HEADER.size, 0), slots)):
+            # чужой файл, другой формат или размер: новый файл вместо старого, а не
+            # truncate — у читателей, открывших старый, отображение не обрывается (SIGBUS)
+            os.close(fd)
+            os.unlink(self.path)
+            fd = os.open(self.path, flags | os.O_EXCL, 0o600)
+            os.ftruncate(fd, size)   # разреженный файл: память занимают только записанные слоты
+            os.pwrite(fd, HEADER.pack(MAGIC, VERSION, RECORD.size, slots, 0), 0)
+        # иначе тот же буфер: после перезапуска бота продолжаем нумерацию
+        os.fchmod(fd, 0o600)   # файл от версии, создававшей его с 0644
+        try:
+            self.map = mmap.mmap(fd, size)
+            self.ino = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _same(head: bytes, slots: int) -> bool:
+        return (len(head) == HEADER.size
+                and HEADER.unpack(head)[:4] == (MAGIC, VERSION, RECORD.size, slots))
+
+    def replaced(self) -> bool:
+        """Бот пересоздал буфер (или удалил) — читателю пора открыть его заново."""
+        try:
+            return os.stat(self.path).st_ino != self.ino
+        except OSError:
+            return True
+
+    @property
+    def head(self) -> int:
+        """Номер последней записи (0 — пусто)."""
+        return _SEQ.unpack_from(self.map, _HEAD_AT)[0]
+
+    def append(self, info: Dict, flags: int = 0, seen: Optional[float] = None) -> int:
+        seq = self.head + 1
+        off = HEADER_SIZE + (seq - 1) % self.slots * RECORD.size
+        m = self.map
+        _SEQ.pack_into(m, off, 0)
+        group = (f"ctr:{info['container']}" if info.get("container")
+                 else f"unit:{info['unit']}" if info.get("unit") else "")
+        RECORD.pack_into(
+            m, off, 0, seen if seen is not None else time.time(),
+            float(info.get("create_ts") or 0.0), int(info["pid"]) & 0xFFFFFFFF,
+            min(0xFFFFFFFF, max(0, round((info.get("memory_mb") or 0.0) * 10))),
+            min(0xFFFF, max(0, round((info.get("cpu") or 0.0) * 10))), flags,
+            _enc(info.get("name") or ""), _enc(info.get("username") or ""),
+            _enc(info.get("host") or ""), _enc(group),
+            _enc(info.get("cmdline") or ""))
+        _SEQ.pack_into(m, off, seq)
+        _SEQ.pack_into(m, _HEAD_AT, seq)
+        return seq
+
+    def get(self, seq: int) -> Optional[Dict]:
+        """Запись с номером seq или None, если её уже вытеснили (или ещё нет)."""
+        if seq <= 0:
+            return None
+        off = HEADER_SIZE + (seq - 1) % self.slots * RECORD.size
+        m = self.map
+        if _SEQ.unpack_from(m, off)[0] != seq:
+            return None
+        rec = RECORD.unpack_from(m, off)
+        if rec[0] != seq or _SEQ.unpack_from(m, off)[0] != seq:
+            return None
+        (_, seen, created, pid, mem, cpu, flags,
+         name, user, host, group, cmdline) = rec
+        return {"seq": seq, "seen": seen, "create_ts": created, "pid": pid,
+                "memory_mb": mem / 10, "cpu": cpu / 10, "flags": flags,
+                "name": _dec(name), "username": _dec(user),
+                "host": _dec(host), "group": _dec(group),
+                "cmdline": _dec(cmdline)}
+
+    def since(self, seq: int, limit: int = 0) -> List[Dict]:
+        """Записи новее seq, от старых к новым (не больше limit, если задан).
+        Отставший читатель получает только то, что ещё не вытеснено."""
+        head = self.head
+        start = max(seq + 1, head - self.slots + 1, 1)
+        if limit:
+            start = max(start, head - limit + 1)
+        out = []
+        for n in range(start, head + 1):
+            rec = self.get(n)
+            if rec is not None:
+                out.append(rec)
+        return out
+
+    def latest(self, limit: int, after: float = 0.0, words: Sequence[str] = (),
+               match: Optional[Callable[[Dict], bool]] = None) -> List[Dict]:
+        """До limit последних записей (новые первыми), обнаруженных позже after.
+        words — все должны встретиться (без учёта регистра) в строковых полях."""
+        words = [w.lower() for w in words]
+        # ASCII-слова сначала ищем в сырых байтах слота — без разбора записи
+        raw_words = [w.encode() for w in words if w.isascii()]
+        out: List[Dict] = []
+        m = self.map
+        seq = self.head
+        stop = max(0, seq - self.slots)
+        while seq > stop and len(out) < limit:
+            if raw_words:
+                off = HEADER_SIZE + (seq - 1) % self.slots * RECORD.size
+                text = m[off + _TEXT_AT:off + RECORD.size].lower()
+                if not all(w in text for w in raw_words):
+                    # у пропущенной записи — только проверки конца: вытеснена или старше after
+                    if _SEQ.unpack_from(m, off)[0] != seq or _SEEN.unpack_from(m, off + 8)[0] < after:
+                        break
+                    seq -= 1
+                    continue
+            rec = self.get(seq)
+            seq -= 1
+            if rec is None:
+                continue
+            if rec["seen"] < after:   # записи идут в порядке обнаружения
+                break
+            if words and not all(any(w in rec[k].lower() for k in TEXT_FIELDS) for w in words):
+                continue
+            if match is None or match(rec):
+                out.append(rec)
+        return out
+
+    def close(self) -> None:
+        self.map.close()
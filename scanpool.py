@@ -0,0 +1,155 @@
+"""
+Параллельный скан /proc для Process Monitor Pro.
+
+Воркер — отдельный процесс (python3 scanpool.py), который владеет шардом
+PID (pid % число воркеров == номер воркера) и помнит известные ему PID.
+На запрос «вот PID твоего шарда» он возвращает сведения о новых процессах
+и забывает исчезнувшие.
+
+CPU новых процессов меряется одной паузой CPU_SAMPLE на всю пачку
+(тики до и после), а не отдельной паузой на каждый процесс.
+
+Обмен с воркером — pickle через stdin/stdout:
+  ("seed", [pid, ...])  → None            — запомнить процессы как известные
+  ("scan", [pid, ...])  → [info, ...]     — новые процессы шарда
+EOF на stdin — выход.
+
+ScanPool — сторона родителя: запускает воркеров и раздаёт им шарды.
+Модуль не зависит от бота: его используют monitor.py и benchmarks/bench_scan.py.
+"""
+
+import os
+import pickle
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+import psutil
+
+CPU_SAMPLE = 0.1     # сек — окно замера CPU новых процессов (как cpu_percent(interval=0.1))
+
+
+def _info(proc: psutil.Process) -> Optional[Dict]:
+    try:
+        with proc.oneshot():
+            cmdline = proc.cmdline()
+            created = proc.create_time()
+            return {
+                "pid":        proc.pid,
+                "name":       proc.name(),
+                "exe":        proc.exe() or "N/A",
+                "cmdline":    " ".join(cmdline) if cmdline else "N/A",
+                "username":   proc.username(),
+                "create_time":datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M:%S"),
+                "create_ts":  created,
+                "status":     proc.status(),
+                "memory_mb":  round(proc.memory_info().rss / 1024**2, 1),
+            }
+    except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+        return None
+
+
+def collect(pids: List[int]) -> List[Dict]:
+    """Сведения о процессах с CPU% за общее окно CPU_SAMPLE."""
+    procs, before = [], []
+    for pid in pids:
+        try:
+            proc = psutil.Process(pid)
+            t = proc.cpu_times()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            continue
+        procs.append(proc)
+        before.append(t.user + t.system)
+    if not procs:
+        return []
+    t0 = time.monotonic()
+    time.sleep(CPU_SAMPLE)
+    out = []
+    for proc, cpu0 in zip(procs, before):
+        info = _info(proc)
+        if info is None:
+            continue
+        try:
+            t = proc.cpu_times()
+            info["cpu"] = round((t.user + t.system - cpu0) / (time.monotonic() - t0) * 100, 1)
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            continue
+        out.append(info)
+    return out
+
+
+class Shard:
+    def __init__(self):
+        self.known: Set[int] = set()
+
+    def seed(self, pids: List[int]) -> None:
+        self.known = set(pids)
+
+    def scan(self, pids: List[int]) -> List[Dict]:
+        known = self.known
+        new = [pid for pid in pids if pid not in known]
+        self.known = set(pids)
+        return collect(new)
+
+
+class PoolError(RuntimeError):
+    """Воркер упал или ответил мусором — пул нужно пересоздать."""
+
+
+class ScanPool:
+    def __init__(self, workers: int):
+        self.n = workers
+        self.procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                      for _ in range(workers)]
+        self.pids = [p.pid for p in self.procs]
+
+    def _call(self, op: str, pids: Iterable[int]) -> List:
+        shards: List[List[int]] = [[] for _ in range(self.n)]
+        for pid in pids:
+            shards[pid % self.n].append(pid)
+        try:
+            # сначала запросы всем, потом ответы — воркеры работают одновременно
+            for p, shard in zip(self.procs, shards):
+                pickle.dump((op, shard), p.stdin, pickle.HIGHEST_PROTOCOL)
+                p.stdin.flush()
+            return [pickle.load(p.stdout) for p in self.procs]
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            raise PoolError(str(e) or type(e).__name__) from None
+
+    def seed(self, pids: Iterable[int]) -> None:
+        self._call("seed", pids)
+
+    def scan(self, pids: Iterable[int]) -> List[Dict]:
+        return [info for part in self._call("scan", pids) for info in part]
+
+    def close(self) -> None:
+        for p in self.procs:
+            try:
+                p.stdin.close()   # EOF — воркер выходит сам
+                p.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                p.kill()
+                p.wait()
+
+
+def worker_main() -> None:
+    inp, out = sys.stdin.buffer, sys.stdout.buffer
+    shard = Shard()
+    while True:
+        try:
+            op, pids = pickle.load(inp)
+        except EOFError:
+            return
+        result = shard.seed(pids) if op == "seed" else shard.scan(pids)
+        pickle.dump(result, out, pickle.HIGHEST_PROTOCOL)
+        out.flush()
+
+
+if __name__ == "__main__":
+    # Ctrl+C в терминале получает вся группа процессов; воркер остановит EOF от родителя
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_main()
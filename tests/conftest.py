@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# модули лежат в корне репозитория рядом с monitor.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def monitor(tmp_path, monkeypatch):
+    """monitor.py с файлами данных во временном каталоге."""
+    import monitor as m
+    for name in dir(m):
+        value = getattr(m, name)
+        if name.endswith("_FILE") and isinstance(value, str) and value:
+            monkeypatch.setattr(m, name, str(tmp_path / os.path.basename(value)))
+    m.stop_event.clear()
+    yield m
+    m.stop_event.clear()
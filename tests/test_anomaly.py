@@ -0,0 +1,43 @@
+import collections
+
+import pytest
+
+T0 = 1_700_000_000.0
+
+
+@pytest.fixture
+def observe(monitor, monkeypatch):
+    monkeypatch.setattr(monitor, "anomaly_state", collections.OrderedDict())
+    monkeypatch.setattr(monitor, "process_stats", {})
+    monkeypatch.setattr(monitor, "_anomaly_started", T0 - 2 * monitor.ANOMALY_WARMUP)
+
+    def run(name, ts, cpu=1.0, mem=10.0):
+        info = {"name": name, "create_ts": ts, "cpu": cpu, "memory_mb": mem}
+        return monitor.anomaly_observe(info, now=ts)
+    return run
+
+
+def _steady(monitor, observe, name, n, step=60.0):
+    # знакомое имя с ровным фоном: запуск раз в step секунд, небольшой разброс RAM
+    monitor.process_stats[name] = {}
+    for k in range(n):
+        assert observe(name, T0 + k * step, mem=10.0 + k % 3) is None
+    return T0 + n * step
+
+
+def test_new_name_after_warmup(monitor, observe, monkeypatch):
+    assert "впервые" in observe("evil", T0)
+    monkeypatch.setitem(monitor.process_stats, "cron", {})
+    assert observe("cron", T0) is None                  # имя есть в истории
+
+
+def test_memory_outlier_and_cooldown(monitor, observe):
+    ts = _steady(monitor, observe, "app", 40)
+    assert "RAM" in observe("app", ts, mem=500.0)
+    assert observe("app", ts + 60, mem=500.0) is None   # не чаще ANOMALY_COOLDOWN
+
+
+def test_spawn_storm(monitor, observe):
+    ts = _steady(monitor, observe, "job", 40, step=600.0)
+    reasons = [observe("job", ts + k * 0.01) for k in range(20)]
+    assert any(r and "чаще обычного" in r for r in reasons)
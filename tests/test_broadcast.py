@@ -0,0 +1,101 @@
+import collections
+import contextlib
+import threading
+import time
+import types
+
+import pytest
+
+
+@pytest.fixture
+def chats(monitor, monkeypatch):
+    sent = []
+    gate = threading.Event()
+
+    def fake_send(cid, text, markup=None, edit_id=None, parse_mode="HTML"):
+        gate.wait(5)
+        sent.append((cid, text))
+        return 1
+
+    monkeypatch.setattr(monitor, "send_message", fake_send)
+    monkeypatch.setattr(monitor, "SEND_RATE", 1000)
+    monkeypatch.setattr(monitor, "ring", None)
+    ids = [str(100 + k) for k in range(5)]
+    for cid in ids:
+        monitor.user_settings[cid] = dict(monitor.DEFAULT_SETTINGS, min_cpu_percent=0, min_memory_mb=0,
+                                          track_stats=False, quiet_hours_enabled=False)
+        monitor.active_users.add(cid)
+    yield ids, sent, gate
+    gate.set()
+    monitor.broadcast_wait()
+    for cid in ids:
+        monitor.active_users.discard(cid)
+        monitor.user_settings.pop(cid, None)
+        monitor.pending.pop(cid, None)
+
+
+def _info(pid):
+    return {"pid": pid, "name": "curl", "exe": "/usr/bin/curl", "cmdline": "curl x",
+            "username": "root", "create_time": "2026-01-01 00:00:00", "create_ts": time.time(),
+            "status": "running", "memory_mb": 5.0, "cpu": 1.0}
+
+
+def test_direct_notifications_do_not_block_scan(monitor, chats):
+    ids, sent, gate = chats
+    for cid in ids:
+        monitor.user_settings[cid]["group_notifications"] = False
+    t0 = time.monotonic()
+    monitor.handle_new_process(_info(1))
+    assert time.monotonic() - t0 < 1 and not sent
+    gate.set()
+    monitor.broadcast_wait()
+    assert sorted(cid for cid, _ in sent) == ids
+    assert len({text for _, text in sent}) == 1   # одно сообщение на все чаты
+
+
+def test_flush_does_not_hold_lock_while_sending(monitor, chats):
+    ids, sent, gate = chats
+    for cid in ids:
+        monitor.user_settings[cid]["group_notifications"] = True
+        monitor.user_settings[cid]["group_interval"] = 0
+    monitor.handle_new_process(_info(2))
+    failures = collections.defaultdict(int)
+    flusher = threading.Thread(target=monitor.flush_pending, args=(failures,))
+    flusher.start()
+    time.sleep(0.2)                               # отправки висят на gate
+    assert monitor._lock.acquire(timeout=1)
+    monitor.pending[ids[0]].append(_info(3))    # событие во время отправки
+    monitor._lock.release()
+    gate.set()
+    flusher.join(5)
+    assert len(sent) == len(ids)
+    assert [p["pid"] for p in monitor.pending[ids[0]]] == [3]
+    assert all(not monitor.pending[cid] for cid in ids[1:])
+    assert all(monitor.delivery[cid]["fail"] == 0 for cid in ids)
+
+
+class _Busy:
+    """Процесс, который держит нагрузку."""
+    def oneshot(self):
+        return contextlib.nullcontext()
+
+    def cpu_percent(self, interval):
+        return 90.0
+
+    def memory_info(self):
+        return types.SimpleNamespace(rss=200 * 1024**2)
+
+
+def test_sustained_alerts_go_through_pool(monitor, chats, monkeypatch):
+    ids, sent, gate = chats
+    monkeypatch.setattr(monitor, "_tracked", {})
+    for cid in ids:
+        monitor.user_settings[cid]["min_cpu_percent"] = 50
+    monitor.sampler_track(_Busy(), _info(4), set())
+    t0 = time.monotonic()
+    for _ in range(monitor.SAMPLE_SUSTAIN):
+        monitor.sample_tracked()
+    assert time.monotonic() - t0 < 1 and not sent   # замеры не ждут отправки
+    gate.set()
+    monitor.broadcast_wait()
+    assert sorted(cid for cid, _ in sent) == ids
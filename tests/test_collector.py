@@ -0,0 +1,75 @@
+import socket
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def collector(monitor, tmp_path, monkeypatch):
+    monkeypatch.setattr(monitor, "AGENT_SECRET", "s3cret")
+    monkeypatch.setattr(monitor, "HOST_NAME", "node-a")
+    addr = f"unix:{tmp_path / 'pm.sock'}"
+    srv = monitor.CollectorServer(addr)
+    t = threading.Thread(target=srv.serve, daemon=True)
+    t.start()
+    yield addr
+    monitor.stop_event.set()
+    t.join(5)
+    monitor.agents.clear()
+    while not monitor.remote_events.empty():
+        monitor.remote_events.get_nowait()
+
+
+def _raw(addr):
+    sock = socket.socket(socket.AF_UNIX)
+    sock.settimeout(5)
+    sock.connect(addr[5:])
+    nonce = sock.recv(4096)
+    assert b"nonce" in nonce
+    return sock
+
+
+def _closed(sock):
+    try:
+        return sock.recv(100) == b""
+    except ConnectionResetError:
+        return True
+
+
+def _send_batch(monitor, sock, seq, events):
+    sock.sendall(monitor._wire({"s": seq, "e": events}))
+    return sock.recv(100)
+
+
+def test_agent_handshake_and_ack(monitor, collector):
+    sock = monitor._agent_connect(collector, "run1")
+    assert _send_batch(monitor, sock, 1, [{"pid": 1, "name": "x"}]) == b'{"a":1}\n'
+    assert monitor.remote_events.get(timeout=5) == ("node-a", [{"pid": 1, "name": "x"}])
+    assert monitor.agents["node-a"]["online"]
+    sock.close()
+
+
+@pytest.mark.parametrize("line", [b"[]\n", b"1\n", b'"x"\n', b'{"hello": 1, "key": []}\n', b"{bad\n"])
+def test_garbage_before_auth_closes_only_that_peer(monitor, collector, line):
+    bad = _raw(collector)
+    bad.sendall(line)
+    assert _closed(bad)
+    good = monitor._agent_connect(collector, "run1")   # сервер жив
+    assert _send_batch(monitor, good, 1, []) == b'{"a":1}\n'
+    good.close()
+
+
+def test_bad_batch_after_auth(monitor, collector):
+    sock = monitor._agent_connect(collector, "run1")
+    sock.sendall(monitor._wire({"s": 1, "e": 5}))
+    assert _closed(sock)
+
+
+def test_replayed_hello_is_rejected(monitor, collector):
+    sock = _raw(collector)
+    key = monitor._agent_key("node-a", "run1", "captured-nonce")
+    sock.sendall(monitor._wire({"hello": "node-a", "run": "run1", "key": key}))
+    assert _closed(sock)
+    time.sleep(0.1)
+    assert "node-a" not in monitor.agents
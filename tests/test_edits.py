@@ -0,0 +1,56 @@
+import collections
+import time
+
+import pytest
+
+
+@pytest.fixture
+def tg(monitor, monkeypatch):
+    calls = []
+
+    def fake_tg(method, files=None, http_timeout=15, **kw):
+        calls.append(kw["text"])
+        if kw["text"] == "same-on-screen":
+            return {"ok": True, "unchanged": True}
+        return {"message_id": kw["message_id"]}
+
+    monkeypatch.setattr(monitor, "_tg", fake_tg)
+    monkeypatch.setattr(monitor, "EDIT_COALESCE", 0.2)
+    monkeypatch.setattr(monitor, "_edits", collections.OrderedDict())
+    return calls
+
+
+def test_same_content_not_resent(monitor, tg):
+    assert monitor.edit_message("1", 10, "a") == 10
+    time.sleep(0.25)
+    assert monitor.edit_message("1", 10, "a") == 10
+    assert tg == ["a"]
+
+
+def test_burst_sends_only_last(monitor, tg):
+    for text in ("a", "b", "c", "d"):
+        monitor.edit_message("1", 11, text)
+    assert tg == ["a"]
+    time.sleep(0.4)
+    assert tg == ["a", "d"]
+
+
+def test_not_modified_is_not_an_error(monitor, tg):
+    assert monitor.edit_message("1", 12, "same-on-screen") == 12
+    time.sleep(0.25)
+    assert monitor.edit_message("1", 12, "same-on-screen") == 12   # хеш запомнен
+    assert tg == ["same-on-screen"]
+
+
+def test_render_cached(monitor, monkeypatch):
+    monkeypatch.setattr(monitor, "_renders", {})
+    built = []
+
+    def build():
+        built.append(1)
+        return f"text{len(built)}", None
+
+    assert monitor.render_cached("1", "stats_total", build) == ("text1", None)
+    assert monitor.render_cached("1", "stats_total", build) == ("text1", None)
+    monitor.render_drop("stats_")
+    assert monitor.render_cached("1", "stats_total", build) == ("text2", None)
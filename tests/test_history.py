@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+import history
+
+
+NOW = 1_700_000_000.0
+OFFSETS = (-5000, -100, -200, -7000, -300, -6000, -30)   # create_ts приходят не по порядку
+
+
+def _entry():
+    entry = history.new_entry()
+    for k, off in enumerate(OFFSETS):
+        history.record(entry, NOW + off, 100 + k, 1.0, 10.0, "root")
+    return entry
+
+
+def test_raw_stays_sorted():
+    raw = _entry()["raw"]
+    assert raw["ts"] == sorted(raw["ts"])
+    # столбцы переставлены вместе с ts
+    assert dict(zip(raw["ts"], raw["pid"]))[NOW - 7000] == 103
+
+
+def test_last_hour_out_of_order():
+    entry = _entry()
+    assert history.count_between(entry, NOW - 3600, NOW) == 4
+    assert history.query(entry, NOW - 3600, NOW)["count"] == 4
+
+
+def test_prune_drops_only_old():
+    entry = _entry()
+    history.prune(entry, NOW - 5500 + history.RAW_RETENTION)
+    assert sorted(entry["raw"]["ts"]) == [NOW + off for off in sorted(OFFSETS) if off > -5500]
+
+
+def test_migrate_sorts_unsorted_raw():
+    entry = history.new_entry()
+    entry["raw"] = {"ts": [3.0, 1.0, 2.0], "pid": [3, 1, 2], "cpu": [0.0] * 3,
+                    "mem": [0.0] * 3, "usr": ["c", "a", "b"], "tag": [""] * 3}
+    raw = history.migrate({"x": entry})["x"]["raw"]
+    assert raw["ts"] == [1.0, 2.0, 3.0]
+    assert raw["usr"] == ["a", "b", "c"]
+
+
+def test_young_entry_uses_finest_complete_tier():
+    # имени три дня: сырые события и минутные сводки уже вычищены, часовые — целы
+    entry = history.new_entry()
+    for k in range(72):
+        history.record(entry, NOW - 3 * 86400 + k * 3600, k, 1.0, 1.0, "root")
+    history.prune(entry, NOW + history.RAW_RETENTION)
+    assert not entry["raw"]["ts"] and entry["h"]
+    assert history._pick_tier(entry, NOW - 7 * 86400) == ("h", 3600)
+    assert history.query(entry, NOW - 7 * 86400, NOW)["source"] == 3600
+    assert history.count_since(entry, NOW - 7 * 86400) == 72
+
+
+def test_history_page_escapes_names(monitor):
+    entry = history.new_entry()
+    history.record(entry, NOW - 10, 1, 1.0, 10.0, "<u>", "<tag>")
+    res = history.query(entry, NOW - 3600, NOW, "<u>")
+    res["name"] = "a<b>"
+    text, _ = monitor.fmt_history_page(res, 0)
+    assert "a&lt;b&gt;" in text and "&lt;u&gt;" in text and "&lt;tag&gt;" in text
+    assert "<u>" not in text and "<tag>" not in text
+
+
+def _store():
+    legacy = [{"ts": NOW - 50, "pid": 7, "cpu": 1.0, "mem": 2.0, "usr": "bob"}]
+    return {"curl": _entry(), "nginx": history.new_entry(), "old": legacy}
+
+
+def _write(path, store, **kw):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(store, f, **kw)
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("chunk", [7, history.STREAM_CHUNK])
+def test_iter_store_matches_migrate(tmp_path, monkeypatch, indent, chunk):
+    path = str(tmp_path / "stats.json")
+    _write(path, _store(), indent=indent)
+    monkeypatch.setattr(history, "STREAM_CHUNK", chunk)
+    with open(path, encoding="utf-8") as f:
+        expected = history.migrate(json.load(f))
+    assert dict(history.iter_store(path)) == expected
+
+
+def test_iter_store_empty(tmp_path):
+    path = str(tmp_path / "stats.json")
+    _write(path, {})
+    assert list(history.iter_store(path)) == []
+
+
+def test_iter_store_truncated(tmp_path, monkeypatch):
+    path = str(tmp_path / "stats.json")
+    _write(path, _store())
+    with open(path, "r+", encoding="utf-8") as f:
+        f.truncate(f.seek(0, 2) // 2)
+    monkeypatch.setattr(history, "STREAM_CHUNK", 64)
+    with pytest.raises(ValueError):
+        list(history.iter_store(path))
@@ -0,0 +1,64 @@
+import collections
+import json
+
+import pytest
+
+
+@pytest.fixture
+def journal(monitor, monkeypatch):
+    def fresh():
+        for name, value in (("_journal_buf", []), ("_journal_open", {}),
+                            ("_journal_done", collections.deque(maxlen=monitor.JOURNAL_KEEP_ACKED)),
+                            ("_journal_done_set", set()), ("_journal_mark", None),
+                            ("_journal_fh", None), ("pending", collections.defaultdict(list))):
+            monkeypatch.setattr(monitor, name, value)
+
+    def restart():
+        if monitor._journal_fh:
+            monitor._journal_fh.close()
+        fresh()
+        return monitor.journal_open()
+
+    fresh()
+    monitor.journal_open()
+    yield restart
+    if monitor._journal_fh:
+        monitor._journal_fh.close()
+
+
+def _info(pid):
+    return {"pid": pid, "name": "x", "create_time": "2026-10-19 12:00:00"}
+
+
+def test_unacked_restored_after_restart(monitor, journal):
+    for pid in (1, 2, 3):
+        assert monitor.journal_queue("c", _info(pid))
+    assert not monitor.journal_queue("c", _info(1))     # дубликат
+    monitor.journal_ack("c", [_info(2)])
+    monitor.journal_watermark(123.0)
+    monitor.journal_sync()
+    assert journal() == 123.0
+    assert [i["pid"] for i in monitor.pending["c"]] == [1, 3]
+    assert not monitor.journal_queue("c", _info(2))     # подтверждённое не шлётся повторно
+
+
+def test_unsynced_tail_is_lost_and_torn_line_ignored(monitor, journal):
+    monitor.journal_queue("c", _info(1))
+    monitor.journal_sync()
+    monitor.journal_queue("c", _info(2))                # без journal_sync — не на диске
+    with open(monitor.JOURNAL_FILE, "a", encoding="utf-8") as f:
+        f.write('{"q": "c:9:')
+    journal()
+    assert [i["pid"] for i in monitor.pending["c"]] == [1]
+
+
+def test_compact_keeps_only_open(monitor, journal, monkeypatch):
+    monkeypatch.setattr(monitor, "JOURNAL_COMPACT_BYTES", 1)
+    for pid in range(5):
+        monitor.journal_queue("c", _info(pid))
+    monitor.journal_ack("c", [_info(pid) for pid in range(4)])
+    monitor.journal_sync()                              # файл больше порога — переписан
+    with open(monitor.JOURNAL_FILE, encoding="utf-8") as f:
+        recs = [json.loads(line) for line in f]
+    assert [r["q"] for r in recs if "q" in r] == [monitor.event_id("c", _info(4))]
+    assert len(recs[0]["a"]) == 4
@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+
+@pytest.fixture
+def names(monitor, tmp_path, monkeypatch):
+    monkeypatch.setattr(monitor, "LIST_BLOCK", 4)    # мелкие блоки — чаще деления
+    monkeypatch.setattr(monitor, "dry_run", False)
+    lst = monitor.NameList(str(tmp_path / "list.json"), ["init"])
+    lst.load()
+    return lst
+
+
+def test_blocks_stay_sorted(names):
+    pool = [f"p{k:03d}" for k in range(100)]
+    random.Random(1).shuffle(pool)
+    for n in pool:
+        assert names.add(n)
+    assert not names.add("p050")
+    for n in pool[::3]:
+        assert names.discard(n)
+    expected = sorted(set(pool) - set(pool[::3]) | {"init"})
+    assert list(names) == expected and len(names) == len(expected)
+    assert all(len(b) <= 8 for b in names._blocks)
+    assert names._maxes == [b[-1] for b in names._blocks]
+
+
+def test_page_and_search(monitor, names):
+    for k in range(20):
+        names.add(f"Nginx-{k:02d}")
+    items, pages, count = names.page(0)
+    assert items == [f"Nginx-{k:02d}" for k in range(monitor.LIST_PAGE)]
+    assert count == 21 and pages == 3
+    items, pages, count = names.page(99, "nginx-1")
+    assert count == 10 and pages == 2 and items == ["Nginx-18", "Nginx-19"]
+    names.discard("Nginx-19")                       # кэш страниц сбрасывается
+    assert names.page(1, "nginx-1")[0] == ["Nginx-18"]
+
+
+def test_journal_replayed_after_crash(monitor, names, tmp_path):
+    names.add("a")
+    names.add("b")
+    names.discard("init")
+    with open(names.log_path, "a", encoding="utf-8") as f:
+        f.write('{"+": "hal')                       # недописанная строка
+    again = monitor.NameList(names.path, ["init"])
+    again.load()
+    assert list(again) == ["a", "b"]
+    with open(again.log_path, encoding="utf-8") as f:
+        assert f.read() == ""                       # журнал свёрнут в снимок
@@ -0,0 +1,42 @@
+import collections
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def chat(monitor, monkeypatch):
+    sent = []
+    monkeypatch.setattr(monitor, "broadcast", lambda msgs, on_sent=None: (
+        sent.extend(msgs), {cid: 1 for cid, *_ in msgs})[1])
+    monitor.user_settings["1"] = dict(monitor.DEFAULT_SETTINGS, group_notifications=True,
+                                      group_interval=30, quiet_hours_enabled=True,
+                                      quiet_hours_start="22:00", quiet_hours_end="08:00")
+    yield sent
+    monitor.user_settings.pop("1", None)
+    monitor.pending.pop("1", None)
+
+
+def _info(pid, stamp="2026-10-19 12:00:00"):
+    return {"pid": pid, "name": "x", "create_time": stamp, "cpu": 0.0, "memory_mb": 0.0,
+            "username": "r", "exe": "e", "cmdline": "c"}
+
+
+def test_quiet_hours_follow_replay_clock(monitor, chat):
+    assert monitor.is_quiet("1", datetime(2026, 10, 19, 23, 0))
+    assert not monitor.is_quiet("1", datetime(2026, 10, 19, 12, 0))
+
+
+def test_final_flush_a_day_later(monitor, chat):
+    monitor.pending["1"].append(_info(1))
+    monitor.flush_pending(collections.defaultdict(int), datetime(2026, 10, 20, 12, 0, 3))
+    assert len(chat) == 1
+
+
+def test_anomaly_warmup_uses_replay_clock(monitor, monkeypatch):
+    monkeypatch.setattr(monitor, "_anomaly_started", 1000.0)
+    monkeypatch.setattr(monitor, "anomaly_state", collections.OrderedDict())
+    info = dict(_info(1), name="never-seen-before", create_ts=1001.0)
+    assert monitor.anomaly_observe(info, now=1001.0) is None
+    info = dict(info, name="also-never-seen", create_ts=1000.0 + monitor.ANOMALY_WARMUP + 1)
+    assert monitor.anomaly_observe(info, now=1000.0 + monitor.ANOMALY_WARMUP + 1)
@@ -0,0 +1,76 @@
+import pytest
+
+import ringbuf
+
+
+def _info(k):
+    return {"pid": k, "name": f"proc{k}", "username": "root", "cmdline": f"run --n {k}",
+            "create_ts": 1_700_000_000.0 + k, "cpu": 1.25, "memory_mb": 10.5, "unit": "cron.service"}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "events.ring")
+
+
+def test_round_trip(path):
+    ring = ringbuf.Ring(path, 8, writable=True)
+    seq = ring.append(_info(1), ringbuf.FLAG_NOTIFIED, seen=5.0)
+    rec = ringbuf.Ring(path).get(seq)
+    assert rec["pid"] == 1 and rec["name"] == "proc1" and rec["group"] == "unit:cron.service"
+    assert rec["seen"] == 5.0 and rec["flags"] == ringbuf.FLAG_NOTIFIED
+    assert rec["cpu"] == pytest.approx(1.2, abs=0.1) and rec["memory_mb"] == 10.5
+
+
+def test_wraparound_and_reopen(path):
+    ring = ringbuf.Ring(path, 4, writable=True)
+    for k in range(1, 11):
+        ring.append(_info(k), seen=float(k))
+    assert ring.get(6) is None                      # вытеснена
+    assert [r["pid"] for r in ring.since(0)] == [7, 8, 9, 10]
+    assert [r["pid"] for r in ring.latest(2)] == [10, 9]
+    assert [r["pid"] for r in ring.latest(10, after=8.5)] == [10, 9]
+    assert [r["pid"] for r in ring.latest(10, words=["proc8"])] == [8]
+    ring.close()
+    again = ringbuf.Ring(path, 4, writable=True)    # та же геометрия — нумерация продолжается
+    assert again.head == 10
+
+
+def test_geometry_change_replaces_file(path):
+    old = ringbuf.Ring(path, 4, writable=True)
+    old.append(_info(1))
+    new = ringbuf.Ring(path, 8, writable=True)
+    assert new.head == 0 and new.slots == 8
+    assert ringbuf.Ring(path).slots == 8
+
+
+def test_torn_slot_is_skipped(path):
+    ring = ringbuf.Ring(path, 4, writable=True)
+    seq = ring.append(_info(1))
+    off = ringbuf.HEADER_SIZE + (seq - 1) % ring.slots * ringbuf.RECORD.size
+    ringbuf._SEQ.pack_into(ring.map, off, 0)       # писатель на середине записи
+    assert ring.get(seq) is None
+    assert ring.since(0) == []
+
+
+@pytest.mark.parametrize("content", [b"", b"PMRB", b"NOPE" + b"\0" * 60])
+def test_not_a_ring(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+    with pytest.raises((ringbuf.RingError, ValueError)):
+        ringbuf.Ring(path)
+
+
+def test_truncated_file(path):
+    ringbuf.Ring(path, 8, writable=True).close()
+    with open(path, "r+b") as f:
+        f.truncate(ringbuf.HEADER_SIZE + ringbuf.RECORD.size)
+    with pytest.raises(ringbuf.RingError):
+        ringbuf.Ring(path)
+
+
+def test_recent_escapes_names(monitor):
+    rec = dict(_info(1), name="a<b>", username="<u>", group="unit:<x>", host="", seen=5.0,
+               flags=0)
+    text = monitor.fmt_recent([rec], "t")
+    assert "a&lt;b&gt;" in text and "&lt;u&gt;" in text and "unit:&lt;x&gt;" in text
@@ -0,0 +1,47 @@
+import pytest
+
+
+@pytest.fixture
+def router(monitor):
+    r = monitor.Router("test")
+    calls = []
+    r.add(("/help", "/h"), lambda *a: calls.append(("help",) + a))
+    r.prefix("wl_")(lambda *a: calls.append(("wl",) + a))
+    r.prefix("wl_page_")(lambda *a: calls.append(("page",) + a))
+    return r, calls
+
+
+def test_exact_and_synonyms(router):
+    r, calls = router
+    assert r.resolve("/h")[0] == "/help" and r.resolve("/h")[2] is None
+    assert r.dispatch("/h", "cid")
+    assert calls == [("help", "cid")]
+
+
+def test_longest_prefix_wins(router):
+    r, calls = router
+    assert r.dispatch("wl_page_3", "cid")
+    assert r.dispatch("wl_nginx", "cid")
+    assert calls == [("page", "cid", "3"), ("wl", "cid", "nginx")]
+    assert not r.dispatch("w", "cid") and not r.dispatch("zz", "cid")
+
+
+def test_cb_pack_round_trip(monitor):
+    assert monitor.cb_pack("ign_nginx") == "ign_nginx"
+    long = "ign_" + "x" * 200
+    packed = monitor.cb_pack(long)
+    assert len(packed.encode()) <= monitor.CB_MAX_BYTES
+    assert packed == monitor.cb_pack(long)          # тот же токен, без новых записей
+    assert monitor.cb_unpack(packed) == long
+    assert monitor.cb_unpack("ign_nginx") == "ign_nginx"
+    assert monitor.cb_unpack("~1:unknown") is None and monitor.cb_unpack("~9:x") is None
+    # строка, похожая на токен, тоже упаковывается, а не принимается за токен
+    assert monitor.cb_unpack(monitor.cb_pack("~1:abc")) == "~1:abc"
+
+
+def test_cb_tokens_lru(monitor, monkeypatch):
+    monkeypatch.setattr(monitor, "CB_TOKENS_MAX", 2)
+    monkeypatch.setattr(monitor, "_cb_tokens", type(monitor._cb_tokens)())
+    a, b, c = (monitor.cb_pack(k * 100) for k in "abc")
+    assert monitor.cb_unpack(a) is None
+    assert monitor.cb_unpack(b) == "b" * 100 and monitor.cb_unpack(c) == "c" * 100
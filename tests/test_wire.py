@@ -0,0 +1,52 @@
+import zlib
+
+import pytest
+
+import wire
+
+
+def _events(n=50):
+    return [{"pid": 1000 + k, "create_ts": 1_700_000_000.25 + k, "cpu": 1.5, "memory_mb": 12.3,
+             "name": f"proc{k % 3}", "exe": "/usr/bin/x", "cmdline": "x --flag",
+             "username": "root", "status": "running", "cgroup": "", "unit": "nginx.service",
+             "container": "", "container_id": "", "runtime": ""}
+            for k in range(n)]
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_round_trip(compress):
+    events = _events()
+    out = wire.decode(wire.encode(events, compress=compress))
+    assert len(out) == len(events)
+    for a, b in zip(events, out):
+        for field in wire.STR_FIELDS:
+            assert b[field] == a[field]
+        assert b["pid"] == a["pid"]
+        assert b["create_ts"] == pytest.approx(a["create_ts"], abs=1e-3)
+        assert b["cpu"] == a["cpu"] and b["memory_mb"] == a["memory_mb"]
+
+
+def test_empty_batch():
+    assert wire.decode(wire.encode([])) == []
+    assert wire.peek(wire.encode([])) == (wire.VERSION, 0)
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_truncated(compress):
+    frame = wire.encode(_events(), compress=compress)
+    for cut in (3, wire.HEADER.size, len(frame) // 2, len(frame) - 1):
+        with pytest.raises(wire.WireError):
+            wire.decode(frame[:cut])
+
+
+def test_bad_magic():
+    with pytest.raises(wire.WireError):
+        wire.decode(b"XXX" + wire.encode(_events())[3:])
+
+
+def test_decompression_cap(monkeypatch):
+    monkeypatch.setattr(wire, "BODY_MAX", 1024)
+    body = zlib.compress(b"\0" * 1_000_000)
+    frame = wire.HEADER.pack(wire.MAGIC, wire.VERSION, wire.FLAG_ZLIB, 1, len(body)) + body
+    with pytest.raises(wire.WireError):
+        wire.decode(frame)
@@ -0,0 +1,168 @@
+"""
+Компактный двоичный формат событий «новый процесс» для Process Monitor Pro.
+
+Пачка (frame):
+  заголовок, 13 байт, big-endian: магия b"PMW", версия (u8), флаги (u8),
+                                  число событий (u32), длина тела (u32)
+  тело (при FLAG_ZLIB — сжатое zlib):
+    varint  базовое время пачки, мс
+    varint  число строк, затем строки: varint длина + UTF-8
+    varint  число событий, затем на событие:
+      varint pid, zigzag-varint (create_ts − база) в мс,
+      varint cpu×10, varint memory_mb×10,
+      по varint на каждое строковое поле STR_FIELDS: индекс строки + 1 (0 — пусто)
+Строки (имена, пользователи, пути, юниты) интернируются в пределах пачки:
+повторяющееся имя занимает байт-два. create_time (строка для людей)
+не передаётся — восстанавливается из create_ts при декодировании.
+Поля события, которых нет в формате, не передаются.
+
+Модуль не зависит от бота: его используют monitor.py и офлайн-утилиты.
+"""
+
+import struct
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+MAGIC   = b"PMW"
+VERSION = 1
+FLAG_ZLIB = 0x01
+
+HEADER = struct.Struct(">3sBBII")
+
+STR_FIELDS = ("name", "exe", "cmdline", "username", "status",
+              "cgroup", "unit", "container", "container_id", "runtime")
+
+ZLIB_MIN   = 512     # тело меньше этого не сжимаем — выигрыша нет
+ZLIB_LEVEL = 1       # быстрый уровень: основной выигрыш даёт интернирование
+BODY_MAX   = 64 * 1024**2   # предел распакованного тела: пачка от агента не раздует память
+
+
+class WireError(ValueError):
+    """Пачка повреждена или неизвестной версии."""
+
+
+def _varint(out: bytearray, n: int) -> None:
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    n = shift = 0
+    while True:
+        try:
+            b = buf[pos]
+        except IndexError:
+            raise WireError("обрыв varint") from None
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def encode(events: Iterable[Dict], compress: bool = True) -> bytes:
+    """Пачка событий (словари get_proc_info) → bytes."""
+    events = list(events)
+    base = min((int(e.get("create_ts", 0) * 1000) for e in events), default=0)
+    strings: Dict[str, int] = {}
+    body = bytearray()
+    for e in events:
+        _varint(body, int(e["pid"]))
+        delta = int(e.get("create_ts", 0) * 1000) - base
+        _varint(body, delta << 1 if delta >= 0 else (-delta << 1) - 1)
+        _varint(body, max(0, round(e.get("cpu", 0.0) * 10)))
+        _varint(body, max(0, round(e.get("memory_mb", 0.0) * 10)))
+        for field in STR_FIELDS:
+            value = e.get(field)
+            if not value:
+                body.append(0)
+                continue
+            idx = strings.get(value)
+            if idx is None:
+                idx = strings[value] = len(strings)
+            _varint(body, idx + 1)
+    out = bytearray()
+    _varint(out, base)
+    _varint(out, len(strings))
+    for s in strings:   # dict хранит порядок вставки — он же порядок индексов
+        raw = s.encode("utf-8", "surrogateescape")
+        _varint(out, len(raw))
+        out += raw
+    _varint(out, len(events))
+    out += body
+    flags = 0
+    if compress and len(out) >= ZLIB_MIN:
+        out, flags = zlib.compress(bytes(out), ZLIB_LEVEL), FLAG_ZLIB
+    return HEADER.pack(MAGIC, VERSION, flags, len(events), len(out)) + bytes(out)
+
+
+def peek(frame: bytes) -> Tuple[int, int]:
+    """(версия, число событий) без разбора тела."""
+    if len(frame) < HEADER.size:
+        raise WireError("короткий заголовок")
+    magic, version, _, count, _ = HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise WireError("не пачка событий")
+    return version, count
+
+
+def decode(frame: bytes) -> List[Dict]:
+    """bytes → список событий в том же виде, что отдаёт get_proc_info."""
+    version, _ = peek(frame)
+    if version != VERSION:
+        raise WireError(f"неизвестная версия {version}")
+    _, _, flags, count, length = HEADER.unpack_from(frame)
+    body = frame[HEADER.size:HEADER.size + length]
+    if len(body) != length:
+        raise WireError("обрыв тела")
+    if flags & FLAG_ZLIB:
+        d = zlib.decompressobj()
+        try:
+            body = d.decompress(body, BODY_MAX)
+        except zlib.error as e:
+            raise WireError(str(e)) from None
+        if d.unconsumed_tail:
+            raise WireError(f"распакованное тело больше {BODY_MAX} байт")
+        if not d.eof:
+            raise WireError("обрыв сжатого тела")
+    base, pos = _read_varint(body, 0)
+    n, pos = _read_varint(body, pos)
+    strings = [""]
+    for _ in range(n):
+        size, pos = _read_varint(body, pos)
+        if pos + size > len(body):
+            raise WireError("обрыв строки")
+        strings.append(body[pos:pos + size].decode("utf-8", "surrogateescape"))
+        pos += size
+    n, pos = _read_varint(body, pos)
+    if n != count:
+        raise WireError("число событий не совпадает с заголовком")
+    events = []
+    stamps: Dict[int, str] = {}   # секунда → create_time: в пачке их немного
+    nstr = len(strings)
+    for _ in range(n):
+        pid, pos = _read_varint(body, pos)
+        delta, pos = _read_varint(body, pos)
+        cpu, pos = _read_varint(body, pos)
+        mem, pos = _read_varint(body, pos)
+        ts = (base + (delta >> 1 if not delta & 1 else -((delta + 1) >> 1))) / 1000
+        sec = int(ts)
+        stamp = stamps.get(sec)
+        if stamp is None:
+            stamp = stamps[sec] = datetime.fromtimestamp(sec).strftime("%Y-%m-%d %H:%M:%S")
+        e = {"pid": pid, "create_ts": ts, "create_time": stamp,
+             "cpu": cpu / 10, "memory_mb": mem / 10}
+        for field in STR_FIELDS:
+            idx = body[pos] if pos < len(body) else 0x80   # индексы почти всегда в один байт
+            if idx < 0x80:
+                pos += 1
+            else:
+                idx, pos = _read_varint(body, pos)
+            if idx >= nstr:
+                raise WireError("ссылка на несуществующую строку")
+            e[field] = strings[idx]
+        events.append(e)
+    return events